@@ -1,12 +1,99 @@
 import re
+import copy
+import time
+import hashlib
+import threading
+from collections import OrderedDict
 
 from rest_framework import authentication, permissions
 from rest_framework import exceptions
 from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
 import jwt
 
 from api.models import User
 
+class TTLCache(object):
+    """Thread safe mapping that keeps at most `maxsize` entries, each for at most `ttl` seconds.
+
+    The least recently used entry is evicted when full.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        with self.lock:
+            self.entries[key] = (value, time.monotonic() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+# Verified JWT payloads by SHA-256 of the token, so the RS256 signature of
+# the long lived service token is checked once every few minutes.
+jwt_payloads = TTLCache(maxsize=256, ttl=5 * 60)
+
+# Field values of users by random slug, (names, values). A user updated in
+# another process can be seen as it was for up to a minute.
+users_by_slug = TTLCache(maxsize=1024, ttl=60)
+
+def forget_user(user):
+    """Drop `user` from the slug cache, call whenever a user is updated"""
+    for slug in user.random_slugs or []:
+        users_by_slug.delete(slug)
+
+def get_user_by_slug(slug):
+    """The user with `slug`, a new instance for every call.
+
+    Only field values are cached, so concurrent requests never share, and
+    never see each other's changes to, one instance.
+    """
+    cached = users_by_slug.get(slug)
+    if cached is not None:
+        names, values = cached
+        return User.from_db(DEFAULT_DB_ALIAS, names, copy.deepcopy(values))
+    # Served by the GIN index users_random_slugs_gin
+    user = User.objects.get(random_slugs__contains=[slug])
+    names = [field.attname for field in User._meta.concrete_fields]
+    users_by_slug.set(slug, (names, copy.deepcopy([getattr(user, name) for name in names])))
+    return user
+
+def decode_jwt(token):
+    key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    payload = jwt_payloads.get(key)
+    if payload is None:
+        payload = jwt.decode(token, settings.JWT_PUB_KEY, algorithms=["RS256"])
+        ttl = None
+        if 'exp' in payload:
+            # Never serve a payload past the token's own expiry
+            ttl = max(0, payload['exp'] - time.time())
+        jwt_payloads.set(key, payload, ttl)
+    return payload
+
 class CognomaAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
         if 'HTTP_AUTHORIZATION' not in request.META:
@@ -27,14 +114,14 @@ class CognomaAuthentication(authentication.BaseAuthentication):
 
         if auth_type == 'Bearer':
             try:
-                user = User.objects.get(random_slugs__contains=[token])
+                user = get_user_by_slug(token)
             except User.DoesNotExist:
                 raise exceptions.AuthenticationFailed('User not found')
 
             return (user, {'type': auth_type})
         elif auth_type == 'JWT':
             try:
-                payload = jwt.decode(token, settings.JWT_PUB_KEY, algorithms=["RS256"])
+                payload = decode_jwt(token)
             except:
                 return None
 
@@ -81,7 +168,7 @@ class ClassifierRetrievePermission(permissions.BasePermission):
         elif request.auth['type'] == 'JWT' and request.auth['service'] == 'core':
             return True
         else:
-            return obj.user == request.user
+            return obj.user_id == request.user.id
 
 class MLWorkerOnlyPermission(permissions.BasePermission):
     def has_permission(self, request, view):
@@ -0,0 +1,491 @@
+import bz2
+import csv
+import hashlib
+import io
+import itertools
+import random
+import re
+import time
+
+import numpy as np
+from django.core.management.base import CommandError
+from django.db import connection, transaction
+
+# Number of rows buffered in memory before each COPY round-trip.
+DEFAULT_COPY_CHUNK_SIZE = 100000
+
+# Number of sample rows of the mutation matrix parsed into one NumPy block.
+# With ~20k genes a block of 500 samples is a ~10MB int8 array.
+DEFAULT_PARSE_BLOCK_SIZE = 500
+
+
+def file_digest(path):
+    """SHA-256 hex digest of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as data_file:
+        for block in iter(lambda: data_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def iter_diseases(disease_path):
+    """Yield (acronym, name) rows from diseases.tsv"""
+    with open(disease_path) as disease_file:
+        for row in csv.DictReader(disease_file, delimiter='\t'):
+            yield (row['acronym'], row['disease'])
+
+
+def iter_samples(sample_path):
+    """Yield (sample_id, acronym, gender, age_diagnosed) rows from samples.tsv"""
+    with open(sample_path) as sample_file:
+        for row in csv.DictReader(sample_file, delimiter='\t'):
+            yield (row['sample_id'],
+                   row['acronym'],
+                   row['gender'] or None,
+                   row['age_diagnosed'] or None)
+
+
+def iter_genes(gene_path):
+    """Yield (entrez_gene_id, symbol, description, chromosome, gene_type, synonyms, aliases) rows from genes.tsv"""
+    with open(gene_path) as gene_file:
+        for row in csv.DictReader(gene_file, delimiter='\t'):
+            yield (row['entrez_gene_id'],
+                   row['symbol'],
+                   row['description'],
+                   row['chromosome'] or None,
+                   row['gene_type'],
+                   row['synonyms'].split('|') or None,
+                   row['aliases'].split('|') or None)
+
+
+def iter_mutations(mutation_path):
+    """Stream (gene_id, sample_id) pairs for every mutated cell of the matrix.
+
+    The bz2 file is decompressed and parsed one sample row at a time so memory
+    use does not grow with the size of the matrix.
+    """
+    with bz2.open(mutation_path, 'rt') as mutation_file:
+        yield from parse_mutations(mutation_file)
+
+
+def parse_mutations(mutation_file):
+    """Yield (gene_id, sample_id) pairs from an open mutation matrix file"""
+    mutation_reader = csv.reader(mutation_file, delimiter='\t')
+    gene_ids = next(mutation_reader)[1:]
+    for row in mutation_reader:
+        sample_id = row[0]
+        for entrez_gene_id, mutation_status in zip(gene_ids, row[1:]):
+            if mutation_status == '1':
+                yield (entrez_gene_id, sample_id)
+
+
+def iter_mutations_vectorized(mutation_path, block_size=DEFAULT_PARSE_BLOCK_SIZE):
+    """Vectorized equivalent of `iter_mutations`"""
+    with bz2.open(mutation_path, 'rt') as mutation_file:
+        yield from parse_mutations_vectorized(mutation_file, block_size)
+
+
+def parse_mutations_vectorized(mutation_file, block_size=DEFAULT_PARSE_BLOCK_SIZE):
+    """Vectorized equivalent of `parse_mutations`.
+
+    Sample rows are read in blocks of `block_size`, parsed into a single int8
+    array in C and the mutated cells located with `np.nonzero`, so the only
+    per-cell Python work left is for the cells that are actually mutated.
+    Pairs are yielded in the same order as `parse_mutations`.
+    """
+    gene_ids = mutation_file.readline().rstrip('\r\n').split('\t')[1:]
+    number_of_genes = len(gene_ids)
+
+    while True:
+        lines = list(itertools.islice(mutation_file, block_size))
+        if not lines:
+            break
+
+        sample_ids = []
+        values = []
+        for line in lines:
+            sample_id, _, row_values = line.rstrip('\r\n').partition('\t')
+            # A block only checks its total cell count, so a short row
+            # followed by a long one would shift cells between samples.
+            if row_values.count('\t') != number_of_genes - 1:
+                raise ValueError('Malformed mutation matrix row for sample ' + sample_id)
+            sample_ids.append(sample_id)
+            values.append(row_values)
+
+        mutated = _parse_block(values, len(sample_ids) * number_of_genes)
+        if mutated is None:
+            raise ValueError('Malformed mutation matrix block starting at sample ' + sample_ids[0])
+
+        sample_indexes, gene_indexes = np.divmod(np.flatnonzero(mutated), number_of_genes)
+        for sample_index, gene_index in zip(sample_indexes.tolist(), gene_indexes.tolist()):
+            yield (gene_ids[gene_index], sample_ids[sample_index])
+
+
+def _parse_block(values, number_of_cells):
+    """Parse tab separated matrix rows into a flat boolean array of cells equal to 1.
+
+    The matrix is made of single character 0/1 cells, in which case every
+    other byte of the block is a value and the parse is a strided view. Any
+    other layout falls back to NumPy's text parser. Returns None when the
+    block does not contain `number_of_cells` cells.
+    """
+    text = '\t'.join(values)
+    raw = text.encode('ascii')
+    if len(raw) == 2 * number_of_cells - 1:
+        buffer = np.frombuffer(raw, dtype=np.uint8)
+        if (buffer[1::2] == ord('\t')).all():
+            return buffer[::2] == ord('1')
+
+    try:
+        block = np.fromstring(text, dtype=np.int8, sep='\t')
+    except ValueError:
+        return None
+    if block.size != number_of_cells:
+        return None
+    return block == 1
+
+
+def random_matrix(number_of_samples, number_of_genes, mutation_rate=0.01, seed=0):
+    """Text of a synthetic mutation matrix, as in mutation-matrix.tsv, for tests and benchmarks"""
+    rng = random.Random(seed)
+    lines = ['\t'.join(['sample_id'] + [str(gene_id) for gene_id in range(1, number_of_genes + 1)])]
+    for sample_number in range(number_of_samples):
+        statuses = ['1' if rng.random() < mutation_rate else '0' for _ in range(number_of_genes)]
+        lines.append('\t'.join(['TCGA-{0:06d}'.format(sample_number)] + statuses))
+    return '\n'.join(lines) + '\n'
+
+
+def _copy_escape(value):
+    """Format a single value for PostgreSQL's COPY text format"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, (list, tuple)):
+        value = '{' + ','.join(
+            '"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"'
+            for item in value) + '}'
+    return (str(value)
+            .replace('\\', '\\\\')
+            .replace('\t', '\\t')
+            .replace('\n', '\\n')
+            .replace('\r', '\\r'))
+
+
+def copy_rows(table, columns, rows, chunk_size=DEFAULT_COPY_CHUNK_SIZE, cursor=None):
+    """Feed an iterable of row tuples to `COPY table (columns) FROM STDIN`.
+
+    Rows are buffered in chunks of at most `chunk_size` so arbitrarily large
+    generators can be loaded with bounded memory. Returns the number of rows
+    copied.
+    """
+    if cursor is None:
+        with connection.cursor() as cursor:
+            return copy_rows(table, columns, rows, chunk_size, cursor)
+
+    sql = 'COPY {table} ({columns}) FROM STDIN'.format(
+        table=connection.ops.quote_name(table),
+        columns=', '.join(connection.ops.quote_name(column) for column in columns))
+
+    def flush(buffer):
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+
+    count = 0
+    buffer = io.StringIO()
+    buffered = 0
+    for row in rows:
+        buffer.write('\t'.join(_copy_escape(value) for value in row))
+        buffer.write('\n')
+        buffered += 1
+        count += 1
+        if buffered >= chunk_size:
+            flush(buffer)
+            buffer = io.StringIO()
+            buffered = 0
+    if buffered:
+        flush(buffer)
+
+    return count
+
+
+def sync_rows(table, columns, key_columns, rows, chunk_size=DEFAULT_COPY_CHUNK_SIZE, delete=None):
+    """Make `table` hold exactly `rows`, touching only the rows that differ.
+
+    The incoming rows are copied into a temporary table and diffed against
+    `table` on `key_columns`: missing rows are inserted, rows whose other
+    columns changed are updated and rows absent from the input are deleted.
+    When given, `delete` is called with the key tuples of the rows to delete
+    instead of a plain DELETE, ex so that the ORM cascades to the rows that
+    reference them. Must run inside a transaction. Returns a dict of
+    received, inserted, updated and deleted row counts.
+    """
+    quote = connection.ops.quote_name
+    staging = quote(table + '_incoming')
+    target = quote(table)
+    value_columns = [column for column in columns if column not in key_columns]
+    keys_match = ' AND '.join('{target}.{column} = {staging}.{column}'.format(
+        target=target, staging=staging, column=quote(column)) for column in key_columns)
+    counts = {}
+
+    with connection.cursor() as cursor:
+        cursor.execute('CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS '
+                       'SELECT {columns} FROM {target} WITH NO DATA'.format(
+                           staging=staging,
+                           target=target,
+                           columns=', '.join(quote(column) for column in columns)))
+        counts['received'] = copy_rows(table + '_incoming', columns, rows, chunk_size, cursor)
+        cursor.execute('ANALYZE {staging}'.format(staging=staging))
+
+        absent = 'FROM {target} WHERE NOT EXISTS (SELECT 1 FROM {staging} WHERE {keys_match})'.format(
+            target=target, staging=staging, keys_match=keys_match)
+        if delete is None:
+            cursor.execute('DELETE ' + absent)
+            counts['deleted'] = cursor.rowcount
+        else:
+            cursor.execute('SELECT {keys} '.format(
+                keys=', '.join('{target}.{column}'.format(target=target, column=quote(column))
+                               for column in key_columns)) + absent)
+            keys = cursor.fetchall()
+            if keys:
+                delete(keys)
+            counts['deleted'] = len(keys)
+
+        if value_columns:
+            cursor.execute('UPDATE {target} SET {assignments} FROM {staging} '
+                           'WHERE {keys_match} AND ({target_values}) IS DISTINCT FROM ({staging_values})'.format(
+                               target=target,
+                               staging=staging,
+                               keys_match=keys_match,
+                               assignments=', '.join('{column} = {staging}.{column}'.format(
+                                   staging=staging, column=quote(column)) for column in value_columns),
+                               target_values=', '.join('{target}.{column}'.format(
+                                   target=target, column=quote(column)) for column in value_columns),
+                               staging_values=', '.join('{staging}.{column}'.format(
+                                   staging=staging, column=quote(column)) for column in value_columns)))
+            counts['updated'] = cursor.rowcount
+        else:
+            counts['updated'] = 0
+
+        cursor.execute('INSERT INTO {target} ({columns}) SELECT {columns} FROM {staging} '
+                       'WHERE NOT EXISTS (SELECT 1 FROM {target} WHERE {keys_match})'.format(
+                           target=target,
+                           staging=staging,
+                           keys_match=keys_match,
+                           columns=', '.join(quote(column) for column in columns)))
+        counts['inserted'] = cursor.rowcount
+
+        cursor.execute('DROP TABLE {staging}'.format(staging=staging))
+
+    return counts
+
+
+class ShadowTables(object):
+    """Reload a set of tables into shadow copies and swap them in atomically.
+
+    Shadow tables are created without indexes or constraints so they can be
+    bulk loaded cheaply. `build_indexes` then recreates the live tables'
+    indexes, primary keys and foreign keys on the shadows in one pass and
+    analyzes them, and `swap` replaces the live tables with the shadows in a
+    single short transaction, so readers see either the old or the new rows.
+    Foreign keys from tables outside the set are pointed at the new tables.
+    """
+
+    suffix = '__shadow'
+
+    def __init__(self, tables):
+        self.tables = tables
+        self.quote = connection.ops.quote_name
+        self.renames = []
+
+    def shadow(self, table):
+        return table + self.suffix
+
+    def create(self):
+        with connection.cursor() as cursor:
+            for table in self.tables:
+                cursor.execute('DROP TABLE IF EXISTS {shadow} CASCADE'.format(
+                    shadow=self.quote(self.shadow(table))))
+                cursor.execute('CREATE TABLE {shadow} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'.format(
+                    shadow=self.quote(self.shadow(table)), table=self.quote(table)))
+
+    def drop(self):
+        with connection.cursor() as cursor:
+            for table in self.tables:
+                cursor.execute('DROP TABLE IF EXISTS {shadow} CASCADE'.format(
+                    shadow=self.quote(self.shadow(table))))
+
+    def _temporary_name(self, table, kind, original):
+        # Index names are schema wide, so the shadow copies need their own
+        # names until the live tables are dropped.
+        temporary = '{table}{suffix}_{number}'.format(table=table, suffix=self.suffix, number=len(self.renames))
+        self.renames.append((table, kind, original, temporary))
+        return temporary
+
+    def build_indexes(self):
+        with connection.cursor() as cursor:
+            for table in self.tables:
+                shadow = self.shadow(table)
+
+                # Plain indexes, i.e. those not backing a constraint
+                cursor.execute("""
+                    SELECT index_class.relname, pg_get_indexdef(index_class.oid)
+                    FROM pg_index
+                    JOIN pg_class index_class ON index_class.oid = pg_index.indexrelid
+                    WHERE pg_index.indrelid = %s::regclass
+                      AND NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conindid = pg_index.indexrelid)
+                """, [table])
+                for name, definition in cursor.fetchall():
+                    match = re.match(r'^(CREATE (?:UNIQUE )?INDEX )\S+ ON (?:ONLY )?\S+( .*)$', definition)
+                    cursor.execute('{create}{name} ON {shadow}{rest}'.format(
+                        create=match.group(1),
+                        name=self.quote(self._temporary_name(table, 'index', name)),
+                        shadow=self.quote(shadow),
+                        rest=match.group(2)))
+
+                # Primary keys, unique and foreign key constraints
+                cursor.execute("""
+                    SELECT conname, contype, pg_get_constraintdef(oid)
+                    FROM pg_constraint
+                    WHERE conrelid = %s::regclass AND contype IN ('p', 'u', 'f')
+                    ORDER BY contype DESC
+                """, [table])
+                for name, constraint_type, definition in cursor.fetchall():
+                    if constraint_type == 'f':
+                        references = re.compile(r'REFERENCES (?:\w+\.)?"?(\w+)"?\(')
+                        referenced = references.search(definition).group(1)
+                        if referenced not in self.tables:
+                            continue
+                        definition = references.sub(
+                            'REFERENCES ' + self.quote(self.shadow(referenced)) + '(', definition, count=1)
+                    cursor.execute('ALTER TABLE {shadow} ADD CONSTRAINT {name} {definition}'.format(
+                        shadow=self.quote(shadow),
+                        name=self.quote(self._temporary_name(table, 'constraint', name)),
+                        definition=definition))
+
+                cursor.execute('ANALYZE {shadow}'.format(shadow=self.quote(shadow)))
+
+    def swap(self):
+        tables = ', '.join(self.quote(table) for table in self.tables)
+        with transaction.atomic(), connection.cursor() as cursor:
+            # Pending deferred checks would block the ALTER TABLEs below.
+            cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+            cursor.execute('LOCK TABLE {tables} IN ACCESS EXCLUSIVE MODE'.format(tables=tables))
+
+            # Foreign keys from outside the set follow the table, not its name,
+            # so they are dropped here and recreated against the new tables.
+            cursor.execute("""
+                SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+                FROM pg_constraint
+                WHERE contype = 'f'
+                  AND confrelid = ANY(%s::regclass[])
+                  AND NOT conrelid = ANY(%s::regclass[])
+            """, [self.tables, self.tables])
+            external_foreign_keys = cursor.fetchall()
+            for referencing_table, name, _ in external_foreign_keys:
+                cursor.execute('ALTER TABLE {table} DROP CONSTRAINT {name}'.format(
+                    table=referencing_table, name=self.quote(name)))
+
+            # Sequences owned by the live tables (ex. mutations.id) move to the shadows.
+            for table in self.tables:
+                for field in connection.introspection.get_table_description(cursor, table):
+                    cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [table, field.name])
+                    sequence = cursor.fetchone()[0]
+                    if sequence:
+                        cursor.execute('ALTER SEQUENCE {sequence} OWNED BY {shadow}.{column}'.format(
+                            sequence=sequence,
+                            shadow=self.quote(self.shadow(table)),
+                            column=self.quote(field.name)))
+
+            cursor.execute('DROP TABLE {tables}'.format(tables=tables))
+
+            for table in self.tables:
+                cursor.execute('ALTER TABLE {shadow} RENAME TO {table}'.format(
+                    shadow=self.quote(self.shadow(table)), table=self.quote(table)))
+            for table, kind, original, temporary in self.renames:
+                if kind == 'index':
+                    cursor.execute('ALTER INDEX {temporary} RENAME TO {original}'.format(
+                        temporary=self.quote(temporary), original=self.quote(original)))
+                else:
+                    cursor.execute('ALTER TABLE {table} RENAME CONSTRAINT {temporary} TO {original}'.format(
+                        table=self.quote(table), temporary=self.quote(temporary), original=self.quote(original)))
+
+            for referencing_table, name, definition in external_foreign_keys:
+                cursor.execute('ALTER TABLE {table} ADD CONSTRAINT {name} {definition}'.format(
+                    table=referencing_table, name=self.quote(name), definition=definition))
+
+
+class ForeignKeyResolver(object):
+    """Resolves foreign key values from the data files with a single query.
+
+    Every key of `model` is read once into memory keyed by the string form of
+    `field` (the primary key by default). Values that cannot be resolved are
+    collected instead of raising so they can all be reported together. Pass
+    `table` to read the keys from a table other than the model's own, such as
+    its shadow table.
+    """
+
+    def __init__(self, model, field=None, table=None):
+        self.model = model
+        self.field = field or model._meta.pk.name
+        if table is None:
+            pairs = model.objects.values_list(self.field, 'pk')
+        else:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT {field}, {pk} FROM {table}'.format(
+                    field=connection.ops.quote_name(model._meta.get_field(self.field).column),
+                    pk=connection.ops.quote_name(model._meta.pk.column),
+                    table=connection.ops.quote_name(table)))
+                pairs = cursor.fetchall()
+        self.lookup = {str(value): pk for value, pk in pairs}
+        self.missing = set()
+
+    def resolve(self, value):
+        try:
+            return self.lookup[value]
+        except KeyError:
+            self.missing.add(value)
+            return None
+
+    def raise_for_missing(self):
+        if self.missing:
+            raise CommandError('Unknown {model} {field} values: {values}'.format(
+                model=self.model.__name__,
+                field=self.field,
+                values=', '.join(sorted(self.missing))))
+
+
+def resolve_rows(rows, resolvers):
+    """Resolve foreign key columns of `rows`, dropping rows with unknown values.
+
+    `resolvers` maps column indexes to the `ForeignKeyResolver` for that
+    column; other columns are passed through untouched.
+    """
+    for row in rows:
+        row = list(row)
+        resolved = True
+        for index, resolver in resolvers.items():
+            row[index] = resolver.resolve(row[index])
+            if row[index] is None:
+                resolved = False
+        if resolved:
+            yield row
+
+
+class LoadTimer(object):
+    """Context manager that reports rows/sec for a single table load"""
+
+    def __init__(self, table, enabled=True):
+        self.table = table
+        self.enabled = enabled
+        self.rows = 0
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None or not self.enabled:
+            return
+        elapsed = time.time() - self.started
+        rate = self.rows / elapsed if elapsed > 0 else float('inf')
+        print('{table}: loaded {rows} rows in {elapsed:.2f}s ({rate:.0f} rows/sec)'.format(
+            table=self.table, rows=self.rows, elapsed=elapsed, rate=rate))
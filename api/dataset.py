@@ -0,0 +1,35 @@
+import time
+import threading
+
+from django.conf import settings
+from django.db.models import Max
+
+from api.models import DatasetFile
+
+lock = threading.Lock()
+# (time read, version) of the last version() read from the database
+last_read = None
+
+def read_version():
+    """The dataset version from the database, which version() then returns until it goes stale"""
+    global last_read
+    loaded_at = DatasetFile.objects.aggregate(loaded_at=Max('loaded_at'))['loaded_at']
+    with lock:
+        last_read = (time.time(), loaded_at)
+    return loaded_at
+
+def version():
+    """Version stamp of the loaded dataset: when loaddata last changed it.
+
+    loaddata updates the DatasetFile of every file it loads, so anything
+    derived from diseases, samples, genes or mutations stays valid for as
+    long as this does. None when loaddata has never recorded a load.
+
+    Each process reads it at most every DATASET_VERSION_CACHE_SECONDS, so a
+    new load is picked up that long after it commits.
+    """
+    with lock:
+        read = last_read
+    if read is not None and time.time() - read[0] < settings.DATASET_VERSION_CACHE_SECONDS:
+        return read[1]
+    return read_version()
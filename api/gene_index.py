@@ -0,0 +1,121 @@
+import heapq
+import bisect
+
+from django.db import connection
+
+from api.models import Gene
+from api.versioned_index import VersionedIndex
+from api import dataset
+
+FIELDS = ['entrez_gene_id', 'symbol', 'description', 'chromosome', 'gene_type', 'synonyms', 'aliases']
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 100
+
+# cognoma_gene_terms() joins a gene's upper cased synonyms and aliases as
+# |TERM|TERM|, so `LIKE '%|PREFIX%'` matches the start of any of them and
+# a trigram index on it can serve the search. Ordered as GeneIndex.ranking.
+search_sql = """
+SELECT {fields}
+FROM cognoma_genes
+WHERE upper(symbol) LIKE %(prefix)s
+    OR cognoma_gene_terms(synonyms, aliases) LIKE %(term_prefix)s
+ORDER BY
+    CASE
+        WHEN upper(symbol) = %(query)s THEN 0
+        WHEN upper(symbol) LIKE %(prefix)s THEN 1
+        WHEN cognoma_gene_terms(synonyms, aliases) LIKE %(term)s THEN 2
+        ELSE 3
+    END,
+    upper(symbol),
+    entrez_gene_id
+LIMIT %(limit)s
+""".format(fields=', '.join(FIELDS))
+
+class GeneIndex(object):
+    """Genes by upper cased symbol and by synonym or alias, as sorted arrays.
+
+    The terms starting with a prefix are a contiguous run of each array,
+    found by bisection, and the genes they match are ranked as search_sql
+    orders them, see `ranking`.
+    """
+
+    def __init__(self, version, genes, symbols, aliases):
+        self.version = version
+        self.genes = genes
+        # (sorted terms, ordinal in `genes` of each term's gene)
+        self.symbols = symbols
+        self.aliases = aliases
+
+    @classmethod
+    def build(cls):
+        # Read first, so a load committing in between leaves the index
+        # looking stale rather than the genes of the load looking current
+        version = dataset.read_version()
+        genes = list(Gene.objects.order_by('entrez_gene_id').values(*FIELDS))
+
+        symbols = sorted((gene['symbol'].upper(), ordinal) for ordinal, gene in enumerate(genes))
+        aliases = sorted(set((term.upper(), ordinal)
+                             for ordinal, gene in enumerate(genes)
+                             for term in (gene['synonyms'] or []) + (gene['aliases'] or [])
+                             if term))
+
+        return cls(version,
+                   genes,
+                   ([term for term, _ in symbols], [ordinal for _, ordinal in symbols]),
+                   ([term for term, _ in aliases], [ordinal for _, ordinal in aliases]))
+
+    def ranking(self, ordinal, match):
+        """Sort key of a gene by its best `match`, as in search_sql.
+
+        `match` is 0 for an exact symbol, 1 for a symbol prefix, 2 for an
+        exact alias and 3 for an alias prefix, and genes that match alike
+        sort by upper cased symbol then entrez_gene_id.
+        """
+        gene = self.genes[ordinal]
+        return match, gene['symbol'].upper(), gene['entrez_gene_id']
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT):
+        prefix = query.upper()
+        matches = {}
+        for exact_match, (terms, term_ordinals) in [(0, self.symbols), (2, self.aliases)]:
+            position = bisect.bisect_left(terms, prefix)
+            while position < len(terms) and terms[position].startswith(prefix):
+                ordinal = term_ordinals[position]
+                match = exact_match if terms[position] == prefix else exact_match + 1
+                matches[ordinal] = min(match, matches.get(ordinal, match))
+                position += 1
+        ordinals = heapq.nsmallest(limit, matches, key=lambda ordinal: self.ranking(ordinal, matches[ordinal]))
+        return [self.genes[ordinal] for ordinal in ordinals]
+
+def escape_like(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def search_from_sql(query, limit):
+    # | separates the terms, so it cannot be part of one.
+    query = query.upper().replace('|', '')
+    pattern = escape_like(query)
+    with connection.cursor() as cursor:
+        cursor.execute(search_sql, {
+            'query': query,
+            'prefix': pattern + '%',
+            'term': '%|' + pattern + '|%',
+            'term_prefix': '%|' + pattern + '%',
+            'limit': limit
+        })
+        return [dict(zip(FIELDS, row)) for row in cursor.fetchall()]
+
+def search(query, limit=DEFAULT_SEARCH_LIMIT):
+    """Up to `limit` genes whose symbol, synonyms or aliases start with `query`, best match first"""
+    query = query.strip()
+    if not query:
+        return []
+    current_index = current()
+    if current_index is not None:
+        return current_index.search(query, limit)
+    return search_from_sql(query, limit)
+
+versions = VersionedIndex('genes', lambda: GeneIndex.build())
+current = versions.current
+rebuild = versions.rebuild
+load_or_build = versions.load_or_build
+reset = versions.reset
@@ -1,13 +1,127 @@
 import os
+import re
+import json
 import shutil
-from urllib.request import urlretrieve
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import Request, urlopen
+from urllib.error import HTTPError
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+
+from api import dataload
 
 COMMIT_HASH = 'da832c5edc1ca4d3f665b038d15b19fced724f4c'
 # Genes have their own repo
 GENES_COMMIT_HASH = "ad9631bb4e77e2cdc5413b0d77cb8f7e93fc5bee"
 REPO_URL_TEMPLATE = 'https://github.com/cognoma/cancer-data/raw/{commit_hash}/{directory}/{filename}'
+GENES_URL_TEMPLATE = 'https://github.com/cognoma/genes/raw/{commit_hash}/{directory}/{filename}'
+
+DOWNLOAD_BLOCK_SIZE = 1 << 20
+
+def data_files():
+    """(commit_hash, url, filename) for every file loaddata needs"""
+    files = []
+    for filename in ['samples.tsv', 'mutation-matrix.tsv.bz2']:
+        files.append((COMMIT_HASH,
+                      REPO_URL_TEMPLATE.format(commit_hash=COMMIT_HASH, directory='data', filename=filename),
+                      filename))
+    files.append((GENES_COMMIT_HASH,
+                  GENES_URL_TEMPLATE.format(commit_hash=GENES_COMMIT_HASH, directory='data', filename='genes.tsv'),
+                  'genes.tsv'))
+    # Diseases lives in a different directory because it is
+    # composed of inputs from external locations.
+    files.append((COMMIT_HASH,
+                  REPO_URL_TEMPLATE.format(commit_hash=COMMIT_HASH, directory='mapping', filename='diseases.tsv'),
+                  'diseases.tsv'))
+    return files
+
+class DataCache(object):
+    """Content addressed store of downloaded data files.
+
+    Files live under `objects/<sha256>`. `manifests/<commit_hash>.json` maps
+    the filenames of a commit to their SHA-256, recorded the first time the
+    commit is downloaded and enforced on every later download of it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        for directory in ['objects', 'manifests', 'partial']:
+            os.makedirs(os.path.join(path, directory), exist_ok=True)
+
+    def object_path(self, sha256):
+        return os.path.join(self.path, 'objects', sha256)
+
+    def partial_path(self, commit_hash, filename):
+        return os.path.join(self.path, 'partial', commit_hash + '-' + filename + '.part')
+
+    def manifest_path(self, commit_hash):
+        return os.path.join(self.path, 'manifests', commit_hash + '.json')
+
+    def manifest(self, commit_hash):
+        try:
+            with open(self.manifest_path(commit_hash)) as manifest_file:
+                return json.load(manifest_file)
+        except FileNotFoundError:
+            return {}
+
+    def record(self, commit_hash, filename, sha256):
+        with self.lock:
+            manifest = self.manifest(commit_hash)
+            manifest[filename] = sha256
+            temporary_path = self.manifest_path(commit_hash) + '.tmp'
+            with open(temporary_path, 'w') as manifest_file:
+                json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+            os.replace(temporary_path, self.manifest_path(commit_hash))
+
+    def cached(self, commit_hash, filename):
+        """Path of the cached copy of `filename` at `commit_hash`, or None"""
+        sha256 = self.manifest(commit_hash).get(filename)
+        if sha256 is not None and os.path.exists(self.object_path(sha256)):
+            return self.object_path(sha256)
+        return None
+
+def content_range(header):
+    """(first byte, complete length) of a Content-Range header, either can be None"""
+    match = re.match(r'^bytes (?:(\d+)-\d+|\*)/(\d+|\*)$', (header or '').strip())
+    if not match:
+        return None, None
+    first, length = match.groups()
+    return (None if first is None else int(first),
+            None if length in (None, '*') else int(length))
+
+def download(url, partial_path):
+    """Download `url` to `partial_path`, resuming from any bytes already there"""
+    offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+    request = Request(url)
+    if offset:
+        request.add_header('Range', 'bytes={offset}-'.format(offset=offset))
+
+    try:
+        response = urlopen(request)
+    except HTTPError as error:
+        if error.code != 416:
+            raise
+        if content_range(error.headers.get('Content-Range'))[1] == offset:
+            # The partial file is already complete
+            return
+        # The partial file is stale. Start over.
+        os.remove(partial_path)
+        return download(url, partial_path)
+
+    with response:
+        if response.status == 206:
+            if content_range(response.headers.get('Content-Range'))[0] != offset:
+                # Appending anything but the bytes right after ours would corrupt the file
+                os.remove(partial_path)
+                return download(url, partial_path)
+            mode = 'ab'
+        else:
+            # A server that ignores Range answers 200 with the whole file.
+            mode = 'wb'
+        with open(partial_path, mode) as partial_file:
+            shutil.copyfileobj(response, partial_file, DOWNLOAD_BLOCK_SIZE)
 
 class Command(BaseCommand):
 
@@ -18,32 +132,51 @@ class Command(BaseCommand):
             default='data',
             help='Path to location of data files.',
         )
+        parser.add_argument(
+            '--cache-path',
+            dest='cache_path',
+            default=None,
+            help='Path to the download cache. Defaults to a .cache directory inside --path.',
+        )
+        parser.add_argument(
+            '--jobs',
+            dest='jobs',
+            type=int,
+            default=4,
+            help='Number of files downloaded concurrently.',
+        )
+
+    def fetch(self, cache, commit_hash, url, filename, path):
+        cached_path = cache.cached(commit_hash, filename)
+        if cached_path is not None:
+            print('Using cached ' + filename + ' for commit ' + commit_hash)
+        else:
+            print('Downloading ' + filename + ' data from: ' + url)
+            partial_path = cache.partial_path(commit_hash, filename)
+            download(url, partial_path)
+
+            sha256 = dataload.file_digest(partial_path)
+            expected = cache.manifest(commit_hash).get(filename)
+            if expected is not None and expected != sha256:
+                os.remove(partial_path)
+                raise CommandError('Checksum mismatch for {filename} at {commit_hash}: expected {expected}, got {sha256}'.format(
+                    filename=filename, commit_hash=commit_hash, expected=expected, sha256=sha256))
+
+            cached_path = cache.object_path(sha256)
+            os.replace(partial_path, cached_path)
+            cache.record(commit_hash, filename, sha256)
+
+        # Copy then rename so loaddata never sees a half written file.
+        table_path = os.path.join(path, filename)
+        shutil.copyfile(cached_path, table_path + '.tmp')
+        os.replace(table_path + '.tmp', table_path)
 
     def handle(self, *args, **options):
-        # Make sure there's no old data to conflict with new stuff.
-        shutil.rmtree(options['path'])
-        os.makedirs(options['path'])
-
-        files_in_data_path = ['samples.tsv', 'mutation-matrix.tsv.bz2']
-
-        for filename in files_in_data_path:
-            table_path = os.path.join(options['path'], filename)
-            table_url = REPO_URL_TEMPLATE.format(
-                commit_hash=COMMIT_HASH, directory="data", filename=filename)
-            print("Downloading " + filename + " data from: " + table_url)
-            urlretrieve(table_url, table_path)
-
-        filename = 'genes.tsv'
-        genes_path = os.path.join(options['path'], filename)
-        genes_url = "https://github.com/cognoma/genes/raw/" + GENES_COMMIT_HASH + "/data/" + filename
-        print("Downloading genes data from: " + genes_url)
-        urlretrieve(genes_url, genes_path)
-
-        # Diseases lives in a different directory because it is
-        # composed of inputs from external locations.
-        filename = 'diseases.tsv'
-        disease_path = os.path.join(options['path'], filename)
-        disease_url = REPO_URL_TEMPLATE.format(
-            commit_hash=COMMIT_HASH, directory="mapping", filename=filename)
-        print("Downloading diseases data from: " + disease_url)
-        urlretrieve(disease_url, disease_path)
+        os.makedirs(options['path'], exist_ok=True)
+        cache = DataCache(options['cache_path'] or os.path.join(options['path'], '.cache'))
+
+        with ThreadPoolExecutor(max_workers=options['jobs']) as executor:
+            futures = [executor.submit(self.fetch, cache, commit_hash, url, filename, options['path'])
+                       for commit_hash, url, filename in data_files()]
+            for future in futures:
+                future.result()
@@ -0,0 +1,448 @@
+import sys
+import json
+import time
+import random
+import hashlib
+import datetime
+import functools
+import threading
+import subprocess
+from collections import OrderedDict
+
+import requests
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.utils import timezone
+
+from api.models import Classifier, User, DatasetFile
+from api.management.commands.benchmarkqueue import percentile
+from api import dataset
+from cognoma_site.custom_storages import gzip_bytes, NOTEBOOK_CONTENT_TYPE
+
+TITLE = 'benchmark'
+USER_SLUG = 'apibenchmark'
+DISEASE = 'BENCH'
+# Recorded while the synthetic rows exist, so the dataset version changes
+# when they are added and again when they are removed, and no cached
+# response or index outlives them
+DATASET_FILENAME = 'benchmark'
+
+# Completions point at this notebook, uploaded once as notebooks are addressed by content
+NOTEBOOK = gzip_bytes(json.dumps({'cells': [], 'metadata': {'benchmark': True},
+                                  'nbformat': 4, 'nbformat_minor': 2}).encode())
+
+seed_dataset_sql = """
+INSERT INTO diseases (acronym, name) VALUES ('BENCH', 'benchmark disease');
+
+INSERT INTO cognoma_genes (entrez_gene_id, symbol, description, chromosome, gene_type, synonyms, aliases)
+SELECT -n, 'BENCH' || n, 'benchmark gene', (1 + n %% 22)::text, 'protein-coding',
+       ARRAY['BENCHSYN' || n], ARRAY['BENCHALIAS' || n]
+FROM generate_series(1, %(genes)s) AS n;
+
+INSERT INTO samples (sample_id, disease_id, gender, age_diagnosed)
+SELECT 'BENCH-' || lpad(n::text, 8, '0'), 'BENCH',
+       CASE WHEN n %% 2 = 0 THEN 'female' ELSE 'male' END, 20 + n %% 60
+FROM generate_series(1, %(samples)s) AS n;
+
+-- Skewed towards low gene numbers, as a few genes are mutated in most samples
+INSERT INTO mutations (gene_id, sample_id)
+SELECT DISTINCT -(1 + ((n * 7919 + m * 104729) %% %(genes)s) * (m %% 4 + 1) / 4),
+       'BENCH-' || lpad(n::text, 8, '0')
+FROM generate_series(1, %(samples)s) AS n, generate_series(1, %(mutations)s) AS m;
+
+ANALYZE cognoma_genes;
+ANALYZE samples;
+ANALYZE mutations;
+"""
+
+seed_classifiers_sql = """
+INSERT INTO classifiers (title, user_id, created_at, updated_at, status, priority,
+                         timeout, attempts, max_attempts, completed_at, failed_at)
+SELECT %(title)s, %(user_id)s, NOW() - n * INTERVAL '1 minute', NOW() - n * INTERVAL '1 minute',
+       CASE WHEN n %% 10 = 0 THEN 'failed' ELSE 'complete' END, 1 + n %% 4, 600, 1 + n %% 3, 3,
+       CASE WHEN n %% 10 = 0 THEN NULL ELSE NOW() - n * INTERVAL '1 minute' END,
+       CASE WHEN n %% 10 = 0 THEN NOW() - n * INTERVAL '1 minute' ELSE NULL END
+FROM generate_series(1, %(historical)s) AS n;
+
+INSERT INTO classifiers (title, user_id, created_at, updated_at, status, priority,
+                         timeout, attempts, max_attempts)
+SELECT %(title)s, %(user_id)s, NOW(), NOW(), 'queued', 1 + n %% 4, 600, 0, 2
+FROM generate_series(1, %(queued)s) AS n;
+
+ANALYZE classifiers;
+"""
+
+cleanup_sql = """
+DELETE FROM classifiers WHERE user_id IN (SELECT id FROM users WHERE random_slugs @> ARRAY[%(slug)s]);
+DELETE FROM users WHERE random_slugs @> ARRAY[%(slug)s];
+DELETE FROM mutations WHERE sample_id IN (SELECT sample_id FROM samples WHERE disease_id = 'BENCH');
+DELETE FROM samples WHERE disease_id = 'BENCH';
+DELETE FROM cognoma_genes WHERE entrez_gene_id < 0 AND symbol LIKE 'BENCH%%';
+DELETE FROM diseases WHERE acronym = 'BENCH';
+"""
+
+class InProcessClient(object):
+    """Requests through Django's test client, in this process and against its database"""
+
+    def __init__(self):
+        self.client = Client()
+
+    def request(self, method, path, params=None, data=None, authorization=None):
+        headers = {} if authorization is None else {'HTTP_AUTHORIZATION': authorization}
+        if method == 'GET':
+            response = self.client.get(path, params or {}, **headers)
+        else:
+            response = self.client.generic(method, path, json.dumps(data), content_type='application/json',
+                                           **headers)
+        return response.status_code, response.content
+
+    def close(self):
+        connection.close()
+
+class HTTPClient(object):
+    """Requests to a running server at `url`"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+
+    def request(self, method, path, params=None, data=None, authorization=None):
+        headers = {} if authorization is None else {'Authorization': authorization}
+        response = self.session.request(method, self.url + path, params=params, json=data, headers=headers)
+        return response.status_code, response.content
+
+    def close(self):
+        self.session.close()
+
+class Recorder(object):
+    """Latencies and errors of one thread's requests by endpoint, merged once the run ends"""
+
+    def __init__(self, client):
+        self.client = client
+        self.timings = {}
+        self.errors = {}
+
+    def request(self, endpoint, method, path, **kwargs):
+        start = time.time()
+        try:
+            status, content = self.client.request(method, path, **kwargs)
+        except Exception:
+            # Connection errors, or in process the exception of a failed view
+            status, content = None, b''
+        self.timings.setdefault(endpoint, []).append((time.time() - start) * 1000)
+        if status is None or status >= 400:
+            self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+        return status, content
+
+class Command(BaseCommand):
+    help = ('Load tests the API with workers claiming, completing and failing classifiers alongside '
+            'front-end reads of a synthetic dataset, and prints per endpoint throughput and latency '
+            'percentiles as JSON. The synthetic rows are committed for the run so that concurrent '
+            'requests see them, and deleted afterwards. Do not run against production.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--database',
+            dest='database',
+            default=None,
+            help='Name of the configured database, required to confirm it is a dedicated benchmark '
+                 'database: the run adds and deletes rows and changes its dataset version.',
+        )
+        parser.add_argument(
+            '--url',
+            dest='url',
+            default=None,
+            help='Load test the server at this URL, which must share this database, '
+                 'instead of handling requests in process.',
+        )
+        parser.add_argument(
+            '--duration',
+            dest='duration',
+            type=float,
+            default=60,
+            help='Seconds to apply load for.',
+        )
+        parser.add_argument(
+            '--workers',
+            dest='workers',
+            type=int,
+            default=8,
+            help='Number of threads acting as ML workers.',
+        )
+        parser.add_argument(
+            '--readers',
+            dest='readers',
+            type=int,
+            default=16,
+            help='Number of threads acting as front-end users.',
+        )
+        parser.add_argument(
+            '--samples',
+            dest='samples',
+            type=int,
+            default=11000,
+            help='Number of synthetic samples.',
+        )
+        parser.add_argument(
+            '--genes',
+            dest='genes',
+            type=int,
+            default=20000,
+            help='Number of synthetic genes.',
+        )
+        parser.add_argument(
+            '--mutations',
+            dest='mutations',
+            type=int,
+            default=250,
+            help='Mutations per sample, before duplicates are dropped.',
+        )
+        parser.add_argument(
+            '--historical',
+            dest='historical',
+            type=int,
+            default=100000,
+            help='Number of completed and failed classifiers.',
+        )
+        parser.add_argument(
+            '--queued',
+            dest='queued',
+            type=int,
+            default=20000,
+            help='Number of classifiers queued for the workers.',
+        )
+        parser.add_argument(
+            '--seed',
+            dest='seed',
+            type=int,
+            default=0,
+            help='Random seed for the request mix.',
+        )
+        parser.add_argument(
+            '--output',
+            dest='output',
+            default=None,
+            help='Write the JSON report to this file instead of stdout.',
+        )
+        parser.add_argument(
+            '--baseline',
+            dest='baseline',
+            default=None,
+            help='Earlier JSON report to compare against, ex from the parent commit.',
+        )
+
+    def log(self, message):
+        self.stderr.write(message)
+
+    def seed(self, options):
+        start = time.time()
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(cleanup_sql, {'slug': USER_SLUG})
+            cursor.execute(seed_dataset_sql, {
+                'genes': options['genes'],
+                'samples': options['samples'],
+                'mutations': options['mutations']
+            })
+            user = User.objects.create(random_slugs=[USER_SLUG])
+            cursor.execute(seed_classifiers_sql, {
+                'title': TITLE,
+                'user_id': user.id,
+                'historical': options['historical'],
+                'queued': options['queued']
+            })
+            cursor.execute('SELECT COUNT(*) FROM mutations WHERE sample_id LIKE %s', ['BENCH-%'])
+            mutations = cursor.fetchone()[0]
+            DatasetFile.objects.update_or_create(filename=DATASET_FILENAME, defaults={'sha256': '0' * 64})
+        dataset.read_version()
+        self.log('Seeded {0} mutations and {1} classifiers in {2:.0f}s'.format(
+            mutations, options['historical'] + options['queued'], time.time() - start))
+
+        classifier_ids = list(Classifier.objects.filter(user=user).order_by('id')[:1000].values_list('id', flat=True))
+        sample_ids = ['BENCH-{0:08d}'.format(n) for n in range(1, options['samples'] + 1)]
+        return classifier_ids, sample_ids
+
+    def cleanup(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(cleanup_sql, {'slug': USER_SLUG})
+            DatasetFile.objects.filter(filename=DATASET_FILENAME).delete()
+            # Otherwise the version from before the run, and whatever was
+            # cached for it while the synthetic rows existed, would be current again
+            DatasetFile.objects.update(loaded_at=timezone.now())
+        dataset.read_version()
+
+    def read(self, recorder, rng, options, classifier_ids, sample_ids):
+        """One front-end request, chosen by weight"""
+        def gene_ids(count):
+            return ','.join(str(-rng.randint(1, options['genes'])) for _ in range(count))
+
+        reads = [
+            (3, lambda: recorder.request('GET /samples?disease', 'GET', '/samples', params={
+                'disease': DISEASE, 'limit': 100, 'offset': rng.randrange(0, max(1, options['samples'] - 100))})),
+            (3, lambda: recorder.request('GET /samples?any_mutations', 'GET', '/samples', params={
+                'disease': DISEASE, 'any_mutations': gene_ids(rng.randint(1, 5)), 'limit': 100})),
+            (2, lambda: recorder.request('GET /samples/counts', 'GET', '/samples/counts', params={
+                'genes': gene_ids(rng.randint(1, 5))})),
+            (2, lambda: recorder.request('GET /samples/<id>', 'GET', '/samples/' + rng.choice(sample_ids))),
+            (2, lambda: recorder.request('GET /genes/search', 'GET', '/genes/search', params={
+                'q': 'BENCH' + str(rng.randint(1, 200))})),
+            (1, lambda: recorder.request('GET /diseases', 'GET', '/diseases')),
+            (2, lambda: recorder.request('GET /classifiers/<id>', 'GET', '/classifiers/{0}'.format(
+                rng.choice(classifier_ids)), authorization='Bearer ' + USER_SLUG)),
+        ]
+        threshold = rng.uniform(0, sum(weight for weight, _ in reads))
+        for weight, request in reads:
+            threshold -= weight
+            if threshold <= 0:
+                return request()
+        return reads[-1][1]()
+
+    def work(self, recorder, rng, worker_id, notebook_digest):
+        """Claim a classifier then heartbeat and complete, fail or release it"""
+        authorization = 'JWT ' + settings.AUTH_TOKEN
+        status, content = recorder.request('GET /classifiers/queue', 'GET', '/classifiers/queue', params={
+            'title': TITLE, 'worker_id': worker_id, 'limit': 1}, authorization=authorization)
+        if status != 200:
+            return
+        claimed = json.loads(content.decode())
+        if not claimed:
+            time.sleep(0.1)
+            return
+
+        id = claimed[0]['id']
+        recorder.request('POST /classifiers/<id>/heartbeat', 'POST', '/classifiers/{0}/heartbeat'.format(id),
+                         data={'worker_id': worker_id}, authorization=authorization)
+        outcome = rng.random()
+        if outcome < 0.8:
+            recorder.request('POST /classifiers/<id>/notebook-upload/confirm', 'POST',
+                             '/classifiers/{0}/notebook-upload/confirm'.format(id),
+                             data=dict(notebook_digest, worker_id=worker_id),
+                             authorization=authorization)
+        elif outcome < 0.95:
+            recorder.request('POST /classifiers/fail', 'POST', '/classifiers/fail', data={
+                'worker_id': worker_id,
+                'classifiers': [{'id': id, 'fail_reason': 'benchmark', 'fail_message': 'Benchmark failure.'}]
+            }, authorization=authorization)
+        else:
+            recorder.request('POST /classifiers/release', 'POST', '/classifiers/release',
+                             data={'worker_id': worker_id, 'ids': [id]}, authorization=authorization)
+
+    def run(self, options, classifier_ids, sample_ids, notebook_digest):
+        recorders = []
+        lock = threading.Lock()
+        deadline = time.time() + options['duration']
+
+        def thread(index, act):
+            client = HTTPClient(options['url']) if options['url'] else InProcessClient()
+            recorder = Recorder(client)
+            rng = random.Random(options['seed'] * 1000 + index)
+            try:
+                while time.time() < deadline:
+                    act(recorder, rng)
+            finally:
+                client.close()
+                with lock:
+                    recorders.append(recorder)
+
+        acts = [functools.partial(self.work, worker_id='benchmark-{0}'.format(index), notebook_digest=notebook_digest)
+                for index in range(options['workers'])]
+        acts += [functools.partial(self.read, options=options, classifier_ids=classifier_ids, sample_ids=sample_ids)
+                 for _ in range(options['readers'])]
+        threads = [threading.Thread(target=thread, args=(index, act)) for index, act in enumerate(acts)]
+
+        start = time.time()
+        for started in threads:
+            started.start()
+        for started in threads:
+            started.join()
+        elapsed = time.time() - start
+
+        timings = {}
+        errors = {}
+        for recorder in recorders:
+            for endpoint, endpoint_timings in recorder.timings.items():
+                timings.setdefault(endpoint, []).extend(endpoint_timings)
+            for endpoint, count in recorder.errors.items():
+                errors[endpoint] = errors.get(endpoint, 0) + count
+        return timings, errors, elapsed
+
+    def summarize(self, timings, errors, elapsed):
+        """Throughput and latencies of `timings`, which are None when there are none"""
+        timings = sorted(timings)
+        return OrderedDict([
+            ('requests', len(timings)),
+            ('errors', errors),
+            ('throughput', len(timings) / elapsed if elapsed else None),
+            ('mean_ms', sum(timings) / len(timings) if timings else None),
+            ('p50_ms', percentile(timings, 0.5) if timings else None),
+            ('p95_ms', percentile(timings, 0.95) if timings else None),
+            ('p99_ms', percentile(timings, 0.99) if timings else None),
+        ])
+
+    def compare(self, report, baseline):
+        """Ratios of this report's throughput and latencies to the baseline's, per endpoint"""
+        changes = OrderedDict()
+        for endpoint, summary in report['endpoints'].items():
+            before = baseline['endpoints'].get(endpoint)
+            if before is None:
+                continue
+            changes[endpoint] = OrderedDict(
+                (name, summary[name] / before[name] if summary[name] is not None and before[name] else None)
+                for name in ['throughput', 'p50_ms', 'p95_ms', 'p99_ms'])
+        return changes
+
+    def commit(self):
+        try:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR,
+                                           stderr=subprocess.DEVNULL).decode().strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    def handle(self, *args, **options):
+        database = connection.settings_dict['NAME']
+        if options['database'] != database:
+            raise CommandError('Pass --database {0} to confirm that the configured database is a dedicated '
+                               'benchmark database. The run adds and deletes rows in it and changes its '
+                               'dataset version, invalidating every cached response.'.format(database))
+
+        started_at = datetime.datetime.utcnow()
+        notebook_digest = {'size': len(NOTEBOOK), 'md5': hashlib.md5(NOTEBOOK).hexdigest()}
+        notebook_name = default_storage.content_addressed_name('notebooks/benchmark.ipynb',
+                                                               notebook_digest['md5'])
+        default_storage.save_gzipped(notebook_name, NOTEBOOK, NOTEBOOK_CONTENT_TYPE)
+        try:
+            # Inside the try, so a seed that fails part way is cleaned up too
+            classifier_ids, sample_ids = self.seed(options)
+            self.log('Running {0} workers and {1} readers for {2:.0f}s'.format(
+                options['workers'], options['readers'], options['duration']))
+            timings, errors, elapsed = self.run(options, classifier_ids, sample_ids, notebook_digest)
+        finally:
+            self.cleanup()
+            default_storage.delete(notebook_name)
+
+        all_timings = [timing for endpoint_timings in timings.values() for timing in endpoint_timings]
+        report = OrderedDict([
+            ('commit', self.commit()),
+            ('started_at', started_at.isoformat() + 'Z'),
+            ('target', options['url'] or 'in-process'),
+            ('options', OrderedDict((name, options[name]) for name in [
+                'duration', 'workers', 'readers', 'samples', 'genes', 'mutations', 'historical', 'queued', 'seed'])),
+            ('elapsed_seconds', elapsed),
+            ('total', self.summarize(all_timings, sum(errors.values()), elapsed)),
+            ('endpoints', OrderedDict((endpoint, self.summarize(timings[endpoint], errors.get(endpoint, 0), elapsed))
+                                      for endpoint in sorted(timings))),
+        ])
+        if options['baseline']:
+            with open(options['baseline']) as baseline_file:
+                baseline = json.load(baseline_file)
+            report['baseline_commit'] = baseline.get('commit')
+            report['changes'] = self.compare(report, baseline)
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output + '\n')
+        else:
+            sys.stdout.write(output + '\n')
@@ -0,0 +1,91 @@
+import time
+import threading
+
+import psycopg2
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.pooled_postgresql.pool import ConnectionPool
+from api.management.commands.benchmarkqueue import percentile
+
+class Command(BaseCommand):
+    help = ('Compares request latency with a new database connection per request against '
+            'connections reused from a pool, under concurrent load.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            dest='concurrency',
+            type=int,
+            default=16,
+            help='Number of threads issuing requests at once.',
+        )
+        parser.add_argument(
+            '--requests',
+            dest='requests',
+            type=int,
+            default=200,
+            help='Number of requests each thread issues.',
+        )
+        parser.add_argument(
+            '--pool-size',
+            dest='pool_size',
+            type=int,
+            default=8,
+            help='Maximum connections in the pool.',
+        )
+
+    def run(self, options, acquire, release):
+        """Per request latencies in ms, each request being one connection checkout and a query"""
+        timings = []
+        lock = threading.Lock()
+
+        def worker():
+            thread_timings = []
+            for _ in range(options['requests']):
+                start = time.time()
+                db_connection = acquire()
+                with db_connection.cursor() as cursor:
+                    cursor.execute('SELECT COUNT(*) FROM classifiers WHERE status = %s', ['queued'])
+                    cursor.fetchone()
+                db_connection.commit()
+                release(db_connection)
+                thread_timings.append((time.time() - start) * 1000)
+            with lock:
+                timings.extend(thread_timings)
+
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.time() - start
+
+        timings.sort()
+        return timings, elapsed
+
+    def handle(self, *args, **options):
+        conn_params = connection.get_connection_params()
+        pool = ConnectionPool(lambda: psycopg2.connect(**conn_params),
+                              max_size=options['pool_size'],
+                              timeout=60,
+                              max_age=30 * 60,
+                              health_check_interval=30)
+
+        modes = [
+            ('unpooled', lambda: psycopg2.connect(**conn_params), lambda db_connection: db_connection.close()),
+            ('pooled', pool.acquire, pool.release),
+        ]
+
+        print('{0:>10} {1:>10} {2:>10} {3:>10} {4:>10}'.format('mode', 'req/s', 'mean ms', 'p50 ms', 'p99 ms'))
+        for name, acquire, release in modes:
+            timings, elapsed = self.run(options, acquire, release)
+            print('{0:>10} {1:>10.0f} {2:>10.3f} {3:>10.3f} {4:>10.3f}'.format(
+                name, len(timings) / elapsed, sum(timings) / len(timings),
+                percentile(timings, 0.5), percentile(timings, 0.99)))
+
+        print('\nPool stats:')
+        for stat, value in sorted(pool.stats().items()):
+            print('{0:>22} {1}'.format(stat, value))
+        pool.close()
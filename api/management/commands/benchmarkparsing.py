@@ -0,0 +1,61 @@
+import io
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import dataload
+
+class Command(BaseCommand):
+    help = ('Compares mutation matrix parsing with the csv module against the vectorized NumPy parser '
+            'on a synthetic matrix. Parsing is timed on decompressed text, as bz2 costs the same for both.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--samples',
+            dest='samples',
+            type=int,
+            default=1000,
+            help='Number of sample rows in the matrix.',
+        )
+        parser.add_argument(
+            '--genes',
+            dest='genes',
+            type=int,
+            default=20000,
+            help='Number of gene columns in the matrix.',
+        )
+        parser.add_argument(
+            '--mutation-rate',
+            dest='mutation_rate',
+            type=float,
+            default=0.01,
+            help='Fraction of cells that are mutated.',
+        )
+        parser.add_argument(
+            '--repeat',
+            dest='repeat',
+            type=int,
+            default=3,
+            help='Number of runs of each parser, the fastest is reported.',
+        )
+
+    def best_time(self, parse, text, repeat):
+        times = []
+        for _ in range(repeat):
+            start = time.time()
+            result = list(parse(io.StringIO(text)))
+            times.append(time.time() - start)
+        return result, min(times)
+
+    def handle(self, *args, **options):
+        text = dataload.random_matrix(options['samples'], options['genes'], options['mutation_rate'])
+
+        reference, reference_time = self.best_time(dataload.parse_mutations, text, options['repeat'])
+        vectorized, vectorized_time = self.best_time(dataload.parse_mutations_vectorized, text, options['repeat'])
+        assert vectorized == reference, 'The parsers disagree'
+
+        cells = options['samples'] * options['genes']
+        print('{0:>12} {1:>10} {2:>14}'.format('parser', 'seconds', 'cells/s'))
+        for name, elapsed in [('csv', reference_time), ('vectorized', vectorized_time)]:
+            print('{0:>12} {1:>10.3f} {2:>14.0f}'.format(name, elapsed, cells / elapsed))
+        print('\nSpeedup: {0:.1f}x'.format(reference_time / vectorized_time))
@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from api.models import User, DEFAULT_CLASSIFIER_TITLE
+from api import queue
+
+seed_classifiers_sql = """
+INSERT INTO classifiers (title, user_id, created_at, updated_at, status, priority,
+                         timeout, attempts, max_attempts)
+SELECT %s, %s, NOW(), NOW(), %s, 1 + (n %% 4), 600, 1, 1
+FROM generate_series(1, %s) AS n
+"""
+
+requeue_sql = """
+UPDATE classifiers SET status = 'queued', worker_id = NULL, locked_at = NULL
+WHERE id = ANY(%s)
+"""
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+class Command(BaseCommand):
+    help = 'Measures queue claim latency as completed classifiers accumulate. All changes are rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            dest='sizes',
+            default='0,10000,100000,1000000',
+            help='Comma separated numbers of completed classifiers to measure at.',
+        )
+        parser.add_argument(
+            '--queued',
+            dest='queued',
+            type=int,
+            default=100,
+            help='Number of claimable classifiers in the queue.',
+        )
+        parser.add_argument(
+            '--claims',
+            dest='claims',
+            type=int,
+            default=200,
+            help='Number of claims timed at each size.',
+        )
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(size) for size in options['sizes'].split(','))
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            user = User.objects.create(random_slugs=['queuebenchmark'])
+            cursor.execute(seed_classifiers_sql, [DEFAULT_CLASSIFIER_TITLE, user.id, 'queued', options['queued']])
+
+            completed = 0
+            print('{0:>12} {1:>10} {2:>10} {3:>10}'.format('completed', 'mean ms', 'p50 ms', 'p99 ms'))
+            for size in sizes:
+                cursor.execute(seed_classifiers_sql, [DEFAULT_CLASSIFIER_TITLE, user.id, 'completed', size - completed])
+                completed = size
+                cursor.execute('ANALYZE classifiers')
+
+                timings = []
+                for _ in range(options['claims']):
+                    start = time.time()
+                    claimed = queue.get_classifiers([DEFAULT_CLASSIFIER_TITLE], 'benchmark')
+                    timings.append((time.time() - start) * 1000)
+                    cursor.execute(requeue_sql, [[classifier.id for classifier in claimed]])
+
+                timings.sort()
+                print('{0:>12} {1:>10.3f} {2:>10.3f} {3:>10.3f}'.format(
+                    size, sum(timings) / len(timings), percentile(timings, 0.5), percentile(timings, 0.99)))
+
+            cursor.execute('EXPLAIN ' + queue.get_classifiers_sql, [[DEFAULT_CLASSIFIER_TITLE], 1, 'benchmark', None])
+            print('\nClaim query plan:')
+            for row in cursor.fetchall():
+                print(row[0])
+
+            transaction.set_rollback(True)
@@ -0,0 +1,104 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIRequestFactory
+
+from api.models import DatasetFile
+from api.management.commands.benchmarkqueue import percentile
+from api import views
+
+seed_sql = """
+INSERT INTO diseases (acronym, name) VALUES ('BENCH', 'benchmark disease');
+
+INSERT INTO cognoma_genes (entrez_gene_id, symbol, description, chromosome, gene_type, synonyms, aliases)
+SELECT -n, 'BENCH' || n, 'benchmark gene', '1', 'protein-coding', ARRAY['a', 'b'], ARRAY['c']
+FROM generate_series(1, %(genes)s) AS n;
+
+INSERT INTO samples (sample_id, disease_id, gender, age_diagnosed)
+SELECT 'BENCH-' || lpad(n::text, 8, '0'), 'BENCH',
+       CASE WHEN n %% 2 = 0 THEN 'female' ELSE 'male' END, 20 + n %% 60
+FROM generate_series(1, %(samples)s) AS n;
+
+INSERT INTO mutations (gene_id, sample_id)
+SELECT -(1 + (n * 7919 + m) %% %(genes)s), 'BENCH-' || lpad(n::text, 8, '0')
+FROM generate_series(1, %(samples)s) AS n, generate_series(1, %(mutations)s) AS m;
+
+ANALYZE samples;
+ANALYZE mutations;
+"""
+
+class Command(BaseCommand):
+    help = ('Compares sample list throughput rendered from values() with ujson against the '
+            'serializers and JSONRenderer. All changes are rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--samples',
+            dest='samples',
+            type=int,
+            default=10000,
+            help='Number of synthetic samples.',
+        )
+        parser.add_argument(
+            '--mutations',
+            dest='mutations',
+            type=int,
+            default=20,
+            help='Number of mutations per sample.',
+        )
+        parser.add_argument(
+            '--page-size',
+            dest='page_size',
+            type=int,
+            default=1000,
+            help='Samples per page requested.',
+        )
+        parser.add_argument(
+            '--requests',
+            dest='requests',
+            type=int,
+            default=50,
+            help='Number of pages requested with each renderer.',
+        )
+
+    def run(self, view, options):
+        """Per request latencies in ms, each request rendering one page of BENCH samples"""
+        factory = APIRequestFactory()
+        timings = []
+        for _ in range(options['requests']):
+            request = factory.get('/samples', {'disease': 'BENCH', 'limit': options['page_size']})
+            start = time.time()
+            response = view(request)
+            response.render()
+            timings.append((time.time() - start) * 1000)
+            assert response.status_code == 200, response.content
+        return sorted(timings)
+
+    def handle(self, *args, **options):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(seed_sql, {
+                'genes': 1000,
+                'samples': options['samples'],
+                'mutations': options['mutations']
+            })
+            # Without a loaded dataset responses are not cached, so every request renders.
+            DatasetFile.objects.all().delete()
+
+            variants = [
+                ('serializer', views.SampleList.as_view(values_fields={}, renderer_classes=(JSONRenderer,))),
+                ('values', views.SampleList.as_view()),
+            ]
+
+            print('{0:>12} {1:>10} {2:>10} {3:>10} {4:>12}'.format('path', 'mean ms', 'p50 ms', 'p99 ms', 'samples/s'))
+            for name, view in variants:
+                # Warm up connections and caches before timing
+                self.run(view, dict(options, requests=1))
+                timings = self.run(view, options)
+                mean = sum(timings) / len(timings)
+                print('{0:>12} {1:>10.3f} {2:>10.3f} {3:>10.3f} {4:>12.0f}'.format(
+                    name, mean, percentile(timings, 0.5), percentile(timings, 0.99),
+                    options['page_size'] / (mean / 1000)))
+
+            transaction.set_rollback(True)
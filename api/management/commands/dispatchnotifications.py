@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api import notifications
+
+class Command(BaseCommand):
+    help = 'Sends the emails and Mailchimp subscriptions waiting in the notifications outbox.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            dest='once',
+            action='store_true',
+            default=False,
+            help='Send everything currently due and exit instead of polling forever.',
+        )
+        parser.add_argument(
+            '--interval',
+            dest='interval',
+            type=float,
+            default=2.0,
+            help='Seconds to wait before polling again once the outbox is drained.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            dest='batch_size',
+            type=int,
+            default=notifications.DEFAULT_BATCH_SIZE,
+            help='Number of notifications claimed and sent at a time.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            attempted = notifications.dispatch(options['batch_size'])
+            # A full batch means there are likely more due right away.
+            if attempted == options['batch_size']:
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
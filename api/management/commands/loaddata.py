@@ -1,10 +1,20 @@
 import os
-import csv
-import bz2
+import functools
 
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
 
-from api.models import Disease, Sample, Gene, Mutation
+from api.models import Disease, Sample, Gene, Mutation, DatasetFile
+from api import dataload, mutation_index, gene_index
+
+# Tables in load order with their data file and the columns filled from it.
+DATA_FILES = [
+    (Disease, 'diseases.tsv', ['acronym', 'name']),
+    (Sample, 'samples.tsv', ['sample_id', 'disease_id', 'gender', 'age_diagnosed']),
+    (Gene, 'genes.tsv', ['entrez_gene_id', 'symbol', 'description', 'chromosome', 'gene_type',
+                         'synonyms', 'aliases']),
+    (Mutation, 'mutation-matrix.tsv.bz2', ['gene_id', 'sample_id']),
+]
 
 
 class Command(BaseCommand):
@@ -16,86 +26,186 @@ class Command(BaseCommand):
             default='data',
             help='Path to location of data files.',
         )
+        parser.add_argument(
+            '--incremental',
+            dest='incremental',
+            action='store_true',
+            default=False,
+            help='Only apply the rows that differ from the current tables, in a single transaction.',
+        )
+        parser.add_argument(
+            '--swap',
+            dest='swap',
+            action='store_true',
+            default=False,
+            help='Load into shadow tables and swap them in with a single rename transaction.',
+        )
+        parser.add_argument(
+            '--mode',
+            dest='mode',
+            choices=['copy', 'orm'],
+            default='copy',
+            help='How to insert rows: stream through COPY FROM STDIN (default) or ORM bulk_create. '
+                 '--swap always uses COPY.',
+        )
+        parser.add_argument(
+            '--parser',
+            dest='parser',
+            choices=['numpy', 'python'],
+            default='numpy',
+            help='How to parse the mutation matrix: vectorized NumPy blocks (default) or a plain Python loop.',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            dest='chunk_size',
+            type=int,
+            default=dataload.DEFAULT_COPY_CHUNK_SIZE,
+            help='Number of rows buffered per COPY round-trip.',
+        )
+        parser.add_argument(
+            '--benchmark',
+            dest='benchmark',
+            action='store_true',
+            default=False,
+            help='Print rows/sec for each table loaded.',
+        )
+
+    def read_rows(self, model, data_path, options, shadows=None):
+        """Return the row iterator for `model` and the foreign key resolvers it uses.
+
+        Resolvers are built when this is called, so it must only be called
+        once the tables they reference have been loaded. When loading into
+        `shadows` the keys are resolved against the shadow tables.
+        """
+        def resolver(referenced_model):
+            table = None
+            if shadows is not None:
+                table = shadows.shadow(referenced_model._meta.db_table)
+            return dataload.ForeignKeyResolver(referenced_model, table=table)
+
+        if model is Disease:
+            return dataload.iter_diseases(data_path), []
+        elif model is Sample:
+            diseases = resolver(Disease)
+            rows = dataload.iter_samples(data_path)
+            return dataload.resolve_rows(rows, {1: diseases}), [diseases]
+        elif model is Gene:
+            return dataload.iter_genes(data_path), []
+        else:
+            if options['parser'] == 'numpy':
+                rows = dataload.iter_mutations_vectorized(data_path)
+            else:
+                rows = dataload.iter_mutations(data_path)
+            genes = resolver(Gene)
+            samples = resolver(Sample)
+            return dataload.resolve_rows(rows, {0: genes, 1: samples}), [genes, samples]
 
     def handle(self, *args, **options):
+        if options['incremental'] and options['swap']:
+            raise CommandError('--incremental and --swap cannot be used together.')
+
+        if options['incremental']:
+            with transaction.atomic():
+                self.load_incremental(options)
+        elif options['swap']:
+            self.load_swap(options)
+        else:
+            self.load_full(options)
+
+        print('Building mutation and gene indexes...')
+        mutation_index.load_or_build()
+        gene_index.load_or_build()
+
+    def load_full(self, options):
         # First clear out all the existing data.
         Disease.objects.all().delete()
         Gene.objects.all().delete()
         Sample.objects.all().delete()
         Mutation.objects.all().delete()
 
-        # Diseases
-        if Disease.objects.count() == 0:
-            print('Loading diseases table...')
-            disease_path = os.path.join(options['path'], 'diseases.tsv')
-            with open(disease_path) as disease_file:
-                disease_reader = csv.DictReader(disease_file, delimiter='\t')
-                disease_list = []
-                for row in disease_reader:
-                    disease = Disease(
-                        acronym=row['acronym'],
-                        name=row['disease']
-                    )
-                    disease_list.append(disease)
-                Disease.objects.bulk_create(disease_list)
-
-        # Samples
-        if Sample.objects.count() == 0:
-            print('Loading samples table...')
-            sample_path = os.path.join(options['path'], 'samples.tsv')
-            with open(sample_path) as sample_file:
-                sample_reader = csv.DictReader(sample_file, delimiter='\t')
-                sample_list = []
-                for row in sample_reader:
-                    disease = Disease.objects.get(acronym=row['acronym'])
-                    sample = Sample(
-                        sample_id=row['sample_id'],
-                        disease=disease,
-                        gender=row['gender'] or None,
-                        age_diagnosed=row['age_diagnosed'] or None
-                    )
-                    sample_list.append(sample)
-                Sample.objects.bulk_create(sample_list)
-
-        # Genes
-        if Gene.objects.count() == 0:
-            print('Loading genes table...')
-            gene_path = os.path.join(options['path'], 'genes.tsv')
-            with open(gene_path) as gene_file:
-                gene_reader = csv.DictReader(gene_file, delimiter='\t')
-                gene_list = []
-                for row in gene_reader:
-                    gene = Gene(
-                        entrez_gene_id=row['entrez_gene_id'],
-                        symbol=row['symbol'],
-                        description=row['description'],
-                        chromosome=row['chromosome'] or None,
-                        gene_type=row['gene_type'],
-                        synonyms=row['synonyms'].split('|') or None,
-                        aliases=row['aliases'].split('|') or None
-                    )
-                    gene_list.append(gene)
-                Gene.objects.bulk_create(gene_list)
-
-        # Mutations
-        if Mutation.objects.count() == 0:
-            print('Loading mutations table...')
-            mutation_path = os.path.join(options['path'], 'mutation-matrix.tsv.bz2')
-            with bz2.open(mutation_path , 'rt') as mutation_file:
-                mutation_reader = csv.DictReader(mutation_file, delimiter='\t')
-                mutation_list = []
-                count = 0
-                for row in mutation_reader:
-                    sample_id = row.pop('sample_id')
-                    count += 1
-                    if count % 1000 == 0:
-                        print('Processing ' + str(count) + ' rows so far')
-                    for entrez_gene_id, mutation_status in row.items():
-                        if mutation_status == '1':
-                            #try:
-                                mutation = Mutation(gene_id=entrez_gene_id, sample_id=sample_id)
-                                mutation_list.append(mutation)
-                            #except:
-                            #    print('Had an issue inserting sample', sample_id, 'mutation', entrez_gene_id)
-                print('Bulk loading mutation data...')
-                Mutation.objects.bulk_create(mutation_list, batch_size=1000)
+        for model, filename, columns in DATA_FILES:
+            table = model._meta.db_table
+            print('Loading ' + table + ' table...')
+            data_path = os.path.join(options['path'], filename)
+
+            with transaction.atomic(), dataload.LoadTimer(table, options['benchmark']) as timer:
+                rows, resolvers = self.read_rows(model, data_path, options)
+                if options['mode'] == 'copy':
+                    timer.rows = dataload.copy_rows(table, columns, rows, chunk_size=options['chunk_size'])
+                else:
+                    instances = [model(**dict(zip(columns, row))) for row in rows]
+                    model.objects.bulk_create(instances, batch_size=1000)
+                    timer.rows = len(instances)
+                # Raising here rolls back the partially loaded table.
+                for resolver in resolvers:
+                    resolver.raise_for_missing()
+
+            DatasetFile.objects.update_or_create(filename=filename,
+                                                 defaults={'sha256': dataload.file_digest(data_path)})
+
+    def delete_rows(self, model, keys):
+        # Tables that reference `model` are skipped when their file is
+        # unchanged, so rows are deleted through the ORM, which also deletes
+        # the mutations and classifier genes referencing them, as a full load
+        # does.
+        model.objects.filter(pk__in=[key for key, in keys]).delete()
+
+    def load_incremental(self, options):
+        for model, filename, columns in DATA_FILES:
+            table = model._meta.db_table
+            data_path = os.path.join(options['path'], filename)
+            digest = dataload.file_digest(data_path)
+
+            if DatasetFile.objects.filter(filename=filename, sha256=digest).exists():
+                print(filename + ' is unchanged, skipping ' + table + ' table.')
+                continue
+
+            print('Syncing ' + table + ' table...')
+            if model is Mutation:
+                key_columns = columns
+                delete = None
+            else:
+                key_columns = [model._meta.pk.column]
+                delete = functools.partial(self.delete_rows, model)
+
+            with dataload.LoadTimer(table, options['benchmark']) as timer:
+                rows, resolvers = self.read_rows(model, data_path, options)
+                counts = dataload.sync_rows(table, columns, key_columns, rows,
+                                            chunk_size=options['chunk_size'], delete=delete)
+                timer.rows = counts['received']
+            for resolver in resolvers:
+                resolver.raise_for_missing()
+
+            print('{table}: {inserted} inserted, {updated} updated, {deleted} deleted'.format(
+                table=table, **counts))
+            DatasetFile.objects.update_or_create(filename=filename, defaults={'sha256': digest})
+
+    def load_swap(self, options):
+        shadows = dataload.ShadowTables([model._meta.db_table for model, _, _ in DATA_FILES])
+        shadows.create()
+        try:
+            for model, filename, columns in DATA_FILES:
+                table = model._meta.db_table
+                print('Loading ' + table + ' shadow table...')
+                data_path = os.path.join(options['path'], filename)
+
+                with dataload.LoadTimer(table, options['benchmark']) as timer:
+                    rows, resolvers = self.read_rows(model, data_path, options, shadows)
+                    timer.rows = dataload.copy_rows(shadows.shadow(table), columns, rows,
+                                                    chunk_size=options['chunk_size'])
+                for resolver in resolvers:
+                    resolver.raise_for_missing()
+
+            print('Building indexes on shadow tables...')
+            shadows.build_indexes()
+
+            digests = {filename: dataload.file_digest(os.path.join(options['path'], filename))
+                       for _, filename, _ in DATA_FILES}
+
+            print('Swapping in shadow tables...')
+            with transaction.atomic():
+                shadows.swap()
+                for filename, digest in digests.items():
+                    DatasetFile.objects.update_or_create(filename=filename, defaults={'sha256': digest})
+        finally:
+            shadows.drop()
@@ -0,0 +1,399 @@
+import os
+import json
+import time
+import uuid
+import fcntl
+import atexit
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from api.pooled_postgresql import pool
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REQUEST_DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUEUE_WAIT_BUCKETS = (1, 5, 15, 60, 5 * 60, 15 * 60, 60 * 60, 4 * 60 * 60, 24 * 60 * 60)
+ATTEMPTS_BUCKETS = (1, 2, 3, 5, 10)
+
+QUEUE_CACHE_KEY = 'metrics:queue'
+
+# Only the statuses indexed by classifiers_claimable_idx, so the count reads
+# the active rows and not every classifier ever run.
+queue_sql = """
+SELECT status, priority, title, COUNT(*), EXTRACT(EPOCH FROM MIN(created_at))
+FROM classifiers
+WHERE status IN ('queued', 'in_progress', 'failed_retrying')
+GROUP BY status, priority, title
+"""
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(name, escape_label(value))
+                          for name, value in zip(names, values)) + '}'
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter(object):
+    """Monotonic count of events, by label values.
+
+    Each process counts its own, and `snapshot()` and `merge()` add up the
+    counts of several processes.
+    """
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+        process_files.changed()
+
+    def snapshot(self):
+        """This process's values as JSON, [[label values, value]]"""
+        with self.lock:
+            return [[list(label_values), value] for label_values, value in self.values.items()]
+
+    def merge(self, snapshots):
+        """One snapshot of the values summed over `snapshots`"""
+        values = {}
+        for snapshot in snapshots:
+            for label_values, value in snapshot:
+                label_values = tuple(label_values)
+                values[label_values] = values.get(label_values, 0) + value
+        return [[list(label_values), value] for label_values, value in values.items()]
+
+    def samples(self, snapshots):
+        for label_values, value in sorted(self.merge(snapshots)):
+            yield self.name, self.labels, tuple(label_values), value
+
+class Histogram(object):
+    """Observations counted into cumulative `le` buckets by label values, summed over processes like Counter"""
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        # label values: [count per bucket and +Inf, sum]
+        self.values = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts, total = self.values.get(label_values, ([0] * (len(self.buckets) + 1), 0))
+            counts[index] += 1
+            self.values[label_values] = (counts, total + value)
+        process_files.changed()
+
+    def snapshot(self):
+        with self.lock:
+            return [[list(label_values), [list(counts), total]]
+                    for label_values, (counts, total) in self.values.items()]
+
+    def merge(self, snapshots):
+        values = {}
+        for snapshot in snapshots:
+            for label_values, (counts, total) in snapshot:
+                label_values = tuple(label_values)
+                merged_counts, merged_total = values.get(label_values, ([0] * (len(self.buckets) + 1), 0))
+                values[label_values] = ([merged + count for merged, count in zip(merged_counts, counts)],
+                                        merged_total + total)
+        return [[list(label_values), [counts, total]] for label_values, (counts, total) in values.items()]
+
+    def samples(self, snapshots):
+        bucket_labels = self.labels + ('le',)
+        for label_values, (counts, total) in sorted(self.merge(snapshots)):
+            label_values = tuple(label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket', bucket_labels, label_values + (format_value(bound),), cumulative
+            yield self.name + '_sum', self.labels, label_values, total
+            yield self.name + '_count', self.labels, label_values, cumulative
+
+class Gauges(object):
+    """Gauge whose samples are read from `collect()`, a list of (label values, value), at render time"""
+    type = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labels = tuple(labels)
+
+    def samples(self, snapshots):
+        for label_values, value in self.collect():
+            yield self.name, self.labels, label_values, value
+
+class ProcessFiles(object):
+    """Counter and histogram values of every process on the host, shared through files in `directory`.
+
+    Like prometheus_client's multiprocess mode, each process writes a
+    snapshot of its own values to `<id>.json`, at most every `flush_seconds`
+    as they change and whenever it renders the metrics, and rendering adds
+    up the snapshots of all processes. A process holds an flock on its
+    `<id>.lock` for as long as it lives, so once gunicorn recycles a worker
+    its snapshot is folded into `aggregate.json` instead of piling up.
+    """
+
+    def __init__(self, directory, metrics, flush_seconds):
+        self.directory = directory
+        self.metrics = {metric.name: metric for metric in metrics}
+        self.flush_seconds = flush_seconds
+        self.lock = threading.Lock()
+        # Set in each process, after gunicorn forks it
+        self.pid = None
+        self.id = None
+        self.lock_file = None
+        self.flushed_at = 0
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def start(self):
+        if self.pid == os.getpid():
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self.id = '{0}-{1}'.format(os.getpid(), uuid.uuid4().hex)
+        # Locked before it is renamed into place, so no reader takes it for exited
+        lock_path = self.path(self.id + '.lock')
+        self.lock_file = open(lock_path + '.tmp', 'w')
+        fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        os.replace(lock_path + '.tmp', lock_path)
+        self.pid = os.getpid()
+
+    def stop(self):
+        """Write this process's last values, if it has any"""
+        if self.pid == os.getpid():
+            self.write()
+
+    def changed(self):
+        if time.time() - self.flushed_at >= self.flush_seconds:
+            self.write()
+
+    def write(self):
+        """Write this process's snapshot, logging rather than raising when it cannot.
+
+        Counting an event must never fail the request that caused it, ex a
+        classifier completing, so the next change after flush_seconds tries again.
+        """
+        with self.lock:
+            self.flushed_at = time.time()
+            try:
+                self.start()
+                snapshots = {name: metric.snapshot() for name, metric in self.metrics.items()}
+                write_json(self.path(self.id + '.json'), snapshots)
+            except OSError:
+                logger.exception('Could not write metrics to %s', self.directory)
+
+    @contextmanager
+    def merging(self):
+        """Excludes other processes folding in snapshots, which would briefly count them twice"""
+        with open(self.path('merge.lock'), 'w') as merge_lock:
+            fcntl.flock(merge_lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(merge_lock, fcntl.LOCK_UN)
+
+    def exited(self, process_id):
+        try:
+            lock_file = open(self.path(process_id + '.lock'))
+        except FileNotFoundError:
+            return False
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            return True
+
+    def fold_exited(self):
+        """Add the snapshots of processes that have exited to aggregate.json and remove them"""
+        exited = [filename[:-len('.lock')] for filename in os.listdir(self.directory)
+                  if filename.endswith('.lock') and filename != 'merge.lock' and
+                  filename[:-len('.lock')] != self.id and self.exited(filename[:-len('.lock')])]
+        if not exited:
+            return
+        aggregate = read_json(self.path('aggregate.json')) or {}
+        for process_id in exited:
+            snapshots = read_json(self.path(process_id + '.json')) or {}
+            for name, metric in self.metrics.items():
+                aggregate[name] = metric.merge([aggregate.get(name, []), snapshots.get(name, [])])
+        write_json(self.path('aggregate.json'), aggregate)
+        for process_id in exited:
+            for extension in ['.json', '.lock']:
+                if os.path.exists(self.path(process_id + extension)):
+                    os.remove(self.path(process_id + extension))
+
+    def read(self):
+        """{metric name: [snapshot of each process]}, this process's written first"""
+        self.write()
+        snapshots = {name: [] for name in self.metrics}
+        with self.merging():
+            self.fold_exited()
+            for filename in sorted(os.listdir(self.directory)):
+                if not filename.endswith('.json'):
+                    continue
+                for name, snapshot in (read_json(self.path(filename)) or {}).items():
+                    if name in snapshots:
+                        snapshots[name].append(snapshot)
+        return snapshots
+
+def write_json(path, value):
+    # Written whole and renamed into place, so readers never see half a file
+    partial_path = '{0}.{1}.tmp'.format(path, os.getpid())
+    with open(partial_path, 'w') as partial_file:
+        json.dump(value, partial_file)
+    os.replace(partial_path, path)
+
+def read_json(path):
+    try:
+        with open(path) as json_file:
+            return json.load(json_file)
+    except (IOError, ValueError):
+        return None
+
+def queue_rows():
+    """(status, priority, title, count, oldest created_at epoch) of active classifiers.
+
+    Cached for METRICS_QUEUE_CACHE_SECONDS so that however often the metrics
+    are scraped, each process counts the queue at most that often.
+    """
+    rows = cache.get(QUEUE_CACHE_KEY)
+    if rows is None:
+        with connection.cursor() as cursor:
+            cursor.execute(queue_sql)
+            rows = [(status, priority, title, count, float(oldest))
+                    for status, priority, title, count, oldest in cursor.fetchall()]
+        cache.set(QUEUE_CACHE_KEY, rows, settings.METRICS_QUEUE_CACHE_SECONDS)
+    return rows
+
+def queue_depth():
+    return [((status, priority, title), count) for status, priority, title, count, _ in queue_rows()]
+
+def queue_oldest_age():
+    now = time.time()
+    return [((status, priority, title), max(0.0, now - oldest))
+            for status, priority, title, _, oldest in queue_rows()]
+
+def pool_stat(name):
+    def collect():
+        return [((alias,), stats[name]) for alias, stats in sorted(pool.all_stats().items())]
+    return collect
+
+classifier_events = Counter('cognoma_classifier_events_total',
+                            'Classifiers claimed, completed, failed or released by workers.',
+                            labels=('event',))
+classifier_queue_wait = Histogram('cognoma_classifier_queue_wait_seconds',
+                                  'Time from creating a classifier to a worker first claiming it.',
+                                  QUEUE_WAIT_BUCKETS, labels=('title',))
+classifier_attempts = Histogram('cognoma_classifier_attempts',
+                                'Attempts a classifier took, observed when it completes or fails.',
+                                ATTEMPTS_BUCKETS, labels=('event',))
+request_duration = Histogram('cognoma_http_request_duration_seconds',
+                             'Time to respond to a request, by view.',
+                             REQUEST_DURATION_BUCKETS, labels=('view', 'method', 'status'))
+
+process_files = ProcessFiles(settings.METRICS_DIR,
+                             [classifier_events, classifier_queue_wait, classifier_attempts, request_duration],
+                             settings.METRICS_FLUSH_SECONDS)
+atexit.register(process_files.stop)
+
+registry = [
+    Gauges('cognoma_classifier_queue_depth',
+           'Classifiers queued, in progress or failed and awaiting a retry.',
+           queue_depth, labels=('status', 'priority', 'title')),
+    Gauges('cognoma_classifier_queue_oldest_age_seconds',
+           'Age of the oldest classifier with each status, priority and title.',
+           queue_oldest_age, labels=('status', 'priority', 'title')),
+    classifier_events,
+    classifier_queue_wait,
+    classifier_attempts,
+    request_duration,
+    Gauges('cognoma_database_pool_connections_in_use',
+           'Pooled database connections checked out in this process.',
+           pool_stat('in_use'), labels=('database',)),
+    Gauges('cognoma_database_pool_connections_idle',
+           'Pooled database connections idle in this process.',
+           pool_stat('idle'), labels=('database',)),
+]
+
+def claimed(classifiers):
+    now = time.time()
+    for classifier in classifiers:
+        classifier_events.inc('claimed')
+        if classifier.attempts == 1:
+            classifier_queue_wait.observe(max(0.0, now - classifier.created_at.timestamp()),
+                                          classifier.title)
+
+def completed(classifiers):
+    for classifier in classifiers:
+        classifier_events.inc('completed')
+        classifier_attempts.observe(classifier.attempts, 'completed')
+
+def failed(classifiers):
+    for classifier in classifiers:
+        classifier_events.inc('failed')
+        # Retried classifiers are only counted once they finally fail
+        if classifier.status == 'failed':
+            classifier_attempts.observe(classifier.attempts, 'failed')
+
+def released(classifiers):
+    for classifier in classifiers:
+        classifier_events.inc('released')
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    snapshots = process_files.read()
+    for metric in registry:
+        lines.append('# HELP {0} {1}'.format(metric.name, metric.help))
+        lines.append('# TYPE {0} {1}'.format(metric.name, metric.type))
+        for name, labels, label_values, value in metric.samples(snapshots.get(metric.name, [])):
+            lines.append('{0}{1} {2}'.format(name, format_labels(labels, label_values), format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+def view_name(view_func):
+    view_class = getattr(view_func, 'view_class', None) or getattr(view_func, 'cls', None)
+    return view_class.__name__ if view_class is not None else view_func.__name__
+
+class RequestMetricsMiddleware(object):
+    """Observes the duration of every request in request_duration, labelled by view"""
+
+    def process_request(self, request):
+        request.metrics_started_at = time.time()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.metrics_view = view_name(view_func)
+
+    def process_response(self, request, response):
+        started_at = getattr(request, 'metrics_started_at', None)
+        if started_at is not None:
+            request_duration.observe(time.time() - started_at,
+                                     getattr(request, 'metrics_view', 'unresolved'),
+                                     request.method,
+                                     str(response.status_code))
+        return response
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 12:30
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_datasetfile'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="""
+                CREATE FUNCTION notify_classifier_queue() RETURNS trigger AS $$
+                BEGIN
+                    PERFORM pg_notify('classifier_queue', NEW.title);
+                    RETURN NULL;
+                END;
+                $$ LANGUAGE plpgsql;
+
+                CREATE TRIGGER classifiers_notify_queue
+                AFTER INSERT OR UPDATE OF status ON classifiers
+                FOR EACH ROW
+                WHEN (NEW.status IN ('queued', 'failed_retrying'))
+                EXECUTE PROCEDURE notify_classifier_queue();
+            """,
+            reverse_sql="""
+                DROP TRIGGER classifiers_notify_queue ON classifiers;
+                DROP FUNCTION notify_classifier_queue();
+            """
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 13:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_classifier_queue_notify'),
+    ]
+
+    operations = [
+        # Only rows that can still be claimed are indexed, so the claim query
+        # does not slow down as completed and failed classifiers pile up.
+        migrations.RunSQL(
+            sql="""
+                CREATE INDEX classifiers_claimable_idx
+                ON classifiers (title, priority, created_at, id)
+                WHERE status IN ('queued', 'in_progress', 'failed_retrying');
+            """,
+            reverse_sql="DROP INDEX classifiers_claimable_idx;"
+        ),
+    ]
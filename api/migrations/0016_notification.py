@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 14:00
+from __future__ import unicode_literals
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_classifier_queue_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Notification',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('email', 'Email'), ('mailchimp', 'Mailchimp Subscription')], max_length=9)),
+                ('dedupe_key', models.CharField(max_length=255, unique=True)),
+                ('payload', django.contrib.postgres.fields.jsonb.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=7)),
+                ('attempts', models.IntegerField(default=0)),
+                ('next_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_error', models.TextField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('sent_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'db_table': 'notifications',
+            },
+        ),
+        # The dispatcher only ever looks at pending notifications that are due.
+        migrations.RunSQL(
+            sql="""
+                CREATE INDEX notifications_due_idx
+                ON notifications (next_attempt_at, id)
+                WHERE status = 'pending';
+            """,
+            reverse_sql="DROP INDEX notifications_due_idx;"
+        ),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 15:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_notification'),
+    ]
+
+    operations = [
+        # Bearer authentication looks users up with random_slugs @> ARRAY[slug],
+        # which only an index on the array elements can serve.
+        migrations.RunSQL(
+            sql="CREATE INDEX users_random_slugs_gin ON users USING GIN (random_slugs);",
+            reverse_sql="DROP INDEX users_random_slugs_gin;"
+        ),
+    ]
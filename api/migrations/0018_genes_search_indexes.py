@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 16:00
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_users_random_slugs_gin'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql="CREATE EXTENSION IF NOT EXISTS pg_trgm;",
+            reverse_sql=migrations.RunSQL.noop
+        ),
+        # Upper cased synonyms and aliases as |TERM|TERM|. array_to_string is
+        # only stable in general, but immutable for text arrays, and an index
+        # expression has to be immutable.
+        migrations.RunSQL(
+            sql="""
+                CREATE FUNCTION cognoma_gene_terms(text[], text[]) RETURNS text AS $$
+                    SELECT '|' || upper(array_to_string($1 || $2, '|')) || '|'
+                $$ LANGUAGE sql IMMUTABLE;
+            """,
+            reverse_sql="DROP FUNCTION cognoma_gene_terms(text[], text[]);"
+        ),
+        # Serve the gene search's LIKE patterns when the in-memory index is
+        # not built yet. loaddata --swap recreates both on the shadow table.
+        migrations.RunSQL(
+            sql="""
+                CREATE INDEX cognoma_genes_symbol_trgm
+                    ON cognoma_genes USING GIN (upper(symbol) gin_trgm_ops);
+                CREATE INDEX cognoma_genes_terms_trgm
+                    ON cognoma_genes USING GIN (cognoma_gene_terms(synonyms, aliases) gin_trgm_ops);
+            """,
+            reverse_sql="""
+                DROP INDEX cognoma_genes_symbol_trgm;
+                DROP INDEX cognoma_genes_terms_trgm;
+            """
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 18:00
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_genes_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='classifier',
+            name='lease',
+            field=models.IntegerField(null=True, verbose_name='lease in seconds requested by the worker, in place of the timeout'),
+        ),
+    ]
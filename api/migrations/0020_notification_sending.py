@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.9.8 on 2026-10-18 18:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_classifier_lease'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')], default='pending', max_length=7),
+        ),
+        # Claimed notifications are `sending` until their lease runs out.
+        migrations.RunSQL(
+            sql="""
+                DROP INDEX notifications_due_idx;
+                CREATE INDEX notifications_due_idx
+                ON notifications (next_attempt_at, id)
+                WHERE status IN ('pending', 'sending');
+            """,
+            reverse_sql="""
+                DROP INDEX notifications_due_idx;
+                CREATE INDEX notifications_due_idx
+                ON notifications (next_attempt_at, id)
+                WHERE status = 'pending';
+            """
+        ),
+    ]
@@ -28,6 +28,18 @@ PRIORITY_CHOICES = (
     (4, "Low")
 )
 
+NOTIFICATION_KIND_CHOICES = (
+    ("email", "Email"),
+    ("mailchimp", "Mailchimp Subscription")
+)
+
+NOTIFICATION_STATUS_CHOICES = (
+    ("pending", "Pending"),
+    ("sending", "Sending"),
+    ("sent", "Sent"),
+    ("failed", "Failed")
+)
+
 class User(models.Model):
     class Meta:
         db_table = "users"
@@ -75,6 +87,14 @@ class Mutation(models.Model):
     gene = models.ForeignKey(Gene, related_name='mutations')
     sample = models.ForeignKey(Sample, related_name='mutations')
 
+class DatasetFile(models.Model):
+    class Meta:
+        db_table = "dataset_files"
+
+    filename = models.CharField(primary_key=True, max_length=255) # ex "samples.tsv"
+    sha256 = models.CharField(max_length=64)
+    loaded_at = models.DateTimeField(auto_now=True)
+
 class Classifier(models.Model):
     class Meta:
         db_table = "classifiers"
@@ -107,6 +127,7 @@ class Classifier(models.Model):
     worker_id = models.CharField(null=True, max_length=255)
     priority = models.PositiveSmallIntegerField(choices=PRIORITY_CHOICES, default=3)
     timeout = models.IntegerField('timeout in seconds', default=600)
+    lease = models.IntegerField('lease in seconds requested by the worker, in place of the timeout', null=True)
     attempts = models.IntegerField(default=0)
     max_attempts = models.IntegerField('max number of times this job can attempt to run', default=1)
     fail_reason = models.CharField(null=True, max_length=255)
@@ -115,3 +136,20 @@ class Classifier(models.Model):
     started_at = models.DateTimeField(null=True)
     completed_at = models.DateTimeField(null=True)
     failed_at = models.DateTimeField(null=True)
+
+class Notification(models.Model):
+    """An email or Mailchimp subscription waiting in the outbox for dispatchnotifications"""
+    class Meta:
+        db_table = "notifications"
+
+    # id added by default
+    kind = models.CharField(choices=NOTIFICATION_KIND_CHOICES, max_length=9)
+    # Enqueuing the same key twice only keeps the first, ex "classifier-12-completed"
+    dedupe_key = models.CharField(max_length=255, unique=True)
+    payload = postgres_fields.JSONField()
+    status = models.CharField(choices=NOTIFICATION_STATUS_CHOICES, max_length=7, default='pending')
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True)
@@ -0,0 +1,135 @@
+import numpy as np
+from django.db import connection
+
+from api.versioned_index import VersionedIndex
+
+# One statement, so the version, samples and mutations all come from one
+# snapshot even while loaddata commits. Aggregates over the same rows see
+# them in the same order, so the arrays of each table line up.
+columns_sql = """
+SELECT
+    (SELECT MAX(loaded_at) FROM dataset_files),
+    sample_columns.*,
+    mutation_columns.*
+FROM
+    (SELECT array_agg(sample_id), array_agg(disease_id), array_agg(gender), array_agg(age_diagnosed)
+     FROM samples) AS sample_columns,
+    (SELECT array_agg(gene_id), array_agg(sample_id)
+     FROM mutations) AS mutation_columns
+"""
+
+class MutationIndex(object):
+    """Which samples each gene is mutated in, as bitmaps over sample ordinals.
+
+    Samples are numbered in sample_id order. Each gene with at least one
+    mutation gets a packed bitmap with bit `i` set when sample `i` is
+    mutated, so a union over any set of genes is a vectorized OR however
+    many mutation rows back it.
+    """
+
+    def __init__(self, version, sample_ids, columns, gene_ids, bitmaps):
+        self.version = version
+        self.sample_ids = sample_ids
+        # {name: (codes, labels)} where labels[codes[i]] is sample i's value
+        self.columns = columns
+        # Row i of bitmaps is the bitmap of gene_ids[i], in ascending order
+        self.gene_ids = gene_ids
+        self.bitmaps = bitmaps
+
+    @classmethod
+    def build(cls):
+        """Index the loaded dataset, with the columns of both tables read as arrays"""
+        with connection.cursor() as cursor:
+            cursor.execute(columns_sql)
+            version, sample_ids, diseases, genders, ages, gene_ids, mutation_sample_ids = cursor.fetchone()
+
+        sample_ids = np.array(sample_ids or [], dtype=str)
+        order = np.argsort(sample_ids, kind='mergesort')
+        sample_ids = sample_ids[order]
+
+        columns = {}
+        for name, values in [('disease', diseases), ('gender', genders), ('age_diagnosed', ages)]:
+            values = np.array(values or [], dtype=object)[order]
+            columns[name] = encode(values.tolist())
+
+        # The snapshot holds no mutation of a missing sample, so every one is found
+        ordinals = np.searchsorted(sample_ids, np.array(mutation_sample_ids or [], dtype=str))
+        gene_ids, rows = np.unique(np.array(gene_ids or [], dtype=np.int64), return_inverse=True)
+        # Laid out as np.packbits would, most significant bit first
+        bitmaps = np.zeros((len(gene_ids), (len(sample_ids) + 7) // 8), dtype=np.uint8)
+        np.bitwise_or.at(bitmaps, (rows, ordinals // 8), (0x80 >> (ordinals % 8)).astype(np.uint8))
+
+        return cls(version, sample_ids, columns, gene_ids, bitmaps)
+
+    def bitmap(self, gene_id):
+        """Packed bitmap of the samples `gene_id` is mutated in, None if it has no mutations"""
+        row = np.searchsorted(self.gene_ids, gene_id)
+        if row < len(self.gene_ids) and self.gene_ids[row] == gene_id:
+            return self.bitmaps[row]
+        return None
+
+    def any_mutations(self, gene_ids):
+        """Boolean mask of the samples mutated in at least one of `gene_ids`"""
+        packed = np.zeros((len(self.sample_ids) + 7) // 8, dtype=np.uint8)
+        for gene_id in gene_ids:
+            bitmap = self.bitmap(gene_id)
+            if bitmap is not None:
+                np.bitwise_or(packed, bitmap, out=packed)
+        return np.unpackbits(packed)[:len(self.sample_ids)].astype(bool)
+
+    def all_mutations(self, gene_ids):
+        """Boolean mask of the samples mutated in every one of `gene_ids`"""
+        packed = np.full((len(self.sample_ids) + 7) // 8, 0xff, dtype=np.uint8)
+        for gene_id in gene_ids:
+            bitmap = self.bitmap(gene_id)
+            if bitmap is None:
+                packed[:] = 0
+                break
+            np.bitwise_and(packed, bitmap, out=packed)
+        return np.unpackbits(packed)[:len(self.sample_ids)].astype(bool)
+
+    def samples(self, mask):
+        return self.sample_ids[mask].tolist()
+
+    def counts_by_disease(self, mask=None):
+        """{disease acronym: number of samples}, of all samples or those in `mask`"""
+        codes, diseases = self.columns['disease']
+        if mask is not None:
+            codes = codes[mask]
+        counts = np.bincount(codes, minlength=len(diseases))
+        return dict(zip(diseases, counts.tolist()))
+
+    def group_counts(self, mask, columns):
+        """[(labels, in mask, total)] for each combination of `columns` with any samples.
+
+        `columns` is a list of (codes, labels) like the values of `self.columns`.
+        """
+        shape = tuple(len(labels) for _, labels in columns)
+        keys = np.zeros(len(self.sample_ids), dtype=np.int64)
+        for codes, labels in columns:
+            keys = keys * len(labels) + codes
+
+        size = int(np.prod(shape))
+        totals = np.bincount(keys, minlength=size)
+        in_mask = np.bincount(keys[mask], minlength=size)
+
+        groups = []
+        for key in np.flatnonzero(totals):
+            positions = np.unravel_index(key, shape)
+            groups.append((tuple(labels[position] for position, (_, labels) in zip(positions, columns)),
+                           int(in_mask[key]),
+                           int(totals[key])))
+        return groups
+
+def encode(values):
+    """(codes, labels) for `values`, with labels sorted and None last"""
+    labels = sorted(set(values), key=lambda value: (value is None, value))
+    ordinals = {label: ordinal for ordinal, label in enumerate(labels)}
+    return np.array([ordinals[value] for value in values], dtype=np.int64), labels
+
+# Looked up when called, so tests can patch MutationIndex.build
+versions = VersionedIndex('mutations', lambda: MutationIndex.build())
+current = versions.current
+rebuild = versions.rebuild
+load_or_build = versions.load_or_build
+reset = versions.reset
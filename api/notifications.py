@@ -0,0 +1,182 @@
+import os
+import datetime
+
+import requests
+from django.core import mail
+from django.db import transaction, IntegrityError
+from django.utils import timezone
+
+from api.models import Notification
+
+# This URL including the list ID is hardcoded,
+# but we don't plan on changing it any time soon.
+MAILCHIMP_LIST_URL = "https://us14.api.mailchimp.com/3.0/lists/074bca87ce/members"
+MAILCHIMP_TIMEOUT_SECONDS = 10
+
+DEFAULT_BATCH_SIZE = 50
+
+# A notification that keeps failing is retried after 30s, 1m, 2m, ... up to
+# an hour apart, and given up on after MAX_ATTEMPTS.
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 30
+BACKOFF_MAX_SECONDS = 60 * 60
+
+# A claimed batch is marked `sending` until this long after the claim, after
+# which a dispatcher that died mid batch has its notifications claimed again.
+# Long enough for a batch of Mailchimp requests that all time out.
+SENDING_LEASE_SECONDS = 15 * 60
+
+claim_notifications_sql = """
+UPDATE notifications SET
+    status = 'sending',
+    next_attempt_at = %s
+WHERE id IN (
+    SELECT id
+    FROM notifications
+    WHERE
+        -- matches the predicate of the partial index notifications_due_idx
+        status IN ('pending', 'sending')
+        -- next_attempt_at is set from the app clock, so it is compared to that too
+        AND next_attempt_at <= %s
+    ORDER BY next_attempt_at, id
+    FOR UPDATE SKIP LOCKED
+    LIMIT %s
+)
+RETURNING *
+"""
+
+class PermanentFailure(Exception):
+    """A notification that will fail the same way however often it is retried"""
+    pass
+
+def enqueue(kind, dedupe_key, payload):
+    """Add a notification to the outbox, unless one with `dedupe_key` is already there.
+
+    Returns the Notification and whether it was created. Call it inside the
+    transaction making the change being notified about, so the notification
+    only goes out if that change commits.
+    """
+    try:
+        with transaction.atomic():
+            return Notification.objects.get_or_create(dedupe_key=dedupe_key,
+                                                      defaults={'kind': kind, 'payload': payload})
+    except IntegrityError:
+        # Lost a race with a concurrent enqueue of the same key
+        return Notification.objects.get(dedupe_key=dedupe_key), False
+
+def enqueue_email(dedupe_key, subject, message, from_email, recipient_list):
+    """Queue an email given the same arguments as `send_mail`"""
+    return enqueue('email', dedupe_key, {
+        'subject': subject,
+        'message': message,
+        'from_email': from_email,
+        'recipient_list': list(recipient_list)
+    })
+
+def enqueue_mailchimp_subscription(email_address):
+    return enqueue('mailchimp', 'mailchimp-subscribe-' + email_address, {'email_address': email_address})
+
+def backoff_seconds(attempts):
+    return min(BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), BACKOFF_MAX_SECONDS)
+
+def mark_sent(notification):
+    notification.attempts += 1
+    notification.status = 'sent'
+    notification.sent_at = timezone.now()
+    notification.last_error = None
+
+def mark_failed(notification, error, permanent=False):
+    notification.attempts += 1
+    notification.last_error = '{0}: {1}'.format(type(error).__name__, error)
+    if permanent or notification.attempts >= MAX_ATTEMPTS:
+        notification.status = 'failed'
+    else:
+        notification.status = 'pending'
+        notification.next_attempt_at = timezone.now() + \
+            datetime.timedelta(seconds=backoff_seconds(notification.attempts))
+
+def send_emails(notifications):
+    """Send emails over a single backend connection, marking each sent or failed"""
+    if not notifications:
+        return
+
+    connection = mail.get_connection(fail_silently=False)
+    try:
+        connection.open()
+    except Exception as error:
+        # Could not connect at all, retry every email in the batch later.
+        for notification in notifications:
+            mark_failed(notification, error)
+        return
+
+    try:
+        for notification in notifications:
+            message = mail.EmailMessage(notification.payload['subject'],
+                                        notification.payload['message'],
+                                        notification.payload['from_email'],
+                                        notification.payload['recipient_list'],
+                                        connection=connection)
+            try:
+                message.send()
+                mark_sent(notification)
+            except Exception as error:
+                mark_failed(notification, error)
+    finally:
+        connection.close()
+
+def subscribe_to_mailchimp(notification):
+    mailchimp_api_key = os.getenv("MAILCHIMP_API_KEY")
+    if mailchimp_api_key is None:
+        raise PermanentFailure('MAILCHIMP_API_KEY is not set')
+
+    response = requests.post(MAILCHIMP_LIST_URL,
+        json={"email_address": notification.payload['email_address'],
+              "status": "subscribed"},
+        auth=("anystring", mailchimp_api_key),
+        timeout=MAILCHIMP_TIMEOUT_SECONDS)
+    # 4xx, ex "Member Exists", will not go away by retrying.
+    if 400 <= response.status_code < 500:
+        raise PermanentFailure('Mailchimp responded {0}: {1}'.format(response.status_code, response.text))
+    response.raise_for_status()
+
+def claim(batch_size):
+    """Mark a batch of due notifications `sending` and commit, so no other dispatcher takes them"""
+    now = timezone.now()
+    with transaction.atomic():
+        return list(Notification.objects.raw(claim_notifications_sql,
+                                             [now + datetime.timedelta(seconds=SENDING_LEASE_SECONDS),
+                                              now,
+                                              batch_size]))
+
+def record(notification):
+    with transaction.atomic():
+        notification.save(update_fields=['status', 'attempts', 'next_attempt_at', 'last_error', 'sent_at'])
+
+def dispatch(batch_size=DEFAULT_BATCH_SIZE):
+    """Send one batch of due notifications. Returns how many were attempted.
+
+    The batch is claimed in a transaction of its own, so no transaction or
+    row lock is held while talking to SES or Mailchimp, and each result is
+    recorded as soon as it is known. A dispatcher that dies before recording
+    a result leaves it to be sent again once SENDING_LEASE_SECONDS pass.
+    """
+    notifications = claim(batch_size)
+
+    emails = [notification for notification in notifications if notification.kind == 'email']
+    send_emails(emails)
+    for notification in emails:
+        record(notification)
+
+    for notification in notifications:
+        if notification.kind != 'mailchimp':
+            continue
+        try:
+            subscribe_to_mailchimp(notification)
+            mark_sent(notification)
+        except PermanentFailure as error:
+            mark_failed(notification, error, permanent=True)
+        except requests.RequestException as error:
+            mark_failed(notification, error)
+        record(notification)
+
+    return len(notifications)
@@ -0,0 +1,68 @@
+"""PostgreSQL backend that reuses connections from a per-process pool.
+
+Closing a connection, which Django does at the end of every request unless
+CONN_MAX_AGE is set, returns it to the pool instead. Pool settings are read
+from the database's `POOL` dict: MAX_SIZE, TIMEOUT, MAX_AGE and
+HEALTH_CHECK_INTERVAL, the last three in seconds.
+"""
+import psycopg2
+from django.db.backends.postgresql import base, creation
+
+from api.pooled_postgresql import pool
+
+DEFAULT_POOL_OPTIONS = {
+    'MAX_SIZE': 8,
+    'TIMEOUT': 10,
+    'MAX_AGE': 30 * 60,
+    'HEALTH_CHECK_INTERVAL': 30,
+}
+
+class DatabaseCreation(creation.DatabaseCreation):
+
+    def _destroy_test_db(self, test_database_name, verbosity):
+        # Idle pooled connections would keep the test database from being dropped.
+        pool.close_all()
+        super(DatabaseCreation, self)._destroy_test_db(test_database_name, verbosity)
+
+class DatabaseWrapper(base.DatabaseWrapper):
+
+    def __init__(self, *args, **kwargs):
+        super(DatabaseWrapper, self).__init__(*args, **kwargs)
+        self.creation = DatabaseCreation(self)
+
+    def get_pool(self, conn_params):
+        options = dict(DEFAULT_POOL_OPTIONS)
+        options.update(self.settings_dict.get('POOL', {}))
+        return pool.get_pool(self.alias,
+                             conn_params,
+                             lambda: psycopg2.connect(**conn_params),
+                             {
+                                 'max_size': int(options['MAX_SIZE']),
+                                 'timeout': float(options['TIMEOUT']),
+                                 'max_age': float(options['MAX_AGE']),
+                                 'health_check_interval': float(options['HEALTH_CHECK_INTERVAL']),
+                             })
+
+    def get_new_connection(self, conn_params):
+        connection = self.get_pool(conn_params).acquire()
+
+        # Reused connections come back in autocommit mode, which older
+        # psycopg2 versions report as an isolation level. Django turns
+        # autocommit back on once isolation_level is known.
+        connection.autocommit = False
+
+        # As in the postgresql backend
+        options = self.settings_dict['OPTIONS']
+        try:
+            self.isolation_level = options['isolation_level']
+        except KeyError:
+            self.isolation_level = connection.isolation_level
+        else:
+            if self.isolation_level != connection.isolation_level:
+                connection.set_session(isolation_level=self.isolation_level)
+        return connection
+
+    def _close(self):
+        if self.connection is not None:
+            with self.wrap_database_errors:
+                self.get_pool(self.get_connection_params()).release(self.connection)
@@ -0,0 +1,205 @@
+import time
+import threading
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+class PoolTimeout(psycopg2.OperationalError):
+    """No connection became free within the pool's timeout"""
+    pass
+
+class ConnectionPool(object):
+    """Bounded pool of psycopg2 connections shared by the threads of a process.
+
+    Waiting is done on a threading.Condition, which eventlet's monkey
+    patching turns green, so a request waiting for a connection yields to
+    the others. Idle connections are handed out most recently used first
+    and checked with `SELECT 1` when they have been idle longer than
+    `health_check_interval`. Connections older than `max_age` are replaced.
+
+    Released connections are rolled back and reset with `DISCARD ALL`, so no
+    session settings, LISTENs, prepared statements or temporary tables of
+    one request leak into the next, and are closed if either fails.
+    """
+
+    def __init__(self, connect, max_size, timeout, max_age, health_check_interval):
+        self.connect = connect
+        self.max_size = max_size
+        self.timeout = timeout
+        self.max_age = max_age
+        self.health_check_interval = health_check_interval
+
+        self.condition = threading.Condition()
+        # (connection, created_at, released_at)
+        self.idle = deque()
+        # connection: created_at
+        self.in_use = {}
+        # Connections open or being opened, idle or in use
+        self.size = 0
+
+        self.created = 0
+        self.reused = 0
+        self.discarded = 0
+        self.health_check_failures = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        waited = False
+        while True:
+            entry = None
+            with self.condition:
+                while True:
+                    if self.idle:
+                        entry = self.idle.pop()
+                        break
+                    if self.size < self.max_size:
+                        # Reserve the slot, then connect without holding the lock.
+                        self.size += 1
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout('No database connection free after {0} seconds, all {1} in use'.format(
+                            self.timeout, self.max_size))
+                    if not waited:
+                        waited = True
+                        self.waits += 1
+                    self.condition.wait(remaining)
+
+            if entry is None:
+                try:
+                    connection = self.connect()
+                except Exception:
+                    with self.condition:
+                        self.size -= 1
+                        self.condition.notify()
+                    raise
+                created_at = time.monotonic()
+                self.created += 1
+            else:
+                connection, created_at, released_at = entry
+                if not self.healthy(connection, created_at, released_at):
+                    self.discard(connection)
+                    continue
+                self.reused += 1
+
+            with self.condition:
+                self.in_use[connection] = created_at
+                self.wait_seconds += time.monotonic() - started
+            return connection
+
+    def healthy(self, connection, created_at, released_at):
+        if connection.closed:
+            return False
+        now = time.monotonic()
+        if now - created_at > self.max_age:
+            return False
+        if now - released_at > self.health_check_interval:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+            except psycopg2.Error:
+                self.health_check_failures += 1
+                return False
+        return True
+
+    def release(self, connection):
+        with self.condition:
+            created_at = self.in_use.pop(connection, None)
+        if created_at is None:
+            # Not from this pool, or the pool was closed while it was in use.
+            connection.close()
+            return
+
+        try:
+            status = connection.get_transaction_status()
+            if status in (extensions.TRANSACTION_STATUS_INTRANS, extensions.TRANSACTION_STATUS_INERROR):
+                connection.rollback()
+            reusable = (status != extensions.TRANSACTION_STATUS_ACTIVE and
+                        not connection.closed and
+                        time.monotonic() - created_at <= self.max_age)
+            if reusable:
+                # DISCARD ALL cannot run in a transaction block. Django turns
+                # autocommit off again when it next acquires the connection.
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute('DISCARD ALL')
+        except psycopg2.Error:
+            reusable = False
+
+        if not reusable:
+            self.discard(connection)
+            return
+        with self.condition:
+            self.idle.append((connection, created_at, time.monotonic()))
+            self.condition.notify()
+
+    def discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+        with self.condition:
+            self.size -= 1
+            self.discarded += 1
+            self.condition.notify()
+
+    def close(self):
+        """Close the idle connections and forget the ones in use, which are closed when released"""
+        with self.condition:
+            idle = list(self.idle)
+            self.idle.clear()
+            self.size -= len(idle) + len(self.in_use)
+            self.in_use.clear()
+        for connection, _, _ in idle:
+            connection.close()
+
+    def stats(self):
+        with self.condition:
+            return {
+                'max_size': self.max_size,
+                'size': self.size,
+                'in_use': len(self.in_use),
+                'idle': len(self.idle),
+                'created': self.created,
+                'reused': self.reused,
+                'discarded': self.discarded,
+                'health_check_failures': self.health_check_failures,
+                'waits': self.waits,
+                'timeouts': self.timeouts,
+                'wait_seconds': self.wait_seconds,
+            }
+
+registry_lock = threading.Lock()
+# (alias, connection parameters): ConnectionPool
+pools = {}
+
+def get_pool(alias, conn_params, connect, options):
+    key = (alias, tuple(sorted((name, str(value)) for name, value in conn_params.items())))
+    with registry_lock:
+        if key not in pools:
+            pools[key] = ConnectionPool(connect, **options)
+        return pools[key]
+
+def close_all():
+    with registry_lock:
+        for pool in pools.values():
+            pool.close()
+
+def all_stats():
+    """{alias: stats} summed over the pools of each database alias"""
+    totals = {}
+    with registry_lock:
+        for (alias, _), pool in pools.items():
+            stats = pool.stats()
+            if alias in totals:
+                for name, value in stats.items():
+                    totals[alias][name] += value
+            else:
+                totals[alias] = stats
+    return totals
@@ -0,0 +1,127 @@
+import time
+import heapq
+import random
+import itertools
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+PROFILE_HEADER = 'HTTP_X_PROFILE'
+
+# Queries kept per profiled request, the slowest requests can run thousands.
+MAX_QUERIES = 200
+
+class SlowestRequests(object):
+    """Thread safe record of the `size` slowest profiles seen, as a min heap on duration"""
+
+    def __init__(self, size):
+        self.size = size
+        self.heap = []
+        # Breaks ties between equally slow requests without comparing profiles
+        self.counter = itertools.count()
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        entry = (profile['total_ms'], next(self.counter), profile)
+        with self.lock:
+            if len(self.heap) < self.size:
+                heapq.heappush(self.heap, entry)
+            elif entry[0] > self.heap[0][0]:
+                heapq.heapreplace(self.heap, entry)
+
+    def profiles(self):
+        """Profiles, slowest first"""
+        with self.lock:
+            entries = sorted(self.heap, reverse=True)
+        return [profile for _, _, profile in entries]
+
+    def clear(self):
+        with self.lock:
+            self.heap = []
+
+slowest = SlowestRequests(settings.PROFILING_SLOWEST)
+
+def should_profile(request):
+    if not settings.PROFILING_ENABLED:
+        return False
+    if request.META.get(PROFILE_HEADER) == '1':
+        return True
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+def server_timing(profile):
+    metrics = [
+        ('db', profile['db_ms'], '{0} queries'.format(profile['query_count'])),
+        ('view', profile['view_ms'], 'view and serialization, excluding db'),
+        ('render', profile['render_ms'], None),
+        ('total', profile['total_ms'], None),
+    ]
+    return ', '.join('{0};dur={1:.1f}'.format(name, duration) + ('' if desc is None else ';desc="{0}"'.format(desc))
+                     for name, duration, desc in metrics if duration is not None)
+
+class ProfilingMiddleware(object):
+    """Times the database, view and rendering of sampled requests.
+
+    Off unless PROFILING_ENABLED. Then a request is profiled when it sends
+    `X-Profile: 1`, or at random for PROFILING_SAMPLE_RATE of requests.
+    Profiled responses get a `Server-Timing` header, and the slowest
+    PROFILING_SLOWEST profiles are kept with their SQL for /status/profiles.
+    Queries are captured with Django's debug cursor, so requests that are not
+    profiled run exactly as before.
+    """
+
+    def process_request(self, request):
+        if not should_profile(request):
+            return
+        request.profile = {'started_at': time.time()}
+        # Django empties queries_log when each request starts
+        request.profile['query_offset'] = len(connection.queries_log)
+        connection.force_debug_cursor = True
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile['view_started_at'] = time.time()
+
+    def process_template_response(self, request, response):
+        # Responses that render, DRF's, are rendered after this returns
+        profile = getattr(request, 'profile', None)
+        if profile is not None:
+            profile['render_started_at'] = time.time()
+
+            def rendered(response):
+                profile['render_ms'] = (time.time() - profile['render_started_at']) * 1000
+            response.add_post_render_callback(rendered)
+        return response
+
+    def process_response(self, request, response):
+        profile = getattr(request, 'profile', None)
+        if profile is None:
+            return response
+        del request.profile
+        connection.force_debug_cursor = False
+
+        finished_at = time.time()
+        queries = list(connection.queries_log)[profile['query_offset']:]
+        db_ms = sum(float(query['time']) for query in queries) * 1000
+        view_ms = None
+        if 'view_started_at' in profile:
+            view_ms = ((profile.get('render_started_at', finished_at) - profile['view_started_at']) * 1000 -
+                       db_ms)
+
+        profile = {
+            'method': request.method,
+            'path': request.get_full_path(),
+            'status': response.status_code,
+            'started_at': profile['started_at'],
+            'total_ms': (finished_at - profile['started_at']) * 1000,
+            'db_ms': db_ms,
+            'query_count': len(queries),
+            'view_ms': None if view_ms is None else max(0.0, view_ms),
+            'render_ms': profile.get('render_ms'),
+            'queries': [{'sql': query['sql'], 'ms': float(query['time']) * 1000}
+                        for query in queries[:MAX_QUERIES]]
+        }
+        slowest.add(profile)
+        response['Server-Timing'] = server_timing(profile)
+        return response
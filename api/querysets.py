@@ -0,0 +1,163 @@
+from collections import OrderedDict
+
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.response import Response
+
+from api.renderers import UJSONRenderer
+
+DEFAULT_STREAM_CHUNK_SIZE = 2000
+
+def model_fields_by_name(model):
+    """Concrete fields by name and reverse relations by accessor name, ex "classifier_set" """
+    fields = {}
+    for field in model._meta.get_fields():
+        if field.auto_created and not field.concrete:
+            fields[field.get_accessor_name()] = field
+        else:
+            fields[field.name] = field
+    return fields
+
+def loading_plan(model, serializer, required=()):
+    """(only, select_related, prefetches) needed to render `model` instances with `serializer`.
+
+    `only` is None when the serializer reads something other than model
+    fields, in which case no column can safely be deferred.
+    """
+    serializer = getattr(serializer, 'child', serializer)
+    fields_by_name = model_fields_by_name(model)
+
+    only = {model._meta.pk.name}
+    only.update(required)
+    can_defer = True
+    select_related = []
+    prefetches = []
+
+    for field in serializer.fields.values():
+        model_field = fields_by_name.get(field.source)
+        if model_field is None:
+            # ex a property, which might read any column
+            can_defer = False
+            continue
+
+        nested = isinstance(field, serializers.BaseSerializer)
+        if not model_field.is_relation:
+            only.add(model_field.name)
+        elif model_field.many_to_many or model_field.one_to_many:
+            # The foreign key back to the parent is needed to attach each row to it.
+            parent_key = [model_field.field.name] if model_field.one_to_many else []
+            related_queryset = model_field.related_model.objects.all()
+            if nested:
+                related_queryset = for_serializer(related_queryset, field, parent_key)
+            else:
+                related_queryset = related_queryset.only(model_field.related_model._meta.pk.name, *parent_key)
+            prefetches.append(Prefetch(field.source, queryset=related_queryset))
+        else:
+            only.add(model_field.name)
+            if nested:
+                related_only, related_select, related_prefetches = loading_plan(model_field.related_model, field)
+                select_related.append(field.source)
+                select_related.extend(field.source + '__' + lookup for lookup in related_select)
+                if related_only is not None:
+                    only.update(field.source + '__' + name for name in related_only)
+                prefetches.extend(Prefetch(field.source + '__' + prefetch.prefetch_through,
+                                           queryset=prefetch.queryset)
+                                  for prefetch in related_prefetches)
+
+    return (only if can_defer else None), select_related, prefetches
+
+def for_serializer(queryset, serializer, required=()):
+    """Restrict `queryset` to what `serializer` renders.
+
+    Looks at the fields left on the serializer once `expand` and `fields`
+    have been applied. Only the columns it reads are loaded, expanded
+    foreign keys are joined with select_related and every to-many
+    relation is fetched with a single prefetch query, however many rows
+    there are.
+    """
+    only, select_related, prefetches = loading_plan(queryset.model, serializer, required)
+    if only is not None:
+        queryset = queryset.only(*only)
+    if select_related:
+        queryset = queryset.select_related(*select_related)
+    if prefetches:
+        queryset = queryset.prefetch_related(*prefetches)
+    return queryset
+
+class SerializerQuerySetMixin(object):
+    """Generic view mixin restricting the view's queryset with `for_serializer`"""
+
+    def get_queryset(self):
+        queryset = super(SerializerQuerySetMixin, self).get_queryset()
+        # Only the request is needed to apply `expand` and `fields`, and
+        # schema generation may call this before the rest of the context exists.
+        request = getattr(self, 'request', None)
+        context = {'request': request} if request is not None else {}
+        return for_serializer(queryset, self.get_serializer_class()(context=context))
+
+class ValuesListMixin(object):
+    """List view mixin rendering rows straight from values() instead of the serializer.
+
+    `values_fields` maps serializer field names to the values() lookup or
+    expression that produces them. The fields are the serializer's after
+    `fields` and `expand` are applied, so filtering them keeps working, and
+    requests for anything without a mapping, ex an expanded relation, go
+    through the serializer as before.
+    """
+    values_fields = {}
+    renderer_classes = (UJSONRenderer, BrowsableAPIRenderer)
+
+    def get_values_field_names(self):
+        """Names of the fields to render from values(), or None to use the serializer"""
+        serializer = self.get_serializer_class()(context=self.get_serializer_context())
+        names = []
+        for name, field in serializer.fields.items():
+            if isinstance(field, serializers.BaseSerializer) or name not in self.values_fields:
+                return None
+            names.append(name)
+        return names or None
+
+    def list(self, request, *args, **kwargs):
+        names = self.get_values_field_names()
+        if names is None:
+            return super(ValuesListMixin, self).list(request, *args, **kwargs)
+
+        lookups = {}
+        annotations = {}
+        for name in names:
+            source = self.values_fields[name]
+            if isinstance(source, str):
+                lookups[name] = source
+            else:
+                # Annotations cannot reuse the name of a model field, ex "mutations"
+                lookups[name] = 'values_' + name
+                annotations[lookups[name]] = source
+
+        queryset = (self.filter_queryset(self.get_queryset())
+                    .prefetch_related(None)
+                    .annotate(**annotations)
+                    .values(*lookups.values()))
+
+        page = self.paginate_queryset(queryset)
+        rows = page if page is not None else queryset
+        data = [OrderedDict((name, row[lookups[name]]) for name in names) for row in rows]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+def stream_values(queryset, key, chunk_size=DEFAULT_STREAM_CHUNK_SIZE):
+    """Yield lists of up to `chunk_size` rows of a values_list() `queryset`, in `key` order.
+
+    `key` is a unique field and the first column of the rows. Each chunk is
+    its own short query for the rows after the last key of the one before,
+    so memory use does not grow with the size of the result and nothing is
+    held open in the database while a StreamingHttpResponse sends a chunk.
+    """
+    queryset = queryset.order_by(key)
+    rows = list(queryset[:chunk_size])
+    while rows:
+        yield rows
+        if len(rows) < chunk_size:
+            return
+        rows = list(queryset.filter(**{key + '__gt': rows[-1][0]})[:chunk_size])
@@ -1,18 +1,40 @@
+import time
+import select
+
 from django.db import connection
 from api.models import Classifier
 
+# Channel the classifiers_notify_queue trigger notifies, with the classifier
+# title as payload, whenever a classifier becomes claimable.
+QUEUE_CHANNEL = 'classifier_queue'
+
+MAX_WAIT_SECONDS = 60
+
+# Leases expire without a notification, so long polls wake to claim when
+# the next one runs out, but not more often than this.
+MIN_LEASE_POLL_SECONDS = 1
+
+# Bounds for the lease, in seconds, a worker can ask for when claiming or
+# heartbeating. The lease lasts until the classifier is claimed again or
+# released, in place of the classifier's timeout. A classifier whose
+# lease runs out can be claimed again.
+MIN_LEASE_SECONDS = 5
+MAX_LEASE_SECONDS = 24 * 60 * 60
+
 get_classifiers_sql = """
 WITH nextClassifiers as (
     SELECT id, started_at, status
     FROM classifiers
     WHERE
        title = ANY(%s)
+       -- matches the predicate of the partial index classifiers_claimable_idx
+       AND status IN ('queued', 'in_progress', 'failed_retrying')
        AND (status = 'queued' OR
            (status = 'in_progress' AND
-            (NOW() > (locked_at + INTERVAL '1 second' * timeout))) OR
+            (NOW() > (locked_at + INTERVAL '1 second' * COALESCE(lease, timeout)))) OR
            (status = 'failed_retrying' AND
             attempts < max_attempts))
-    ORDER BY priority
+    ORDER BY priority, created_at, id
     FOR UPDATE SKIP LOCKED
     LIMIT %s
 )
@@ -20,6 +42,7 @@ UPDATE classifiers SET
     status = 'in_progress',
     worker_id = %s,
     locked_at = NOW(),
+    lease = %s,
     started_at =
         CASE WHEN nextClassifiers.started_at = null
              THEN NOW()
@@ -35,6 +58,15 @@ WHERE classifiers.id = nextClassifiers.id
 RETURNING classifiers.*;
 """
 
+# Seconds until the first in progress lease among the titles runs out
+next_lease_expiry_sql = """
+SELECT EXTRACT(EPOCH FROM MIN(locked_at + INTERVAL '1 second' * COALESCE(lease, timeout)) - NOW())
+FROM classifiers
+WHERE
+    title = ANY(%s)
+    AND status = 'in_progress'
+"""
+
 def dictfetchall(cursor):
     """Return all rows from a cursor as a list of dicts"""
     columns = [col[0] for col in cursor.description]
@@ -43,9 +75,98 @@ def dictfetchall(cursor):
         for row in cursor.fetchall()
     ]
 
-def get_classifiers(title, worker_id, limit=1):
+heartbeat_sql = """
+UPDATE classifiers SET
+    locked_at = NOW(),
+    lease = COALESCE(%s, lease)
+WHERE
+    id = %s
+    AND worker_id = %s
+    AND status = 'in_progress'
+RETURNING classifiers.*;
+"""
+
+batch_update_sql = """
+UPDATE classifiers SET
+    {assignments},
+    updated_at = NOW()
+FROM (VALUES {values}) AS batch ({columns})
+WHERE
+    classifiers.id = batch.id
+    AND classifiers.status = 'in_progress'
+    {worker_filter}
+RETURNING classifiers.*;
+"""
+
+complete_assignments = """
+    status = 'complete',
+    completed_at = NOW(),
+    failed_at = NULL,
+    notebook_file = batch.notebook_file
+"""
+
+fail_assignments = """
+    status =
+        CASE WHEN classifiers.attempts >= classifiers.max_attempts
+             THEN 'failed'
+             ELSE 'failed_retrying'
+        END,
+    failed_at = NOW(),
+    completed_at = NULL,
+    fail_reason = batch.fail_reason,
+    fail_message = batch.fail_message
+"""
+
+release_assignments = """
+    status = 'queued',
+    locked_at = NULL,
+    lease = NULL,
+    worker_id = NULL
+"""
+
+def batch_update(assignments, columns, rows, worker_id=None):
+    """Apply `assignments` to many in progress classifiers in a single UPDATE.
+
+    `rows` are tuples matching `columns`, the first of which must be `id`.
+    When `worker_id` is given only classifiers held by that worker are
+    updated. Returns the updated classifiers.
+    """
+    if not rows:
+        return []
+
+    params = [value for row in rows for value in row]
+    worker_filter = ''
+    if worker_id is not None:
+        worker_filter = 'AND classifiers.worker_id = %s'
+        params.append(worker_id)
+
+    row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    sql = batch_update_sql.format(assignments=assignments.strip(),
+                                  values=', '.join([row_placeholder] * len(rows)),
+                                  columns=', '.join(columns),
+                                  worker_filter=worker_filter)
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        raw_classifiers = dictfetchall(cursor)
+
+    return [Classifier(**raw_classifier) for raw_classifier in raw_classifiers]
+
+def complete_classifiers(notebooks, worker_id=None):
+    """Complete classifiers given (id, notebook_file name) pairs"""
+    return batch_update(complete_assignments, ['id', 'notebook_file'], notebooks, worker_id)
+
+def fail_classifiers(failures, worker_id=None):
+    """Fail classifiers given (id, fail_reason, fail_message) tuples"""
+    return batch_update(fail_assignments, ['id', 'fail_reason', 'fail_message'], failures, worker_id)
+
+def release_classifiers(ids, worker_id=None):
+    """Put in progress classifiers back in the queue"""
+    return batch_update(release_assignments, ['id'], [(id,) for id in ids], worker_id)
+
+def get_classifiers(title, worker_id, limit=1, lease=None):
     with connection.cursor() as cursor:
-        cursor.execute(get_classifiers_sql, [title, limit, worker_id])
+        cursor.execute(get_classifiers_sql, [title, limit, worker_id, lease])
         raw_classifiers = dictfetchall(cursor)
 
     classifiers = []
@@ -53,3 +174,76 @@ def get_classifiers(title, worker_id, limit=1):
         classifiers.append(Classifier(**raw_classifier))
 
     return classifiers
+
+def heartbeat(id, worker_id, lease=None):
+    """Renew the lease `worker_id` holds on an in progress classifier.
+
+    `lease` optionally replaces the lease taken when claiming. Returns the updated
+    classifier, or None when the worker does not hold the classifier.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(heartbeat_sql, [lease, id, worker_id])
+        raw_classifiers = dictfetchall(cursor)
+
+    if not raw_classifiers:
+        return None
+    return Classifier(**raw_classifiers[0])
+
+def seconds_until_lease_expiry(titles):
+    """Seconds until an in progress classifier with one of `titles` can be reclaimed, None if none are"""
+    with connection.cursor() as cursor:
+        cursor.execute(next_lease_expiry_sql, [titles])
+        seconds, = cursor.fetchone()
+    return None if seconds is None else float(seconds)
+
+def wait_for_notification(titles, timeout):
+    """Block until a queue notification for one of `titles` arrives or `timeout` passes.
+
+    The connection must already be listening on QUEUE_CHANNEL. Returns
+    whether a relevant notification arrived.
+    """
+    pg_connection = connection.connection
+    deadline = time.time() + timeout
+    while True:
+        # Notifications can also arrive while other queries run, in which
+        # case psycopg2 has already collected them.
+        payloads = [notify.payload for notify in pg_connection.notifies]
+        del pg_connection.notifies[:]
+        if any(payload in titles for payload in payloads):
+            return True
+
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return False
+        if select.select([pg_connection], [], [], remaining) == ([], [], []):
+            return False
+        pg_connection.poll()
+
+def get_classifiers_wait(title, worker_id, limit=1, wait=0, lease=None):
+    """Like get_classifiers, but waits up to `wait` seconds for work to be queued"""
+    classifiers = get_classifiers(title, worker_id, limit, lease)
+    if classifiers or wait <= 0:
+        return classifiers
+
+    deadline = time.time() + wait
+    with connection.cursor() as cursor:
+        cursor.execute('LISTEN ' + QUEUE_CHANNEL)
+    try:
+        while True:
+            # Claiming again after LISTEN closes the race with inserts
+            # that happened before we started listening.
+            classifiers = get_classifiers(title, worker_id, limit, lease)
+            if classifiers:
+                return classifiers
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return []
+            # An expiring lease makes a classifier claimable without a
+            # notification, so stop waiting when the next one does.
+            expiry = seconds_until_lease_expiry(title)
+            if expiry is not None:
+                remaining = min(remaining, max(expiry, MIN_LEASE_POLL_SECONDS))
+            wait_for_notification(title, remaining)
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('UNLISTEN ' + QUEUE_CHANNEL)
@@ -0,0 +1,22 @@
+import ujson
+from rest_framework.renderers import JSONRenderer
+
+class UJSONRenderer(JSONRenderer):
+    """JSONRenderer encoding with ujson, several times faster than the json module.
+
+    ujson only knows plain Python types, so anything else, ex a lazy
+    translation in an error message, is rendered by JSONRenderer instead.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return bytes()
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        try:
+            # Non-ASCII is escaped, which also covers the U+2028 and U+2029
+            # escaping JSONRenderer does for embedding in JavaScript.
+            return ujson.dumps(data, ensure_ascii=True, escape_forward_slashes=False,
+                               indent=indent or 0).encode('utf-8')
+        except (TypeError, OverflowError, ValueError):
+            return super(UJSONRenderer, self).render(data, accepted_media_type, renderer_context)
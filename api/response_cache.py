@@ -0,0 +1,76 @@
+import json
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, HttpResponseNotModified
+
+from api import dataset
+
+CACHE_ALIAS = 'responses'
+
+def cache_key(version, request):
+    """Key for the response to `request` while the dataset is at `version`.
+
+    Query params are sorted by name, so `?a=1&b=2` and `?b=2&a=1` share an
+    entry. Pagination links are absolute, so the scheme and host are part
+    of the key too.
+    """
+    key = json.dumps([version.isoformat(),
+                      request.build_absolute_uri('/'),
+                      request.path,
+                      sorted(request.query_params.lists()),
+                      request.accepted_renderer.format])
+    return 'response:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def etag_matches(etag, if_none_match):
+    """Whether an If-None-Match header matches `etag`, using weak comparison"""
+    for candidate in if_none_match.split(','):
+        candidate = candidate.strip()
+        if candidate == '*':
+            return True
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+class DatasetCacheMixin(object):
+    """Caching for views of data that only changes when loaddata runs.
+
+    While a dataset is loaded, JSON responses get a strong ETag and a
+    Cache-Control max-age, conditional requests with a matching
+    If-None-Match get a 304 without touching the view, and rendered
+    responses are kept in the `responses` cache until the next load.
+    """
+
+    def get(self, request, *args, **kwargs):
+        self.response_cache_key = None
+        version = dataset.version()
+        if version is None or request.accepted_renderer.format != 'json':
+            return super(DatasetCacheMixin, self).get(request, *args, **kwargs)
+
+        key = cache_key(version, request)
+        etag = '"{0}"'.format(key.split(':')[1])
+
+        if etag_matches(etag, request.META.get('HTTP_IF_NONE_MATCH', '')):
+            response = HttpResponseNotModified()
+        else:
+            cached = caches[CACHE_ALIAS].get(key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = super(DatasetCacheMixin, self).get(request, *args, **kwargs)
+                self.response_cache_key = key
+
+        response['ETag'] = etag
+        response['Cache-Control'] = 'public, max-age={0}'.format(settings.DATASET_CACHE_MAX_AGE)
+        return response
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super(DatasetCacheMixin, self).finalize_response(request, response, *args, **kwargs)
+        if getattr(self, 'response_cache_key', None) is not None and response.status_code == 200:
+            response.render()
+            caches[CACHE_ALIAS].set(self.response_cache_key, (response.content, response['Content-Type']))
+        return response
@@ -0,0 +1,92 @@
+import json
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+
+from api import mutation_index, dataset
+
+GROUP_BY_COLUMNS = ['disease', 'gender', 'age_bucket']
+AGE_BUCKET_SIZE = 10
+CACHE_TIMEOUT_SECONDS = 60 * 60
+
+group_by_sql = {
+    'disease': 'samples.disease_id',
+    'gender': 'samples.gender',
+    # Start of the bucket, ex 40 for ages 40 to 49
+    'age_bucket': '(samples.age_diagnosed / {size}) * {size}'.format(size=AGE_BUCKET_SIZE),
+}
+
+counts_sql = """
+SELECT
+    {columns},
+    COUNT(*) FILTER (WHERE samples.sample_id IN (
+        SELECT sample_id FROM mutations WHERE gene_id = ANY(%s))) AS mutated,
+    COUNT(*) AS total
+FROM samples
+GROUP BY {columns}
+"""
+
+def age_bucket_start(age):
+    return None if age is None else (age // AGE_BUCKET_SIZE) * AGE_BUCKET_SIZE
+
+def age_bucket_label(start):
+    """ex "40-49" for the bucket starting at 40"""
+    return None if start is None else '{0}-{1}'.format(start, start + AGE_BUCKET_SIZE - 1)
+
+def counts_from_index(index, gene_ids, group_by):
+    columns = []
+    for name in group_by:
+        if name == 'age_bucket':
+            codes, ages = index.columns['age_diagnosed']
+            bucket_codes, buckets = mutation_index.encode([age_bucket_start(age) for age in ages])
+            columns.append((bucket_codes[codes], buckets))
+        else:
+            columns.append(index.columns[name])
+    return index.group_counts(index.any_mutations(gene_ids), columns)
+
+def counts_from_sql(gene_ids, group_by):
+    sql = counts_sql.format(columns=', '.join(group_by_sql[name] for name in group_by))
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [list(gene_ids)])
+        return [(tuple(row[:-2]), row[-2], row[-1]) for row in cursor.fetchall()]
+
+def cache_key(version, gene_ids, group_by):
+    key = json.dumps([version.isoformat(), list(gene_ids), list(group_by)])
+    return 'sample-counts:' + hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def sample_counts(gene_ids, group_by):
+    """Mutated and total samples for each combination of the `group_by` columns.
+
+    A sample is mutated when it has a mutation in any of `gene_ids`. Results
+    are cached per dataset load, gene set and grouping.
+    """
+    gene_ids = sorted(set(gene_ids))
+    version = dataset.version()
+    if version is not None:
+        cached = cache.get(cache_key(version, gene_ids, group_by))
+        if cached is not None:
+            return cached
+
+    index = mutation_index.current()
+    if index is not None:
+        groups = counts_from_index(index, gene_ids, group_by)
+    else:
+        groups = counts_from_sql(gene_ids, group_by)
+
+    groups.sort(key=lambda group: [(value is None, value) for value in group[0]])
+    results = []
+    for values, mutated, total in groups:
+        result = OrderedDict()
+        for name, value in zip(group_by, values):
+            result[name] = age_bucket_label(value) if name == 'age_bucket' else value
+        result['mutated'] = mutated
+        result['total'] = total
+        results.append(result)
+
+    # Only cache counts that a later load will invalidate
+    if version is not None:
+        cache.set(cache_key(version, gene_ids, group_by), results, CACHE_TIMEOUT_SECONDS)
+    return results
@@ -6,6 +6,7 @@ from expander import ExpanderSerializerMixin
 from drf_dynamic_fields import DynamicFieldsMixin
 from django.conf import settings
 
+from api.auth import forget_user
 from api.models import User, Classifier, Disease, Sample, Mutation, Gene, PRIORITY_CHOICES, DEFAULT_CLASSIFIER_TITLE
 
 class UserSerializer(DynamicFieldsMixin, serializers.Serializer):
@@ -29,6 +30,7 @@ class UserSerializer(DynamicFieldsMixin, serializers.Serializer):
         instance.name = validated_data.get('name', instance.name)
         instance.email = validated_data.get('email', instance.email)
         instance.save()
+        forget_user(instance)
         return instance
 
     def to_representation(self, obj):
@@ -95,6 +97,7 @@ class ClassifierSerializer(DynamicFieldsMixin, ExpanderSerializerMixin, serializ
     worker_id = serializers.CharField(read_only=True)
     priority = serializers.ChoiceField(required=False, choices=PRIORITY_CHOICES, read_only=True)
     timeout = serializers.IntegerField(required=False, read_only=True)
+    lease = serializers.IntegerField(read_only=True)
     attempts = serializers.IntegerField(read_only=True)
     max_attempts = serializers.IntegerField(required=False, read_only=True)
     fail_reason = serializers.CharField(required=False, allow_blank=False, allow_null=False, max_length=255)
@@ -162,6 +165,11 @@ class ClassifierSerializer(DynamicFieldsMixin, ExpanderSerializerMixin, serializ
         instance.save()
         return instance
 
+class ClassifierFailureSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    fail_reason = serializers.CharField(allow_blank=False, max_length=255)
+    fail_message = serializers.CharField(allow_blank=False, max_length=1000)
+
 class SampleSerializer(DynamicFieldsMixin, ExpanderSerializerMixin, serializers.Serializer):
     class Meta:
         expandable_fields = {
@@ -0,0 +1,174 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase
+
+from api.management.commands import acquiredata
+
+commit_hash = 'a' * 40
+genes_commit_hash = 'b' * 40
+
+remote_files = {
+    '/{0}/data/samples.tsv'.format(commit_hash): b'sample_id\tacronym\tgender\tage_diagnosed\n' * 50,
+    '/{0}/data/mutation-matrix.tsv.bz2'.format(commit_hash): bytes(range(256)) * 40,
+    '/{0}/mapping/diseases.tsv'.format(commit_hash): b'acronym\tdisease\nGBM\tglioblastoma multiforme\n',
+    '/{0}/data/genes.tsv'.format(genes_commit_hash): b'entrez_gene_id\tsymbol\n1\tA1BG\n' * 20,
+}
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Serves `remote_files` with support for single `bytes=N-` ranges.
+
+    With `misaligned_ranges` set, ranges start 10 bytes early.
+    """
+    requests = []
+    misaligned_ranges = False
+
+    def do_GET(self):
+        range_header = self.headers.get('Range')
+        StandInHandler.requests.append((self.path, range_header))
+
+        if self.path not in remote_files:
+            self.send_error(404)
+            return
+
+        body = remote_files[self.path]
+        if range_header:
+            start = int(range_header.replace('bytes=', '').rstrip('-'))
+            if start >= len(body):
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{0}'.format(len(body)))
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if StandInHandler.misaligned_ranges:
+                start = max(0, start - 10)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(start, len(body) - 1, len(body)))
+            body = body[start:]
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+class AcquireDataTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super(AcquireDataTests, cls).setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+        cls.server_thread = threading.Thread(target=cls.server.serve_forever)
+        cls.server_thread.daemon = True
+        cls.server_thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super(AcquireDataTests, cls).tearDownClass()
+
+    def setUp(self):
+        StandInHandler.requests = []
+        StandInHandler.misaligned_ranges = False
+        self.data_path = tempfile.mkdtemp()
+        base_url = 'http://127.0.0.1:{0}'.format(self.server.server_port)
+        patches = [
+            patch.object(acquiredata, 'COMMIT_HASH', commit_hash),
+            patch.object(acquiredata, 'GENES_COMMIT_HASH', genes_commit_hash),
+            patch.object(acquiredata, 'REPO_URL_TEMPLATE', base_url + '/{commit_hash}/{directory}/{filename}'),
+            patch.object(acquiredata, 'GENES_URL_TEMPLATE', base_url + '/{commit_hash}/{directory}/{filename}'),
+        ]
+        for data_patch in patches:
+            data_patch.start()
+            self.addCleanup(data_patch.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def assert_data_files(self):
+        for remote_path, contents in remote_files.items():
+            with open(os.path.join(self.data_path, os.path.basename(remote_path)), 'rb') as data_file:
+                self.assertEqual(data_file.read(), contents)
+
+    def test_download_all_files(self):
+        call_command('acquiredata', path=self.data_path)
+
+        self.assert_data_files()
+        self.assertEqual(sorted(path for path, _ in StandInHandler.requests), sorted(remote_files.keys()))
+
+        with open(os.path.join(self.data_path, '.cache', 'manifests', commit_hash + '.json')) as manifest_file:
+            manifest = json.load(manifest_file)
+        self.assertEqual(manifest['diseases.tsv'],
+                         hashlib.sha256(remote_files['/{0}/mapping/diseases.tsv'.format(commit_hash)]).hexdigest())
+
+    def test_unchanged_commit_skips_network(self):
+        call_command('acquiredata', path=self.data_path)
+        for filename in os.listdir(self.data_path):
+            if filename != '.cache':
+                os.remove(os.path.join(self.data_path, filename))
+        StandInHandler.requests = []
+
+        call_command('acquiredata', path=self.data_path)
+
+        self.assert_data_files()
+        self.assertEqual(StandInHandler.requests, [])
+
+    def test_resume_partial_download(self):
+        remote_path = '/{0}/data/mutation-matrix.tsv.bz2'.format(commit_hash)
+        cache = acquiredata.DataCache(os.path.join(self.data_path, '.cache'))
+        with open(cache.partial_path(commit_hash, 'mutation-matrix.tsv.bz2'), 'wb') as partial_file:
+            partial_file.write(remote_files[remote_path][:1000])
+
+        call_command('acquiredata', path=self.data_path)
+
+        self.assert_data_files()
+        self.assertIn((remote_path, 'bytes=1000-'), StandInHandler.requests)
+
+    def test_resume_complete_partial_download(self):
+        remote_path = '/{0}/data/mutation-matrix.tsv.bz2'.format(commit_hash)
+        cache = acquiredata.DataCache(os.path.join(self.data_path, '.cache'))
+        with open(cache.partial_path(commit_hash, 'mutation-matrix.tsv.bz2'), 'wb') as partial_file:
+            partial_file.write(remote_files[remote_path])
+
+        call_command('acquiredata', path=self.data_path)
+
+        self.assert_data_files()
+        self.assertEqual([request for request in StandInHandler.requests if request[0] == remote_path],
+                         [(remote_path, 'bytes={0}-'.format(len(remote_files[remote_path])))])
+
+    def test_resume_misaligned_range(self):
+        StandInHandler.misaligned_ranges = True
+        remote_path = '/{0}/data/mutation-matrix.tsv.bz2'.format(commit_hash)
+        cache = acquiredata.DataCache(os.path.join(self.data_path, '.cache'))
+        with open(cache.partial_path(commit_hash, 'mutation-matrix.tsv.bz2'), 'wb') as partial_file:
+            partial_file.write(remote_files[remote_path][:1000])
+
+        call_command('acquiredata', path=self.data_path)
+
+        self.assert_data_files()
+        self.assertEqual([request for request in StandInHandler.requests if request[0] == remote_path],
+                         [(remote_path, 'bytes=1000-'), (remote_path, None)])
+
+    def test_checksum_mismatch(self):
+        cache = acquiredata.DataCache(os.path.join(self.data_path, '.cache'))
+        cache.record(commit_hash, 'samples.tsv', '0' * 64)
+
+        with self.assertRaisesRegex(CommandError, 'Checksum mismatch for samples.tsv'):
+            call_command('acquiredata', path=self.data_path)
+
+        self.assertFalse(os.path.exists(os.path.join(self.data_path, 'samples.tsv')))
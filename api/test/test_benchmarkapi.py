@@ -0,0 +1,60 @@
+import io
+import os
+import json
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TransactionTestCase
+
+from api.models import Sample, Classifier, DatasetFile
+from api import dataset
+
+class BenchmarkAPITests(TransactionTestCase):
+    # The load runs in threads with connections of their own, so the
+    # synthetic rows have to be committed.
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_smoke(self):
+        DatasetFile.objects.create(filename='samples.tsv', sha256='0' * 64)
+        version_before = dataset.read_version()
+        output = os.path.join(self.directory, 'report.json')
+
+        call_command('benchmarkapi', database=connection.settings_dict['NAME'], duration=0.5, workers=1, readers=2,
+                     samples=30, genes=20, mutations=3, historical=10, queued=5, output=output,
+                     stderr=io.StringIO())
+
+        with open(output) as report_file:
+            report = json.load(report_file)
+        self.assertGreater(report['total']['requests'], 0)
+        self.assertIn('GET /classifiers/queue', report['endpoints'])
+        for summary in report['endpoints'].values():
+            self.assertLessEqual(summary['p50_ms'], summary['p99_ms'])
+
+        # The synthetic rows are gone, and the dataset version moved past both them and the run
+        self.assertFalse(Sample.objects.filter(disease_id='BENCH').exists())
+        self.assertFalse(Classifier.objects.filter(title='benchmark').exists())
+        self.assertEqual(list(DatasetFile.objects.values_list('filename', flat=True)), ['samples.tsv'])
+        self.assertGreater(dataset.read_version(), version_before)
+
+    def test_requires_database_name(self):
+        DatasetFile.objects.create(filename='samples.tsv', sha256='0' * 64)
+        version_before = dataset.read_version()
+
+        for database in [None, 'cognoma']:
+            with self.assertRaises(CommandError):
+                call_command('benchmarkapi', database=database, duration=0.5, stderr=io.StringIO())
+
+        self.assertEqual(dataset.read_version(), version_before)
+
+    def test_summarize_without_requests(self):
+        from api.management.commands.benchmarkapi import Command
+
+        summary = Command().summarize([], 0, 0.5)
+
+        self.assertEqual((summary['requests'], summary['throughput'], summary['p99_ms']), (0, 0, None))
@@ -1,12 +1,18 @@
+import io
 import os
+import time
+import hashlib
+import threading
 from datetime import datetime, timedelta
 from unittest.mock import patch
 
 from django.conf import settings
-from rest_framework.test import APITestCase, APIClient
+from django.db import connection
+from rest_framework.test import APITestCase, APITransactionTestCase, APIClient
 
 from api.test.test_classifiers import classifier_keys
-from api.models import Classifier, Gene, Disease, DEFAULT_CLASSIFIER_TITLE
+from api.models import Classifier, Gene, Disease, User, DEFAULT_CLASSIFIER_TITLE
+from api import queue
 
 number_of_classifiers_created_initially = 1
 error_reason = 'default_error'
@@ -156,6 +162,253 @@ class ClassifierQueueTests(APITestCase):
         response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo')
         self.assertEqual(classifier4['id'], response.data[0]['id'])
 
+    def test_pull_from_queue_wait_with_queued_classifier(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        start = time.time()
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&wait=5')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        self.assertLess(time.time() - start, 5)
+
+    def test_pull_from_queue_wait_timeout(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo')
+        self.assertEqual(len(response.data), 1)
+
+        start = time.time()
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&wait=0.5')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+        self.assertGreaterEqual(time.time() - start, 0.5)
+
+    def test_pull_from_queue_wait_validation(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        for wait in ['-1', '61', 'nan', 'foo']:
+            response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&wait=' + wait)
+            self.assertEqual(response.status_code, 400)
+
+    def test_claim_query_uses_claimable_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN ' + queue.get_classifiers_sql, [[DEFAULT_CLASSIFIER_TITLE], 1, 'foo', None])
+            plan = '\n'.join(row[0] for row in cursor.fetchall())
+
+        self.assertIn('classifiers_claimable_idx', plan)
+
+    def test_pull_from_queue_fifo_within_priority(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        later = self.schedule_classifier()
+
+        first_response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo')
+        second_response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo')
+
+        self.assertLess(first_response.data[0]['id'], later['id'])
+        self.assertEqual(second_response.data[0]['id'], later['id'])
+
+    def test_heartbeat_extends_lease(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo')
+        classifier = response.data[0]
+        Classifier.objects.filter(id=classifier['id']).update(locked_at=datetime.utcnow() - timedelta(0, 300))
+
+        heartbeat_response = client.post('/classifiers/{id}/heartbeat'.format(id=classifier['id']),
+                                          data={'worker_id': 'foo', 'lease': 30},
+                                          format='json')
+
+        self.assertEqual(heartbeat_response.status_code, 200)
+        self.assertEqual(heartbeat_response.data['lease'], 30)
+        self.assertGreater(heartbeat_response.data['locked_at'], classifier['locked_at'])
+
+    def test_heartbeat_from_other_worker(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo')
+        classifier = response.data[0]
+
+        heartbeat_response = client.post('/classifiers/{id}/heartbeat'.format(id=classifier['id']),
+                                          data={'worker_id': 'bar'},
+                                          format='json')
+        self.assertEqual(heartbeat_response.status_code, 409)
+
+        heartbeat_response = client.post('/classifiers/999999/heartbeat', data={'worker_id': 'foo'}, format='json')
+        self.assertEqual(heartbeat_response.status_code, 404)
+
+    def test_heartbeat_auth(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token)
+
+        response = client.post('/classifiers/1/heartbeat', data={'worker_id': 'foo'}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+
+    def test_short_lease_is_reclaimed(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&lease=10')
+        classifier = response.data[0]
+        self.assertEqual(classifier['lease'], 10)
+        self.assertEqual(classifier['timeout'], 600)
+
+        # Lease expired, the worker stopped heartbeating
+        Classifier.objects.filter(id=classifier['id']).update(locked_at=datetime.utcnow() - timedelta(0, 20))
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=bar')
+        self.assertEqual(len(response.data), 1)
+        self.assertEqual(response.data[0]['id'], classifier['id'])
+        self.assertEqual(response.data[0]['worker_id'], 'bar')
+
+    def test_lease_validation(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        for lease in ['1', '100000', 'foo', '30.5']:
+            response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&lease=' + lease)
+            self.assertEqual(response.status_code, 400)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo')
+        classifier = response.data[0]
+        for lease in [30.5, True, '30.5']:
+            heartbeat_response = client.post('/classifiers/{id}/heartbeat'.format(id=classifier['id']),
+                                              data={'worker_id': 'foo', 'lease': lease},
+                                              format='json')
+            self.assertEqual(heartbeat_response.status_code, 400)
+
+    def test_lease_is_not_kept_by_later_claims(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&lease=10')
+        classifier = response.data[0]
+
+        release_response = client.post('/classifiers/release', data={'ids': [classifier['id']], 'worker_id': 'foo'},
+                                       format='json')
+        self.assertEqual(release_response.status_code, 200)
+        self.assertIsNone(Classifier.objects.get(id=classifier['id']).lease)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=bar')
+        self.assertEqual(response.data[0]['id'], classifier['id'])
+        self.assertIsNone(response.data[0]['lease'])
+        self.assertEqual(response.data[0]['timeout'], 600)
+
+    def test_null_worker_id(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo')
+        classifier = response.data[0]
+
+        heartbeat_response = client.post('/classifiers/{id}/heartbeat'.format(id=classifier['id']),
+                                          data={'worker_id': None},
+                                          format='json')
+        self.assertEqual(heartbeat_response.status_code, 400)
+
+        # A null worker_id is no filter, not the worker "None"
+        release_response = client.post('/classifiers/release', data={'ids': [classifier['id']], 'worker_id': None},
+                                       format='json')
+        self.assertEqual(release_response.status_code, 200)
+        self.assertEqual(Classifier.objects.get(id=classifier['id']).status, 'queued')
+
+    def claim(self, client, limit, worker_id='foo'):
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=' + worker_id +
+                              '&limit=' + str(limit))
+        self.assertEqual(len(response.data), limit)
+        return [classifier['id'] for classifier in response.data]
+
+    def test_batch_fail(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+        self.schedule_classifier(max_attempts=2)
+        ids = self.claim(client, 2)
+
+        response = client.post('/classifiers/fail', data={'classifiers': [
+            {'id': ids[0], 'fail_reason': error_reason, 'fail_message': error_message},
+            {'id': ids[1], 'fail_reason': error_reason, 'fail_message': error_message},
+            {'id': 999999, 'fail_reason': error_reason, 'fail_message': error_message},
+            {'id': ids[0]},
+        ]}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        outcomes = {(result['id'], result['outcome']) for result in response.data['results']}
+        self.assertEqual(outcomes, {(ids[0], 'invalid'), (ids[0], 'updated'), (ids[1], 'updated'), (999999, 'not_found')})
+        statuses = dict(Classifier.objects.filter(id__in=ids).values_list('max_attempts', 'status'))
+        self.assertEqual(statuses, {1: 'failed', 2: 'failed_retrying'})
+        self.assertEqual(Classifier.objects.get(id=ids[0]).fail_message, error_message)
+
+    def test_batch_release(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+        self.schedule_classifier()
+        ids = self.claim(client, 2)
+
+        response = client.post('/classifiers/release', data={'ids': ids, 'worker_id': 'bar'}, format='json')
+        self.assertEqual([result['outcome'] for result in response.data['results']], ['conflict', 'conflict'])
+
+        response = client.post('/classifiers/release', data={'ids': ids + ['x'], 'worker_id': 'foo'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['outcome'] for result in response.data['results']], ['invalid', 'updated', 'updated'])
+        self.assertEqual(set(Classifier.objects.filter(id__in=ids).values_list('status', flat=True)), {'queued'})
+
+    def test_batch_complete(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+        self.schedule_classifier()
+        ids = self.claim(client, 2)
+
+        notebook_path = os.path.join(settings.BASE_DIR, 'api/test/fixtures/test_notebook.ipynb')
+        with open(notebook_path, mode='rb') as notebook_file:
+            notebook_name = 'notebooks/{0}.ipynb'.format(hashlib.sha256(notebook_file.read()).hexdigest())
+        with open(notebook_path, mode='rb') as first_notebook, open(notebook_path, mode='rb') as second_notebook:
+            response = client.post('/classifiers/complete',
+                                   data={'notebook_file_' + str(ids[0]): first_notebook,
+                                         'notebook_file_' + str(ids[1]): second_notebook,
+                                         'worker_id': 'foo'},
+                                   format='multipart')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['status'] for result in response.data['results']], ['complete', 'complete'])
+        for classifier in Classifier.objects.filter(id__in=ids):
+            self.assertEqual(classifier.status, 'complete')
+            # The same notebook is stored once and shared
+            self.assertEqual(classifier.notebook_file.name, notebook_name)
+
+    def test_batch_complete_conflict_stores_nothing(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+        ids = self.claim(client, 1)
+
+        notebook = io.BytesIO(b'{"cells": [], "held_by": "foo"}')
+        notebook.name = 'notebook.ipynb'
+        notebook_name = 'notebooks/{0}.ipynb'.format(hashlib.sha256(notebook.getvalue()).hexdigest())
+        response = client.post('/classifiers/complete',
+                               data={'notebook_file_' + str(ids[0]): notebook, 'worker_id': 'bar'},
+                               format='multipart')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['outcome'] for result in response.data['results']], ['conflict'])
+        self.assertFalse(Classifier._meta.get_field('notebook_file').storage.exists(notebook_name))
+
+    def test_batch_auth(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token)
+
+        response = client.post('/classifiers/release', data={'ids': [1]}, format='json')
+
+        self.assertEqual(response.status_code, 403)
+
     def test_release_classifier(self):
         client = APIClient()
         client.credentials(HTTP_AUTHORIZATION=self.service_token)
@@ -289,3 +542,59 @@ class ClassifierQueueTests(APITestCase):
         self.assertIsNotNone(classifier.notebook_file.name)
         self.assertEqual(upload_response.data['status'], 'complete')
 
+
+class ClassifierQueueLongPollTests(APITransactionTestCase):
+    # Notifications are only delivered on commit, so these tests need real transactions.
+
+    def setUp(self):
+        self.user = User.objects.create(random_slugs=['longpolluser'])
+        self.service_token = 'JWT ' + settings.AUTH_TOKEN
+
+    def schedule_classifier_later(self, delay, title=DEFAULT_CLASSIFIER_TITLE):
+        def schedule():
+            time.sleep(delay)
+            Classifier.objects.create(user=self.user, title=title)
+            connection.close()
+
+        thread = threading.Thread(target=schedule)
+        thread.start()
+        self.addCleanup(thread.join)
+
+    def test_wait_woken_by_new_classifier(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+        self.schedule_classifier_later(0.5)
+
+        start = time.time()
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&wait=10')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 1)
+        self.assertLess(time.time() - start, 5)
+
+    def test_wait_ignores_other_titles(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+        self.schedule_classifier_later(0.2, title='other-task')
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&wait=1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+
+    def test_wait_woken_by_expiring_lease(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.service_token)
+        classifier = Classifier.objects.create(user=self.user, title=DEFAULT_CLASSIFIER_TITLE)
+
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=foo&lease=10')
+        self.assertEqual(response.data[0]['id'], classifier.id)
+        # Expires in about a second, and nothing notifies when it does
+        Classifier.objects.filter(id=classifier.id).update(locked_at=datetime.utcnow() - timedelta(0, 9))
+
+        start = time.time()
+        response = client.get('/classifiers/queue?title=' + DEFAULT_CLASSIFIER_TITLE + '&worker_id=bar&wait=20')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([claimed['id'] for claimed in response.data], [classifier.id])
+        self.assertLess(time.time() - start, 10)
@@ -4,8 +4,10 @@ from unittest.mock import patch
 from rest_framework.test import APITestCase, APIClient
 
 from django.conf import settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
-from api.models import Disease, Gene, Classifier
+from api.models import Disease, Gene, Classifier, Sample, Mutation, Notification
 
 classifier_keys = ['id',
                    'title',
@@ -21,6 +23,7 @@ classifier_keys = ['id',
                    'worker_id',
                    'priority',
                    'timeout',
+                   'lease',
                    'attempts',
                    'max_attempts',
                    'fail_reason',
@@ -76,6 +79,18 @@ class ClassifierTests(APITestCase):
         self.assertEqual(response.status_code, 201)
         self.assertEqual(list(response.data.keys()), classifier_keys)
 
+    @patch.dict(os.environ, {'MAILCHIMP_API_KEY': 'test-key'})
+    def test_create_subscribe_without_email(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token)
+
+        classifier_post_data = self.classifier_post_data.copy()
+        classifier_post_data['subscribe'] = True
+        response = client.post('/classifiers', classifier_post_data, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(Notification.objects.filter(kind='mailchimp').exists())
+
     def test_create_from_internal_service(self):
         client = APIClient()
 
@@ -245,3 +260,32 @@ class ClassifierTests(APITestCase):
         self.assertTrue(isinstance(get_2_response.data['genes'][1], dict))
         self.assertTrue(isinstance(get_2_response.data['diseases'][0], dict))
         self.assertTrue(isinstance(get_2_response.data['diseases'][1], dict))
+
+    def expanded_classifier_queries(self, client, number_of_genes):
+        sample = Sample.objects.create(sample_id='TCGA-{0}'.format(number_of_genes), disease=self.disease1)
+        genes = [Gene.objects.create(entrez_gene_id=number_of_genes * 1000 + index,
+                                     symbol='GENE' + str(index),
+                                     description='foo',
+                                     gene_type='bar')
+                 for index in range(number_of_genes)]
+        Mutation.objects.bulk_create([Mutation(gene=gene, sample=sample) for gene in genes])
+
+        response = client.post('/classifiers', {
+            'genes': [gene.entrez_gene_id for gene in genes],
+            'diseases': [self.disease1.acronym, self.disease2.acronym]
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+
+        with CaptureQueriesContext(connection) as queries:
+            get_response = client.get('/classifiers/{id}?expand=user,genes,diseases'.format(id=response.data['id']))
+        self.assertEqual(get_response.status_code, 200)
+        self.assertEqual(len(get_response.data['genes']), number_of_genes)
+        self.assertEqual(len(get_response.data['genes'][0]['mutations']), 1)
+        return len(queries)
+
+    def test_expansion_query_count(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=self.token)
+
+        self.assertEqual(self.expanded_classifier_queries(client, 2),
+                         self.expanded_classifier_queries(client, 50))
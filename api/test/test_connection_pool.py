@@ -0,0 +1,176 @@
+import os
+import runpy
+import threading
+from unittest import skipUnless
+from unittest.mock import patch
+
+import psycopg2
+from psycopg2 import extensions
+from django.conf import settings
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+
+from api.pooled_postgresql import pool
+from api.pooled_postgresql.pool import ConnectionPool, PoolTimeout
+
+class FakeCursor(object):
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, params=None):
+        if self.connection.broken:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+        self.connection.queries.append(sql)
+
+class FakeConnection(object):
+
+    def __init__(self):
+        self.closed = 0
+        self.broken = False
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+        self.queries = []
+        self.rollbacks = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def get_transaction_status(self):
+        return self.status
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.status = extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+class ConnectionPoolTests(SimpleTestCase):
+
+    def make_pool(self, **options):
+        settings = {'max_size': 2, 'timeout': 0.1, 'max_age': 600, 'health_check_interval': 30}
+        settings.update(options)
+        return ConnectionPool(FakeConnection, **settings)
+
+    def test_reuses_connections(self):
+        connection_pool = self.make_pool()
+
+        first = connection_pool.acquire()
+        connection_pool.release(first)
+        second = connection_pool.acquire()
+
+        self.assertIs(second, first)
+        stats = connection_pool.stats()
+        self.assertEqual((stats['created'], stats['reused'], stats['in_use'], stats['idle']), (1, 1, 1, 0))
+
+    def test_waits_then_times_out(self):
+        connection_pool = self.make_pool()
+        held = [connection_pool.acquire(), connection_pool.acquire()]
+
+        with self.assertRaises(PoolTimeout):
+            connection_pool.acquire()
+
+        releaser = threading.Timer(0.02, connection_pool.release, [held[0]])
+        releaser.start()
+        self.assertIs(connection_pool.acquire(), held[0])
+        releaser.join()
+
+        stats = connection_pool.stats()
+        self.assertEqual((stats['size'], stats['waits'], stats['timeouts']), (2, 2, 1))
+
+    def test_rolls_back_open_transactions(self):
+        connection_pool = self.make_pool()
+        db_connection = connection_pool.acquire()
+        db_connection.status = extensions.TRANSACTION_STATUS_INERROR
+
+        connection_pool.release(db_connection)
+
+        self.assertEqual(db_connection.rollbacks, 1)
+        self.assertIs(connection_pool.acquire(), db_connection)
+
+    def test_resets_sessions(self):
+        connection_pool = self.make_pool()
+        db_connection = connection_pool.acquire()
+
+        connection_pool.release(db_connection)
+
+        self.assertEqual(db_connection.queries, ['DISCARD ALL'])
+        self.assertIs(connection_pool.acquire(), db_connection)
+
+    def test_discards_connections_that_fail_to_reset(self):
+        connection_pool = self.make_pool()
+        broken = connection_pool.acquire()
+        broken.broken = True
+
+        connection_pool.release(broken)
+
+        self.assertTrue(broken.closed)
+        self.assertIsNot(connection_pool.acquire(), broken)
+        self.assertEqual(connection_pool.stats()['discarded'], 1)
+
+    def test_health_check_replaces_broken_connections(self):
+        connection_pool = self.make_pool(health_check_interval=-1)
+        broken = connection_pool.acquire()
+        connection_pool.release(broken)
+        broken.broken = True
+
+        replacement = connection_pool.acquire()
+
+        self.assertIsNot(replacement, broken)
+        self.assertTrue(broken.closed)
+        stats = connection_pool.stats()
+        self.assertEqual((stats['size'], stats['health_check_failures'], stats['discarded']), (1, 1, 1))
+
+    def test_recycles_old_connections(self):
+        connection_pool = self.make_pool(max_age=10)
+        with patch('api.pooled_postgresql.pool.time.monotonic', return_value=100):
+            old = connection_pool.acquire()
+            connection_pool.release(old)
+        with patch('api.pooled_postgresql.pool.time.monotonic', return_value=111):
+            self.assertIsNot(connection_pool.acquire(), old)
+        self.assertTrue(old.closed)
+
+    def test_close_drops_idle_and_in_use(self):
+        connection_pool = self.make_pool()
+        idle = connection_pool.acquire()
+        in_use = connection_pool.acquire()
+        connection_pool.release(idle)
+
+        connection_pool.close()
+        connection_pool.release(in_use)
+
+        self.assertTrue(idle.closed)
+        self.assertTrue(in_use.closed)
+        self.assertEqual(connection_pool.stats()['size'], 0)
+
+@skipUnless(connection.vendor == 'postgresql' and connection.settings_dict['ENGINE'] == 'api.pooled_postgresql',
+            'Connection pooling is disabled')
+class PooledBackendTests(TransactionTestCase):
+
+    def test_close_returns_connection_to_pool(self):
+        connection.ensure_connection()
+        raw_connection = connection.connection
+        # As Django does at the end of every request
+        connection.close()
+        connection.ensure_connection()
+
+        self.assertIs(connection.connection, raw_connection)
+        self.assertIn(connection.alias, pool.all_stats())
+
+class GunicornConfigTests(SimpleTestCase):
+
+    def test_pool_covers_worker_connections(self):
+        config = runpy.run_path(os.path.join(settings.BASE_DIR, 'config/prod/gunicorn.conf'))
+
+        # Eventlet workers run worker_connections requests at once, each of
+        # which can hold a connection for as long as a long poll waits.
+        self.assertEqual(config['worker_class'], 'eventlet')
+        self.assertNotIn('threads', config)
+        if settings.DB_POOL_SIZE > 0:
+            self.assertGreaterEqual(settings.DB_POOL_SIZE, config['worker_connections'])
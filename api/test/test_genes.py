@@ -1,85 +1,162 @@
-# from rest_framework.test import APITestCase, APIClient
-#
-# from api.models import Gene
-# from api.views import GenePagination
-#
-# class GeneTests(APITestCase):
-#     gene_keys = ['entrez_gene_id',
-#                  'symbol',
-#                  'description',
-#                  'chromosome',
-#                  'gene_type',
-#                  'synonyms',
-#                  'aliases',
-#                  'mutations']
-#
-#     def setUp(self):
-#         self.gene1 = Gene.objects.create(entrez_gene_id=123456,
-#                                          symbol='GENE123',
-#                                          description='foo',
-#                                          chromosome='1',
-#                                          gene_type='bar',
-#                                          synonyms=['foo', 'bar'],
-#                                          aliases=['foo', 'bar'])
-#         self.gene2 = Gene.objects.create(entrez_gene_id=234567,
-#                                          symbol='GENE234',
-#                                          description='foo',
-#                                          chromosome='X',
-#                                          gene_type='bar',
-#                                          synonyms=['foo', 'bar'],
-#                                          aliases=['foo', 'bar'])
-#
-#     def test_list_genes(self):
-#         client = APIClient()
-#
-#         list_response = client.get('/genes')
-#
-#         self.assertEqual(list_response.status_code, 200)
-#         self.assertEqual(list(list_response.data.keys()), ['count',
-#                                                            'next',
-#                                                            'previous',
-#                                                            'results'])
-#         self.assertEqual(len(list_response.data['results']), 2)
-#         self.assertEqual(list(list_response.data['results'][0].keys()), self.gene_keys)
-#         self.assertEqual(list(list_response.data['results'][1].keys()), self.gene_keys)
-#
-#         number_of_genes_to_create = GenePagination.default_limit + 1
-#         for x in range(0, number_of_genes_to_create):
-#             Gene.objects.create(entrez_gene_id=x,
-#                                 symbol='GENE234',
-#                                 description='foo',
-#                                 chromosome='X',
-#                                 gene_type='bar',
-#                                 synonyms=['foo', 'bar'],
-#                                 aliases=['foo', 'bar'])
-#
-#         list_response = client.get('/genes')
-#         self.assertEqual(list_response.status_code, 200)
-#         self.assertEqual(list(list_response.data.keys()), ['count',
-#                                                            'next',
-#                                                            'previous',
-#                                                            'results'])
-#         self.assertEqual(len(list_response.data['results']), GenePagination.default_limit)
-#         self.assertEqual(list_response.data['count'], number_of_genes_to_create + 2)
-#
-#     def test_get_gene(self):
-#         client = APIClient()
-#
-#         get_response = client.get('/genes/' + str(self.gene1.entrez_gene_id))
-#
-#         self.assertEqual(get_response.status_code, 200)
-#         self.assertEqual(list(get_response.data.keys()), self.gene_keys)
-#
-#     def test_entrezid_filter(self):
-#         client = APIClient()
-#
-#         list_response = client.get('/genes?entrez_gene_id=123456')
-#
-#         self.assertEqual(list_response.status_code, 200)
-#         self.assertEqual(list(list_response.data.keys()), ['count',
-#                                                            'next',
-#                                                            'previous',
-#                                                            'results'])
-#         self.assertEqual(len(list_response.data['results']), 1)
-#         self.assertEqual(list(list_response.data['results'][0].keys()), self.gene_keys)
-#         self.assertEqual(list_response.data['results'][0]['entrez_gene_id'], 123456)
+
+from rest_framework.test import APITestCase, APIClient
+
+from api.models import Gene, DatasetFile
+from api.views import GenePagination
+from api import gene_index
+
+class GeneTests(APITestCase):
+    gene_keys = ['entrez_gene_id',
+                 'symbol',
+                 'description',
+                 'chromosome',
+                 'gene_type',
+                 'synonyms',
+                 'aliases',
+                 'mutations']
+
+    def setUp(self):
+        self.gene1 = Gene.objects.create(entrez_gene_id=123456,
+                                         symbol='GENE123',
+                                         description='foo',
+                                         chromosome='1',
+                                         gene_type='bar',
+                                         synonyms=['foo', 'bar'],
+                                         aliases=['foo', 'bar'])
+        self.gene2 = Gene.objects.create(entrez_gene_id=234567,
+                                         symbol='GENE234',
+                                         description='foo',
+                                         chromosome='X',
+                                         gene_type='bar',
+                                         synonyms=['foo', 'bar'],
+                                         aliases=['foo', 'bar'])
+
+    def test_list_genes(self):
+        client = APIClient()
+
+        list_response = client.get('/genes')
+
+        self.assertEqual(list_response.status_code, 200)
+        self.assertEqual(list(list_response.data.keys()), ['count',
+                                                           'next',
+                                                           'previous',
+                                                           'results'])
+        self.assertEqual(len(list_response.data['results']), 2)
+        self.assertEqual(list(list_response.data['results'][0].keys()), self.gene_keys)
+        self.assertEqual(list(list_response.data['results'][1].keys()), self.gene_keys)
+
+        number_of_genes_to_create = GenePagination.default_limit + 1
+        for x in range(0, number_of_genes_to_create):
+            Gene.objects.create(entrez_gene_id=x,
+                                symbol='GENE234',
+                                description='foo',
+                                chromosome='X',
+                                gene_type='bar',
+                                synonyms=['foo', 'bar'],
+                                aliases=['foo', 'bar'])
+
+        list_response = client.get('/genes')
+        self.assertEqual(list_response.status_code, 200)
+        self.assertEqual(list(list_response.data.keys()), ['count',
+                                                           'next',
+                                                           'previous',
+                                                           'results'])
+        self.assertEqual(len(list_response.data['results']), GenePagination.default_limit)
+        self.assertEqual(list_response.data['count'], number_of_genes_to_create + 2)
+
+    def test_get_gene(self):
+        client = APIClient()
+
+        get_response = client.get('/genes/' + str(self.gene1.entrez_gene_id))
+
+        self.assertEqual(get_response.status_code, 200)
+        self.assertEqual(list(get_response.data.keys()), self.gene_keys)
+
+    def test_entrezid_filter(self):
+        client = APIClient()
+
+        list_response = client.get('/genes?entrez_gene_id=123456')
+
+        self.assertEqual(list_response.status_code, 200)
+        self.assertEqual(list(list_response.data.keys()), ['count',
+                                                           'next',
+                                                           'previous',
+                                                           'results'])
+        self.assertEqual(len(list_response.data['results']), 1)
+        self.assertEqual(list(list_response.data['results'][0].keys()), self.gene_keys)
+        self.assertEqual(list_response.data['results'][0]['entrez_gene_id'], 123456)
+
+class GeneSearchTests(APITestCase):
+
+    def setUp(self):
+        gene_index.reset()
+        self.addCleanup(gene_index.reset)
+
+        for entrez_gene_id, symbol, synonyms, aliases in [
+                (7157, 'TP53', ['P53', 'LFS1'], ['tumor protein p53']),
+                (7158, 'TP53BP1', ['53BP1'], None),
+                (9540, 'TP53I3', ['PIG3'], ['TP53 inducible protein 3']),
+                (4609, 'MYC', ['MRTL', 'bHLHe39'], None),
+                (8626, 'TP63', ['TP53L', 'P63'], None),
+                (1, 'A1BG', None, None)]:
+            Gene.objects.create(entrez_gene_id=entrez_gene_id,
+                                symbol=symbol,
+                                description='foo',
+                                gene_type='protein-coding',
+                                synonyms=synonyms,
+                                aliases=aliases)
+
+    def search(self, query):
+        response = APIClient().get('/genes/search', query)
+        self.assertEqual(response.status_code, 200)
+        return [gene['symbol'] for gene in response.data['results']]
+
+    def assert_search(self, query, symbols):
+        # From the database, then from the in-memory index
+        self.assertEqual(self.search(query), symbols)
+        DatasetFile.objects.create(filename='genes.tsv', sha256='0' * 64)
+        gene_index.rebuild()
+        self.assertEqual(self.search(query), symbols)
+
+    def test_ranking(self):
+        self.assert_search({'q': 'tp53'}, ['TP53', 'TP53BP1', 'TP53I3', 'TP63'])
+
+    def test_alias_matches(self):
+        self.assert_search({'q': 'p6'}, ['TP63'])
+
+    def test_alias_matches_by_symbol(self):
+        # P53, P63 then PIG3 by alias, but ranked by symbol as the database ranks them
+        self.assert_search({'q': 'p'}, ['TP53', 'TP53I3', 'TP63'])
+
+    def test_case_insensitive(self):
+        self.assert_search({'q': 'BHLH'}, ['MYC'])
+
+    def test_limit(self):
+        self.assert_search({'q': 'TP', 'limit': 2}, ['TP53', 'TP53BP1'])
+
+    def test_no_matches(self):
+        self.assert_search({'q': 'ZZZ'}, [])
+
+    def test_like_characters_are_literal(self):
+        self.assert_search({'q': '%'}, [])
+
+    def test_result_fields(self):
+        response = APIClient().get('/genes/search', {'q': 'myc'})
+
+        self.assertEqual(response.data['q'], 'myc')
+        self.assertEqual(response.data['results'], [{
+            'entrez_gene_id': 4609,
+            'symbol': 'MYC',
+            'description': 'foo',
+            'chromosome': None,
+            'gene_type': 'protein-coding',
+            'synonyms': ['MRTL', 'bHLHe39'],
+            'aliases': None
+        }])
+
+    def test_invalid_params(self):
+        client = APIClient()
+
+        self.assertEqual(client.get('/genes/search').status_code, 400)
+        self.assertEqual(client.get('/genes/search', {'q': 'TP', 'limit': 'ten'}).status_code, 400)
+        self.assertEqual(client.get('/genes/search', {'q': 'TP', 'limit': 1000}).status_code, 400)
@@ -0,0 +1,339 @@
+import os
+import bz2
+import csv
+import io
+import shutil
+import tempfile
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.test import TestCase
+
+from api.models import Disease, Sample, Gene, Mutation, DatasetFile, User, Classifier
+from api import dataload
+
+diseases_tsv = """acronym\tdisease
+BLCA\tbladder urothelial carcinoma
+GBM\tglioblastoma multiforme
+"""
+
+samples_tsv = """sample_id\tacronym\tgender\tage_diagnosed
+TCGA-22-4593-01\tBLCA\tfemale\t37
+TCGA-2G-AALW-01\tGBM\tmale\t43
+TCGA-2G-AALW-02\tGBM\t\t
+"""
+
+genes_tsv = """entrez_gene_id\tsymbol\tdescription\tchromosome\tgene_type\tsynonyms\taliases
+1\tA1BG\talpha-1-B glycoprotein\t19\tprotein-coding\tA1B|ABG\talpha-1B-glycoprotein
+2\tA2M\talpha-2-macroglobulin\t12\tprotein-coding\tA2MD|CPAMD5\tC3 and PZP-like alpha-2-macroglobulin domain-containing protein 5
+9\tNAT1\tN-acetyltransferase 1\t8\tprotein-coding\tAAC1\tarylamide acetylase 1
+"""
+
+mutations_tsv = """sample_id\t1\t2\t9
+TCGA-22-4593-01\t1\t0\t1
+TCGA-2G-AALW-01\t0\t0\t0
+TCGA-2G-AALW-02\t0\t1\t1
+"""
+
+expected_mutations = [
+    (1, 'TCGA-22-4593-01'),
+    (9, 'TCGA-22-4593-01'),
+    (2, 'TCGA-2G-AALW-02'),
+    (9, 'TCGA-2G-AALW-02'),
+]
+
+def write_dataset(path, diseases=diseases_tsv, samples=samples_tsv, genes=genes_tsv, mutations=mutations_tsv):
+    for filename, contents in [('diseases.tsv', diseases),
+                               ('samples.tsv', samples),
+                               ('genes.tsv', genes)]:
+        with open(os.path.join(path, filename), 'w') as data_file:
+            data_file.write(contents)
+    with bz2.open(os.path.join(path, 'mutation-matrix.tsv.bz2'), 'wt') as mutation_file:
+        mutation_file.write(mutations)
+
+def dictreader_mutations(mutation_file):
+    # The original loaddata parsing loop, kept as the reference implementation.
+    mutation_reader = csv.DictReader(mutation_file, delimiter='\t')
+    for row in mutation_reader:
+        sample_id = row.pop('sample_id')
+        for entrez_gene_id, mutation_status in row.items():
+            if mutation_status == '1':
+                yield (entrez_gene_id, sample_id)
+
+class LoadDataTests(TestCase):
+
+    def setUp(self):
+        self.data_path = tempfile.mkdtemp()
+        write_dataset(self.data_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.data_path)
+
+    def loaded_mutations(self):
+        return sorted(Mutation.objects.values_list('gene_id', 'sample_id'))
+
+    def table_schema(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s ORDER BY indexname', [table])
+            indexes = cursor.fetchall()
+            cursor.execute("""
+                SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid)
+                FROM pg_constraint
+                WHERE conrelid = %s::regclass OR confrelid = %s::regclass
+                ORDER BY conname
+            """, [table, table])
+            constraints = cursor.fetchall()
+        return indexes, constraints
+
+    def test_iter_mutations(self):
+        mutation_path = os.path.join(self.data_path, 'mutation-matrix.tsv.bz2')
+
+        mutations = [(int(gene_id), sample_id) for gene_id, sample_id in dataload.iter_mutations(mutation_path)]
+
+        self.assertEqual(mutations, expected_mutations)
+
+    def test_iter_mutations_vectorized(self):
+        mutation_path = os.path.join(self.data_path, 'mutation-matrix.tsv.bz2')
+
+        for block_size in [1, 2, 500]:
+            mutations = list(dataload.iter_mutations_vectorized(mutation_path, block_size=block_size))
+            self.assertEqual(mutations, list(dataload.iter_mutations(mutation_path)))
+
+    def test_iter_mutations_vectorized_malformed(self):
+        mutation_path = os.path.join(self.data_path, 'mutation-matrix.tsv.bz2')
+        with bz2.open(mutation_path, 'wt') as mutation_file:
+            mutation_file.write('sample_id\t1\t2\nTCGA-22-4593-01\t1\n')
+
+        with self.assertRaises(ValueError):
+            list(dataload.iter_mutations_vectorized(mutation_path))
+
+    def test_parse_mutations_vectorized_ragged_rows(self):
+        # The block holds the right number of cells, but B's are shifted into A's row
+        text = 'sample_id\t1\t2\t3\nA\t1\t0\nB\t0\t1\t1\t1\n'
+
+        with self.assertRaises(ValueError):
+            list(dataload.parse_mutations_vectorized(io.StringIO(text)))
+
+    def test_parse_mutations_vectorized_matches_reference(self):
+        text = dataload.random_matrix(number_of_samples=30, number_of_genes=400)
+
+        self.assertEqual(list(dataload.parse_mutations_vectorized(io.StringIO(text), block_size=7)),
+                         list(dictreader_mutations(io.StringIO(text))))
+
+    def test_parse_mutations_vectorized_multi_character_cells(self):
+        text = 'sample_id\t1\t2\t3\nTCGA-22-4593-01\t00\t1\t10\nTCGA-2G-AALW-01\t1\t0\t0\n'
+
+        mutations = list(dataload.parse_mutations_vectorized(io.StringIO(text)))
+
+        self.assertEqual(mutations, list(dictreader_mutations(io.StringIO(text))))
+
+    def test_load_with_python_parser(self):
+        call_command('loaddata', path=self.data_path, parser='python')
+
+        self.assertEqual(self.loaded_mutations(), sorted(expected_mutations))
+
+    def test_load_with_copy(self):
+        call_command('loaddata', path=self.data_path, chunk_size=1)
+
+        self.assertEqual(Disease.objects.count(), 2)
+        self.assertEqual(Sample.objects.count(), 3)
+        self.assertEqual(Gene.objects.count(), 3)
+        self.assertEqual(self.loaded_mutations(), sorted(expected_mutations))
+
+        sample = Sample.objects.get(sample_id='TCGA-2G-AALW-02')
+        self.assertIsNone(sample.gender)
+        self.assertIsNone(sample.age_diagnosed)
+
+    def test_load_with_orm(self):
+        call_command('loaddata', path=self.data_path, mode='orm')
+
+        self.assertEqual(self.loaded_mutations(), sorted(expected_mutations))
+
+    def test_copy_rows_escapes_values(self):
+        Disease.objects.create(acronym='BLCA', name='bladder urothelial carcinoma')
+
+        copied = dataload.copy_rows(Disease._meta.db_table,
+                                    ['acronym', 'name'],
+                                    [('TAB', 'tab\there'), ('SLASH', 'back\\slash\nnewline')])
+
+        self.assertEqual(copied, 2)
+        self.assertEqual(Disease.objects.get(acronym='TAB').name, 'tab\there')
+        self.assertEqual(Disease.objects.get(acronym='SLASH').name, 'back\\slash\nnewline')
+
+    def test_copy_rows_arrays(self):
+        copied = dataload.copy_rows(Gene._meta.db_table,
+                                    ['entrez_gene_id', 'symbol', 'description', 'chromosome',
+                                     'gene_type', 'synonyms', 'aliases'],
+                                    [(5, 'GENE5', 'desc', None, 'ncRNA', ['a,b', 'c"d'], None)])
+
+        self.assertEqual(copied, 1)
+        gene = Gene.objects.get(entrez_gene_id=5)
+        self.assertIsNone(gene.chromosome)
+        self.assertEqual(gene.synonyms, ['a,b', 'c"d'])
+        self.assertIsNone(gene.aliases)
+
+    def test_foreign_key_resolver_single_query(self):
+        Disease.objects.create(acronym='BLCA', name='bladder urothelial carcinoma')
+        Disease.objects.create(acronym='GBM', name='glioblastoma multiforme')
+
+        with self.assertNumQueries(1):
+            diseases = dataload.ForeignKeyResolver(Disease)
+            resolved = [diseases.resolve(acronym) for acronym in ['BLCA', 'GBM', 'BLCA', 'LUAD']]
+
+        self.assertEqual(resolved, ['BLCA', 'GBM', 'BLCA', None])
+        self.assertEqual(diseases.missing, {'LUAD'})
+
+    def test_unknown_disease_acronyms_reported_together(self):
+        write_dataset(self.data_path, samples=samples_tsv +
+                      'TCGA-2G-AALW-03\tLUAD\tmale\t50\n' +
+                      'TCGA-2G-AALW-04\tACC\tmale\t51\n')
+
+        with self.assertRaisesRegex(CommandError, 'ACC, LUAD'):
+            call_command('loaddata', path=self.data_path)
+
+        self.assertEqual(Sample.objects.count(), 0)
+
+    def test_unknown_mutation_keys_roll_back(self):
+        write_dataset(self.data_path, mutations=mutations_tsv.replace('\t9\n', '\t404\n', 1) +
+                      'TCGA-UNKNOWN-01\t1\t0\t0\n')
+
+        with self.assertRaisesRegex(CommandError, '404'):
+            call_command('loaddata', path=self.data_path)
+
+        self.assertEqual(Mutation.objects.count(), 0)
+
+    def test_full_load_records_file_digests(self):
+        call_command('loaddata', path=self.data_path)
+
+        self.assertEqual(DatasetFile.objects.count(), 4)
+        self.assertEqual(DatasetFile.objects.get(filename='samples.tsv').sha256,
+                         dataload.file_digest(os.path.join(self.data_path, 'samples.tsv')))
+
+    def test_incremental_load_from_empty(self):
+        call_command('loaddata', path=self.data_path, incremental=True)
+
+        self.assertEqual(Disease.objects.count(), 2)
+        self.assertEqual(Sample.objects.count(), 3)
+        self.assertEqual(Gene.objects.count(), 3)
+        self.assertEqual(self.loaded_mutations(), sorted(expected_mutations))
+
+    def test_incremental_load_applies_only_changes(self):
+        call_command('loaddata', path=self.data_path)
+        mutation_ids = dict(((mutation.gene_id, mutation.sample_id), mutation.id)
+                            for mutation in Mutation.objects.all())
+
+        write_dataset(self.data_path,
+                      diseases=diseases_tsv.replace('glioblastoma multiforme', 'glioblastoma'),
+                      samples=samples_tsv.replace('TCGA-2G-AALW-01\tGBM\tmale\t43\n', ''),
+                      mutations=mutations_tsv
+                        .replace('TCGA-2G-AALW-01\t0\t0\t0\n', '')
+                        .replace('TCGA-2G-AALW-02\t0\t1\t1', 'TCGA-2G-AALW-02\t1\t1\t0'))
+
+        call_command('loaddata', path=self.data_path, incremental=True)
+
+        self.assertEqual(Disease.objects.get(acronym='GBM').name, 'glioblastoma')
+        self.assertFalse(Sample.objects.filter(sample_id='TCGA-2G-AALW-01').exists())
+        self.assertEqual(self.loaded_mutations(), [
+            (1, 'TCGA-22-4593-01'),
+            (1, 'TCGA-2G-AALW-02'),
+            (2, 'TCGA-2G-AALW-02'),
+            (9, 'TCGA-22-4593-01'),
+        ])
+        # Mutations that did not change keep their rows.
+        for key in [(1, 'TCGA-22-4593-01'), (9, 'TCGA-22-4593-01'), (2, 'TCGA-2G-AALW-02')]:
+            self.assertEqual(Mutation.objects.get(gene_id=key[0], sample_id=key[1]).id, mutation_ids[key])
+
+    def test_incremental_load_skips_unchanged_files(self):
+        call_command('loaddata', path=self.data_path)
+        Disease.objects.filter(acronym='GBM').update(name='edited')
+
+        call_command('loaddata', path=self.data_path, incremental=True)
+
+        self.assertEqual(Disease.objects.get(acronym='GBM').name, 'edited')
+
+    def test_incremental_load_removes_mutations_of_removed_samples(self):
+        call_command('loaddata', path=self.data_path)
+        user = User.objects.create(random_slugs=['abc'])
+        classifier = Classifier.objects.create(user=user)
+        classifier.genes.add(Gene.objects.get(entrez_gene_id=1))
+
+        # Only samples.tsv changes, the mutation matrix is skipped
+        write_dataset(self.data_path, samples=samples_tsv.replace('TCGA-22-4593-01\tBLCA\tfemale\t37\n', ''))
+
+        call_command('loaddata', path=self.data_path, incremental=True)
+
+        self.assertFalse(Sample.objects.filter(sample_id='TCGA-22-4593-01').exists())
+        self.assertEqual(self.loaded_mutations(), [(2, 'TCGA-2G-AALW-02'), (9, 'TCGA-2G-AALW-02')])
+        self.assertEqual(list(classifier.genes.values_list('entrez_gene_id', flat=True)), [1])
+
+    def test_incremental_load_removes_references_to_removed_genes(self):
+        call_command('loaddata', path=self.data_path)
+        user = User.objects.create(random_slugs=['abc'])
+        classifier = Classifier.objects.create(user=user)
+        classifier.genes.add(Gene.objects.get(entrez_gene_id=1), Gene.objects.get(entrez_gene_id=2))
+
+        write_dataset(self.data_path, genes='\n'.join(line for line in genes_tsv.split('\n')
+                                                      if not line.startswith('2\t')))
+
+        call_command('loaddata', path=self.data_path, incremental=True)
+
+        self.assertFalse(Gene.objects.filter(entrez_gene_id=2).exists())
+        self.assertEqual(self.loaded_mutations(), [(1, 'TCGA-22-4593-01'), (9, 'TCGA-22-4593-01'),
+                                                   (9, 'TCGA-2G-AALW-02')])
+        self.assertEqual(list(classifier.genes.values_list('entrez_gene_id', flat=True)), [1])
+
+    def test_incremental_and_swap_exclusive(self):
+        with self.assertRaisesRegex(CommandError, 'cannot be used together'):
+            call_command('loaddata', path=self.data_path, incremental=True, swap=True)
+
+    def test_incremental_load_rolls_back_on_unknown_keys(self):
+        call_command('loaddata', path=self.data_path)
+        write_dataset(self.data_path,
+                      diseases=diseases_tsv.replace('glioblastoma multiforme', 'glioblastoma'),
+                      samples=samples_tsv + 'TCGA-2G-AALW-03\tLUAD\tmale\t50\n')
+
+        with self.assertRaisesRegex(CommandError, 'LUAD'):
+            call_command('loaddata', path=self.data_path, incremental=True)
+
+        self.assertEqual(Disease.objects.get(acronym='GBM').name, 'glioblastoma multiforme')
+        self.assertEqual(Sample.objects.count(), 3)
+
+    def test_swap_load_replaces_tables(self):
+        call_command('loaddata', path=self.data_path)
+        tables = ['diseases', 'samples', 'cognoma_genes', 'mutations']
+        schemas = [self.table_schema(table) for table in tables]
+        user = User.objects.create(random_slugs=['abc'])
+        classifier = Classifier.objects.create(user=user)
+        classifier.genes.add(Gene.objects.get(entrez_gene_id=1))
+        classifier.diseases.add(Disease.objects.get(acronym='BLCA'))
+
+        write_dataset(self.data_path,
+                      diseases=diseases_tsv.replace('glioblastoma multiforme', 'glioblastoma'),
+                      mutations=mutations_tsv.replace('TCGA-2G-AALW-01\t0\t0\t0', 'TCGA-2G-AALW-01\t0\t1\t0'))
+
+        call_command('loaddata', path=self.data_path, swap=True)
+
+        self.assertEqual(Disease.objects.get(acronym='GBM').name, 'glioblastoma')
+        self.assertEqual(Sample.objects.count(), 3)
+        self.assertEqual(self.loaded_mutations(), sorted(expected_mutations + [(2, 'TCGA-2G-AALW-01')]))
+        self.assertEqual([self.table_schema(table) for table in tables], schemas)
+        self.assertEqual(list(classifier.genes.values_list('entrez_gene_id', flat=True)), [1])
+        self.assertEqual(list(classifier.diseases.values_list('acronym', flat=True)), ['BLCA'])
+
+        # The id sequence survives the swap.
+        mutation = Mutation.objects.create(gene_id=1, sample_id='TCGA-2G-AALW-01')
+        self.assertGreater(mutation.id, 0)
+
+    def test_swap_load_failure_keeps_live_tables(self):
+        call_command('loaddata', path=self.data_path)
+        write_dataset(self.data_path, samples=samples_tsv + 'TCGA-2G-AALW-03\tLUAD\tmale\t50\n')
+
+        with self.assertRaisesRegex(CommandError, 'LUAD'):
+            call_command('loaddata', path=self.data_path, swap=True)
+
+        self.assertEqual(Sample.objects.count(), 3)
+        self.assertEqual(self.loaded_mutations(), sorted(expected_mutations))
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT count(*) FROM pg_tables WHERE tablename LIKE '%%__shadow'")
+            self.assertEqual(cursor.fetchone()[0], 0)
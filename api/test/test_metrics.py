@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+
+from django.core.cache import cache
+from django.conf import settings
+from django.test import SimpleTestCase
+from rest_framework.test import APITestCase, APIClient
+
+from api.models import Classifier, User, DEFAULT_CLASSIFIER_TITLE
+from api import metrics
+
+def samples(text):
+    """{metric with labels: value} of a Prometheus text exposition"""
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+class MetricsTests(APITestCase):
+
+    def setUp(self):
+        cache.delete(metrics.QUEUE_CACHE_KEY)
+        user = User.objects.create(random_slugs=['metricsuser'])
+        for priority in [1, 3, 3]:
+            Classifier.objects.create(user=user, priority=priority)
+        Classifier.objects.create(user=user, status='complete')
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + settings.AUTH_TOKEN)
+
+    def get_metrics(self):
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        return samples(response.content.decode())
+
+    def depth(self, values, status, priority):
+        name = 'cognoma_classifier_queue_depth{{status="{0}",priority="{1}",title="{2}"}}'.format(
+            status, priority, DEFAULT_CLASSIFIER_TITLE)
+        return values.get(name)
+
+    def test_queue_depth(self):
+        values = self.get_metrics()
+
+        self.assertEqual(self.depth(values, 'queued', 1), 1)
+        self.assertEqual(self.depth(values, 'queued', 3), 2)
+        self.assertIsNone(self.depth(values, 'complete', 3))
+        self.assertGreaterEqual(values['cognoma_classifier_queue_oldest_age_seconds{{status="queued",'
+                                       'priority="3",title="{0}"}}'.format(DEFAULT_CLASSIFIER_TITLE)], 0)
+
+    def test_queue_depth_cached(self):
+        self.get_metrics()
+        Classifier.objects.filter(status='queued').delete()
+
+        self.assertEqual(self.depth(self.get_metrics(), 'queued', 3), 2)
+
+        cache.delete(metrics.QUEUE_CACHE_KEY)
+        self.assertIsNone(self.depth(self.get_metrics(), 'queued', 3))
+
+    def test_claim_events(self):
+        claimed = 'cognoma_classifier_events_total{event="claimed"}'
+        wait_count = 'cognoma_classifier_queue_wait_seconds_count{{title="{0}"}}'.format(DEFAULT_CLASSIFIER_TITLE)
+        before_wait_count = self.get_metrics().get(wait_count, 0)
+        before = self.get_metrics().get(claimed, 0)
+
+        response = self.client.get('/classifiers/queue', {'title': DEFAULT_CLASSIFIER_TITLE,
+                                                          'worker_id': 'worker-1',
+                                                          'limit': 2})
+        self.assertEqual(len(response.data), 2)
+
+        values = self.get_metrics()
+        self.assertEqual(values[claimed], before + 2)
+        self.assertEqual(values[wait_count], before_wait_count + 2)
+
+    def test_request_duration(self):
+        self.get_metrics()
+
+        values = self.get_metrics()
+
+        labels = 'view="Metrics",method="GET",status="200"'
+        self.assertGreaterEqual(values['cognoma_http_request_duration_seconds_count{' + labels + '}'], 1)
+        self.assertEqual(values['cognoma_http_request_duration_seconds_bucket{' + labels + ',le="+Inf"}'],
+                         values['cognoma_http_request_duration_seconds_count{' + labels + '}'])
+
+    def test_from_user(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer metricsuser')
+
+        response = client.get('/metrics')
+
+        self.assertEqual(response.status_code, 403)
+
+class HistogramTests(SimpleTestCase):
+
+    def test_cumulative_buckets(self):
+        histogram = metrics.Histogram('test_seconds', 'Test.', (1, 5), labels=('view',))
+        for value in [0.5, 1, 3, 10]:
+            histogram.observe(value, 'a')
+
+        lines = list(histogram.samples([histogram.snapshot()]))
+
+        self.assertEqual(lines, [
+            ('test_seconds_bucket', ('view', 'le'), ('a', '1'), 2),
+            ('test_seconds_bucket', ('view', 'le'), ('a', '5'), 3),
+            ('test_seconds_bucket', ('view', 'le'), ('a', '+Inf'), 4),
+            ('test_seconds_sum', ('view',), ('a',), 14.5),
+            ('test_seconds_count', ('view',), ('a',), 4),
+        ])
+
+    def test_escape_labels(self):
+        self.assertEqual(metrics.format_labels(('title',), ('a "b"\\\n',)), '{title="a \\"b\\"\\\\\\n"}')
+
+class ProcessFilesTests(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def start_process(self):
+        """A counter and the files it is shared through, standing in for one gunicorn worker"""
+        counter = metrics.Counter('test_total', 'Test.', labels=('event',))
+        return counter, metrics.ProcessFiles(self.directory, [counter], 60)
+
+    def test_summed_across_processes(self):
+        first, first_files = self.start_process()
+        second, second_files = self.start_process()
+        first.inc('claimed', amount=2)
+        second.inc('claimed', amount=3)
+        second.inc('failed')
+        second_files.write()
+
+        snapshots = first_files.read()
+
+        self.assertEqual(list(first.samples(snapshots['test_total'])), [
+            ('test_total', ('event',), ('claimed',), 5),
+            ('test_total', ('event',), ('failed',), 1),
+        ])
+
+    def test_exited_process_folded_in(self):
+        first, first_files = self.start_process()
+        second, second_files = self.start_process()
+        first.inc('claimed', amount=2)
+        second.inc('claimed', amount=3)
+        second_files.write()
+        # The worker exits, releasing its lock
+        second_files.lock_file.close()
+
+        snapshots = first_files.read()
+
+        self.assertEqual(list(first.samples(snapshots['test_total'])), [('test_total', ('event',), ('claimed',), 5)])
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted(['aggregate.json', 'merge.lock', first_files.id + '.json', first_files.id + '.lock']))
+
+    def test_write_errors_are_logged(self):
+        counter, process_files = self.start_process()
+        process_files.directory = os.path.join(self.directory, 'missing', 'file')
+        open(os.path.join(self.directory, 'missing'), 'w').close()
+
+        with self.assertLogs('api.metrics', level='ERROR'):
+            process_files.write()
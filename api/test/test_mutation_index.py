@@ -0,0 +1,128 @@
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase, APIClient
+
+from api.models import Sample, Disease, Mutation, Gene, DatasetFile
+from api import mutation_index, dataset
+
+class MutationIndexTests(APITestCase):
+
+    def setUp(self):
+        mutation_index.reset()
+        self.addCleanup(mutation_index.reset)
+
+        self.genes = [Gene.objects.create(entrez_gene_id=entrez_gene_id,
+                                          symbol='GENE' + str(entrez_gene_id),
+                                          description='foo',
+                                          gene_type='bar')
+                      for entrez_gene_id in [1, 2, 3, 4]]
+        self.blca = Disease.objects.create(acronym='BLCA', name='bladder urothelial carcinoma')
+        self.gbm = Disease.objects.create(acronym='GBM', name='glioblastoma multiforme')
+        # Enough samples that the bitmaps span several bytes
+        self.samples = [Sample.objects.create(sample_id='TCGA-{0:02d}'.format(number),
+                                              disease=self.blca if number % 3 else self.gbm,
+                                              gender='female',
+                                              age_diagnosed=40 + number)
+                        for number in range(20)]
+        mutated = {1: [0, 1, 2, 17], 2: [2, 3, 19], 3: [5]}
+        Mutation.objects.bulk_create([Mutation(gene_id=gene_id, sample=self.samples[number])
+                                      for gene_id, numbers in mutated.items()
+                                      for number in numbers])
+        DatasetFile.objects.create(filename='mutation-matrix.tsv.bz2', sha256='0' * 64)
+
+    def sample_ids(self, numbers):
+        return [self.samples[number].sample_id for number in numbers]
+
+    def get_samples(self, client, query):
+        response = client.get('/samples', query)
+        self.assertEqual(response.status_code, 200)
+        return sorted(response.data['results'], key=lambda sample: sample['sample_id'])
+
+    def test_union_and_intersection(self):
+        index = mutation_index.rebuild()
+
+        self.assertEqual(index.samples(index.any_mutations([1, 2])), self.sample_ids([0, 1, 2, 3, 17, 19]))
+        self.assertEqual(index.samples(index.all_mutations([1, 2])), self.sample_ids([2]))
+        self.assertEqual(index.samples(index.any_mutations([4, 999])), [])
+        self.assertEqual(index.samples(index.all_mutations([1, 4])), [])
+
+    def test_counts_by_disease(self):
+        index = mutation_index.rebuild()
+
+        self.assertEqual(index.counts_by_disease(), {'BLCA': 13, 'GBM': 7})
+        self.assertEqual(index.counts_by_disease(index.any_mutations([1, 2])), {'BLCA': 4, 'GBM': 2})
+
+    def test_filter_matches_sql(self):
+        client = APIClient()
+        queries = [
+            {'any_mutations': '1,2', 'limit': 100},
+            {'any_mutations': '2,1', 'disease': 'BLCA', 'limit': 100},
+            {'all_mutations': '1,2', 'limit': 100},
+            {'any_mutations': '4', 'limit': 100},
+        ]
+
+        with patch('api.mutation_index.MutationIndex.build') as build:
+            from_sql = [self.get_samples(client, query) for query in queries]
+            # Never built while serving a request
+            self.assertFalse(build.called)
+
+        mutation_index.rebuild()
+        with patch('api.views.Mutation.objects.filter') as mutation_filter:
+            from_index = [self.get_samples(client, query) for query in queries]
+            self.assertFalse(mutation_filter.called)
+
+        self.assertEqual(from_index, from_sql)
+        self.assertEqual([sample['sample_id'] for sample in from_index[0]], self.sample_ids([0, 1, 2, 3, 17, 19]))
+
+    def test_stale_after_load(self):
+        mutation_index.rebuild()
+        self.assertIsNotNone(mutation_index.current())
+
+        DatasetFile.objects.update(loaded_at=timezone.now())
+
+        with patch('api.mutation_index.MutationIndex.build') as build:
+            self.assertIsNone(mutation_index.current())
+            self.assertFalse(build.called)
+
+    @override_settings(DATASET_VERSION_CACHE_SECONDS=60)
+    def test_version_read_briefly_cached(self):
+        mutation_index.rebuild()
+        DatasetFile.objects.update(loaded_at=timezone.now())
+
+        with self.assertNumQueries(0):
+            self.assertIsNotNone(mutation_index.current())
+
+        dataset.read_version()
+        self.assertIsNone(mutation_index.current())
+
+    def test_no_dataset_loaded(self):
+        DatasetFile.objects.all().delete()
+
+        self.assertIsNone(mutation_index.current())
+        self.assertIsNone(mutation_index.load_or_build())
+
+    def test_built_once_per_load(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+
+        with self.settings(INDEX_DIR=index_dir):
+            index = mutation_index.load_or_build()
+            self.assertEqual(index.samples(index.any_mutations([3])), self.sample_ids([5]))
+
+            # A recycled worker loads what the first one saved
+            mutation_index.reset()
+            with patch('api.mutation_index.MutationIndex.build') as build:
+                index = mutation_index.load_or_build()
+                self.assertFalse(build.called)
+            self.assertEqual(index.samples(index.any_mutations([3])), self.sample_ids([5]))
+
+            # A running worker picks up the index loaddata saves after a new load
+            DatasetFile.objects.update(loaded_at=timezone.now())
+            self.assertIsNone(mutation_index.current())
+            mutation_index.load_or_build()
+            mutation_index.reset()
+            self.assertIsNotNone(mutation_index.current())
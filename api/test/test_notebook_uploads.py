@@ -0,0 +1,193 @@
+import os
+import gzip
+import time
+import hashlib
+from unittest.mock import patch
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from rest_framework.test import APITestCase, APIClient
+
+from api.models import Classifier, User
+from cognoma_site.custom_storages import gzip_bytes
+
+def read_notebook():
+    with open(os.path.join(settings.BASE_DIR, 'api/test/fixtures/test_notebook.ipynb'), mode='rb') as notebook_file:
+        return notebook_file.read()
+
+class NotebookUploadTests(APITestCase):
+
+    def setUp(self):
+        user = User.objects.create(random_slugs=['notebookuploaduser'])
+        self.classifier = Classifier.objects.create(user=user, status='in_progress', worker_id='worker-1')
+
+        self.notebook = read_notebook()
+        self.body = gzip_bytes(self.notebook)
+        self.digest = {
+            'size': len(self.body),
+            'md5': hashlib.md5(self.body).hexdigest()
+        }
+        self.name = 'notebooks/{0}.ipynb'.format(self.digest['md5'])
+
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION='JWT ' + settings.AUTH_TOKEN)
+
+    def path(self, suffix=''):
+        return '/classifiers/{id}/notebook-upload{suffix}'.format(id=self.classifier.id, suffix=suffix)
+
+    def put(self, upload, body):
+        # Upload URLs are authorized by their signature alone
+        return APIClient().put(upload['url'],
+                               data=body,
+                               content_type=upload['headers']['Content-Type'],
+                               HTTP_CONTENT_ENCODING=upload['headers']['Content-Encoding'],
+                               HTTP_CONTENT_MD5=upload['headers']['Content-MD5'])
+
+    def upload(self, body=None):
+        response = self.client.post(self.path(), self.digest, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['exists'])
+        self.assertEqual(response.data['method'], 'PUT')
+        return self.put(response.data, self.body if body is None else body)
+
+    def test_upload_and_confirm(self):
+        self.assertEqual(self.upload().status_code, 200)
+
+        response = self.client.post(self.path('/confirm'), dict(self.digest, worker_id='worker-1'), format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['status'], 'complete')
+        classifier = Classifier.objects.get(id=self.classifier.id)
+        self.assertEqual(classifier.notebook_file.name, self.name)
+        with default_storage.open(classifier.notebook_file.name) as notebook_file:
+            self.assertEqual(notebook_file.read(), self.notebook)
+
+    def test_already_stored(self):
+        self.assertEqual(self.upload().status_code, 200)
+        response = self.client.post(self.path('/confirm'), dict(self.digest, worker_id='worker-1'), format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.classifier = Classifier.objects.create(user=self.classifier.user, status='in_progress')
+        response = self.client.post(self.path(), self.digest, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'exists': True})
+
+        response = self.client.post(self.path('/confirm'), self.digest, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Classifier.objects.get(id=self.classifier.id).notebook_file.name, self.name)
+
+    def test_upload_with_other_content(self):
+        response = self.upload(body=self.body + b' ')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['code'], 'BadDigest')
+
+    def test_expired_upload_url(self):
+        response = self.client.post(self.path(), self.digest, format='json')
+
+        with patch('cognoma_site.custom_storages.time.time', return_value=time.time() + 60 * 60):
+            put_response = self.put(response.data, self.body)
+
+        self.assertEqual(put_response.status_code, 403)
+
+    def test_tampered_upload_url(self):
+        response = self.client.post(self.path(), self.digest, format='json')
+
+        put_response = self.put(dict(response.data, url=response.data['url'] + 'x'), self.body)
+
+        self.assertEqual(put_response.status_code, 403)
+
+    def test_confirm_before_upload(self):
+        response = self.client.post(self.path('/confirm'), self.digest, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Classifier.objects.get(id=self.classifier.id).status, 'in_progress')
+
+    def test_confirm_with_other_size(self):
+        self.assertEqual(self.upload().status_code, 200)
+
+        response = self.client.post(self.path('/confirm'), dict(self.digest, size=self.digest['size'] + 1),
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_confirm_requires_digest(self):
+        self.assertEqual(self.upload().status_code, 200)
+
+        response = self.client.post(self.path('/confirm'), {'worker_id': 'worker-1'}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Classifier.objects.get(id=self.classifier.id).status, 'in_progress')
+
+    def test_confirm_from_other_worker(self):
+        self.assertEqual(self.upload().status_code, 200)
+
+        response = self.client.post(self.path('/confirm'), dict(self.digest, worker_id='worker-2'), format='json')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Classifier.objects.get(id=self.classifier.id).status, 'in_progress')
+
+    def test_invalid_digest(self):
+        response = self.client.post(self.path(), dict(self.digest, md5='not a digest'), format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(self.path(), dict(self.digest, size='not a size'), format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_not_found(self):
+        response = self.client.post('/classifiers/999999/notebook-upload', self.digest, format='json')
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_from_user(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Bearer notebookuploaduser')
+
+        response = client.post(self.path(), self.digest, format='json')
+
+        self.assertEqual(response.status_code, 403)
+
+class NotebookStorageTests(APITestCase):
+
+    def setUp(self):
+        self.notebook = read_notebook()
+        self.name = default_storage.save('notebooks/classifier_1.ipynb', ContentFile(self.notebook))
+
+    def test_content_addressed(self):
+        self.assertEqual(self.name, 'notebooks/{0}.ipynb'.format(hashlib.sha256(self.notebook).hexdigest()))
+        self.assertEqual(default_storage.save('notebooks/classifier_2.ipynb', ContentFile(self.notebook)), self.name)
+        self.assertNotEqual(default_storage.save('notebooks/classifier_3.ipynb', ContentFile(b'{}')), self.name)
+
+    def test_stored_compressed(self):
+        with open(default_storage.path(self.name), 'rb') as stored:
+            self.assertEqual(gzip.decompress(stored.read()), self.notebook)
+        with default_storage.open(self.name) as notebook_file:
+            self.assertEqual(notebook_file.read(), self.notebook)
+
+    def test_download(self):
+        response = self.client.get('/media/' + self.name)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ipynb+json')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(int(response['Content-Length']), len(response.content))
+        self.assertEqual(gzip.decompress(response.content), self.notebook)
+
+    def test_download_range(self):
+        full = self.client.get('/media/' + self.name).content
+
+        response = self.client.get('/media/' + self.name, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], 'bytes 10-19/{0}'.format(len(full)))
+        self.assertEqual(response.content, full[10:20])
+
+        response = self.client.get('/media/' + self.name, HTTP_RANGE='bytes=-5')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, full[-5:])
+
+        response = self.client.get('/media/' + self.name, HTTP_RANGE='bytes={0}-'.format(len(full)))
+        self.assertEqual(response.status_code, 416)
@@ -0,0 +1,67 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from rest_framework.test import APITestCase, APIClient
+
+from api.models import Disease
+from api import profiling
+
+class ProfilingTests(APITestCase):
+
+    def setUp(self):
+        Disease.objects.create(acronym='BLCA', name='bladder urothelial carcinoma')
+        profiling.slowest.clear()
+
+        self.service_client = APIClient()
+        self.service_client.credentials(HTTP_AUTHORIZATION='JWT ' + settings.AUTH_TOKEN)
+
+    def test_off_by_default(self):
+        response = self.client.get('/diseases', HTTP_X_PROFILE='1')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(self.service_client.get('/status/profiles').data, [])
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_profile_by_header(self):
+        self.assertNotIn('Server-Timing', self.client.get('/diseases'))
+
+        response = self.client.get('/diseases?limit=5', HTTP_X_PROFILE='1')
+
+        self.assertEqual(response.status_code, 200)
+        timings = [timing.split(';')[0] for timing in response['Server-Timing'].split(', ')]
+        self.assertEqual(timings, ['db', 'view', 'render', 'total'])
+
+        profiles = self.service_client.get('/status/profiles').data
+        self.assertEqual(len(profiles), 1)
+        self.assertEqual(profiles[0]['path'], '/diseases?limit=5')
+        self.assertEqual(profiles[0]['status'], 200)
+        self.assertGreater(profiles[0]['query_count'], 0)
+        self.assertEqual(len(profiles[0]['queries']), profiles[0]['query_count'])
+        self.assertIn('diseases', profiles[0]['queries'][-1]['sql'])
+
+    @override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_RATE=1.0)
+    def test_profile_sampled(self):
+        response = self.client.get('/diseases')
+
+        self.assertIn('Server-Timing', response)
+
+    @override_settings(PROFILING_ENABLED=True)
+    def test_clear(self):
+        self.client.get('/diseases', HTTP_X_PROFILE='1')
+
+        self.assertEqual(self.service_client.delete('/status/profiles').status_code, 204)
+        self.assertEqual(self.service_client.get('/status/profiles').data, [])
+
+    def test_from_user(self):
+        response = self.client.get('/status/profiles')
+
+        self.assertEqual(response.status_code, 401)
+
+class SlowestRequestsTests(SimpleTestCase):
+
+    def test_keeps_slowest(self):
+        slowest = profiling.SlowestRequests(2)
+        for total_ms in [5, 1, 9, 9, 3]:
+            slowest.add({'total_ms': total_ms})
+
+        self.assertEqual([profile['total_ms'] for profile in slowest.profiles()], [9, 9])
@@ -0,0 +1,117 @@
+import tempfile
+import shutil
+
+from django.core.cache import caches
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase, APIClient
+
+from api.models import Disease, Sample, DatasetFile
+
+class ResponseCacheTests(APITestCase):
+
+    def setUp(self):
+        caches['responses'].clear()
+
+        brca = Disease.objects.create(acronym='BRCA', name='breast invasive carcinoma')
+        Disease.objects.create(acronym='GBM', name='glioblastoma multiforme')
+        Sample.objects.create(sample_id='TCGA-01', disease=brca, gender='female', age_diagnosed=41)
+        DatasetFile.objects.create(filename='diseases.tsv', sha256='0' * 64)
+
+        self.client = APIClient()
+
+    def test_no_etag_before_data_is_loaded(self):
+        DatasetFile.objects.all().delete()
+
+        response = self.client.get('/diseases')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Cache-Control'))
+
+    def test_etag_and_cache_control(self):
+        response = self.client.get('/diseases/BRCA')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertRegex(response['ETag'], r'^"[0-9a-f]{40}"$')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=300')
+
+    def test_not_modified(self):
+        etag = self.client.get('/samples/TCGA-01')['ETag']
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/samples/TCGA-01', HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_modified(self):
+        response = self.client.get('/samples/TCGA-01', HTTP_IF_NONE_MATCH='"stale"')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['sample_id'], 'TCGA-01')
+
+    def test_cached_response(self):
+        first = self.client.get('/diseases')
+        Disease.objects.filter(acronym='GBM').update(name='renamed outside of loaddata')
+
+        # Only the dataset version is read
+        with self.assertNumQueries(1):
+            second = self.client.get('/diseases')
+
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second['Content-Type'], first['Content-Type'])
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_query_params_are_normalized(self):
+        first = self.client.get('/diseases?acronym=GBM&name=glioblastoma+multiforme')
+        second = self.client.get('/diseases?name=glioblastoma+multiforme&acronym=GBM')
+        other = self.client.get('/diseases?acronym=BRCA')
+
+        self.assertEqual(first['ETag'], second['ETag'])
+        self.assertNotEqual(first['ETag'], other['ETag'])
+
+    def test_keyed_by_host(self):
+        Disease.objects.create(acronym='LUAD', name='lung adenocarcinoma')
+
+        first = self.client.get('/diseases', {'limit': 1}, HTTP_HOST='api.cognoma.org')
+        second = self.client.get('/diseases', {'limit': 1}, HTTP_HOST='localhost:8080')
+
+        # Each with absolute pagination links to its own host
+        self.assertTrue(first.data['next'].startswith('http://api.cognoma.org/diseases'))
+        self.assertTrue(second.data['next'].startswith('http://localhost:8080/diseases'))
+
+    def test_loaddata_invalidates(self):
+        first = self.client.get('/diseases')
+        Disease.objects.filter(acronym='GBM').update(name='glioblastoma')
+        DatasetFile.objects.update(loaded_at=timezone.now())
+
+        response = self.client.get('/diseases', HTTP_IF_NONE_MATCH=first['ETag'])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertIn('glioblastoma', [disease['name'] for disease in response.data['results']])
+
+    def test_errors_are_not_cached(self):
+        self.assertEqual(self.client.get('/diseases/LUAD').status_code, 404)
+        Disease.objects.create(acronym='LUAD', name='lung adenocarcinoma')
+
+        self.assertEqual(self.client.get('/diseases/LUAD').status_code, 200)
+
+    def test_file_backend(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        responses = {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location
+        }
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                                       'responses': responses}):
+            first = self.client.get('/diseases/GBM')
+            with self.assertNumQueries(1):
+                second = self.client.get('/diseases/GBM')
+
+        self.assertEqual(second.content, first.content)
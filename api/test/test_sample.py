@@ -1,6 +1,10 @@
+import csv
+import json
+
 from rest_framework.test import APITestCase, APIClient
 
 from api.models import Sample, Disease, Mutation, Gene
+from api.querysets import stream_values
 
 class SampleTests(APITestCase):
     sample_keys = ['sample_id',
@@ -63,6 +67,34 @@ class SampleTests(APITestCase):
         self.assertEqual(list(list_response.data['results'][0].keys()), self.sample_keys)
         self.assertEqual(list(list_response.data['results'][1].keys()), self.sample_keys)
 
+    def test_list_matches_serializer(self):
+        client = APIClient()
+
+        list_response = client.get('/samples')
+
+        for sample in json.loads(list_response.content.decode())['results']:
+            get_response = client.get('/samples/' + sample['sample_id'])
+            self.assertEqual(sample, json.loads(get_response.content.decode()))
+
+    def test_list_fields(self):
+        client = APIClient()
+
+        list_response = client.get('/samples', {'fields': 'sample_id,mutations'})
+
+        self.assertEqual(list_response.status_code, 200)
+        self.assertIn({'sample_id': self.sample1.sample_id, 'mutations': [self.mutation1.id]},
+                      list_response.data['results'])
+        self.assertEqual(list(list_response.data['results'][0].keys()), ['sample_id', 'mutations'])
+
+    def test_list_expand(self):
+        client = APIClient()
+
+        list_response = client.get('/samples', {'expand': 'disease'})
+
+        self.assertEqual(list_response.status_code, 200)
+        self.assertEqual(list_response.data['results'][0]['disease'], {'acronym': self.disease1.acronym,
+                                                                       'name': self.disease1.name})
+
     def test_get_sample(self):
         client = APIClient()
 
@@ -119,3 +151,58 @@ class SampleTests(APITestCase):
             self.sample3.sample_id,]
         returned_samples = [x['sample_id'] for x in get_response.data['results']]
         self.assertEqual(sorted(expected_samples), sorted(returned_samples))
+
+    def test_keyset_pagination(self):
+        client = APIClient()
+
+        first_page = client.get('/samples', {'after': '', 'limit': 3})
+
+        self.assertEqual(first_page.status_code, 200)
+        self.assertEqual(list(first_page.data.keys()), ['next', 'results'])
+        self.assertEqual([sample['sample_id'] for sample in first_page.data['results']],
+                         [self.sample1.sample_id, self.sample2.sample_id, self.sample3.sample_id])
+        self.assertIn('after=' + self.sample3.sample_id, first_page.data['next'])
+
+        second_page = client.get(first_page.data['next'])
+
+        self.assertEqual([sample['sample_id'] for sample in second_page.data['results']], [self.sample4.sample_id])
+        self.assertEqual(list(second_page.data['results'][0].keys()), self.sample_keys)
+        self.assertEqual(second_page.data['results'][0]['mutations'], [])
+        self.assertIsNone(second_page.data['next'])
+
+    def test_export_ndjson(self):
+        client = APIClient()
+
+        response = client.get('/samples/export.ndjson')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        samples = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([list(sample.keys()) for sample in samples], [self.sample_keys] * 4)
+        self.assertEqual(samples[0], {'sample_id': self.sample1.sample_id,
+                                       'disease': self.disease1.acronym,
+                                       'mutations': [self.mutation1.id],
+                                       'gender': 'female',
+                                       'age_diagnosed': 37})
+
+    def test_export_csv_filtered(self):
+        client = APIClient()
+
+        response = client.get('/samples/export.csv', {
+                              'any_mutations': ','.join([str(self.gene1.entrez_gene_id), str(self.gene2.entrez_gene_id)]),
+                              })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0], self.sample_keys)
+        self.assertEqual([row[0] for row in rows[1:]],
+                         [self.sample1.sample_id, self.sample2.sample_id, self.sample3.sample_id])
+        self.assertEqual(rows[2][2], str(self.mutation2.id))
+
+    def test_export_in_keyset_chunks(self):
+        chunks = list(stream_values(Sample.objects.values_list('sample_id', 'gender'), 'sample_id', chunk_size=3))
+
+        self.assertEqual([len(rows) for rows in chunks], [3, 1])
+        self.assertEqual([row[0] for rows in chunks for row in rows],
+                         sorted(Sample.objects.values_list('sample_id', flat=True)))
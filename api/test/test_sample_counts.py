@@ -0,0 +1,90 @@
+from unittest.mock import patch
+
+from django.core.cache import cache
+from rest_framework.test import APITestCase, APIClient
+
+from api.models import Sample, Disease, Mutation, Gene, DatasetFile
+from api import mutation_index, sample_counts
+
+class SampleCountsTests(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+        mutation_index.reset()
+        self.addCleanup(mutation_index.reset)
+
+        for entrez_gene_id in [1, 2, 3]:
+            Gene.objects.create(entrez_gene_id=entrez_gene_id,
+                                symbol='GENE' + str(entrez_gene_id),
+                                description='foo',
+                                gene_type='bar')
+        blca = Disease.objects.create(acronym='BLCA', name='bladder urothelial carcinoma')
+        gbm = Disease.objects.create(acronym='GBM', name='glioblastoma multiforme')
+        samples = [
+            Sample.objects.create(sample_id='TCGA-01', disease=blca, gender='female', age_diagnosed=41),
+            Sample.objects.create(sample_id='TCGA-02', disease=blca, gender='female', age_diagnosed=48),
+            Sample.objects.create(sample_id='TCGA-03', disease=blca, gender='male', age_diagnosed=52),
+            Sample.objects.create(sample_id='TCGA-04', disease=gbm, gender='male', age_diagnosed=None),
+            Sample.objects.create(sample_id='TCGA-05', disease=gbm, gender=None, age_diagnosed=60),
+        ]
+        Mutation.objects.bulk_create([
+            Mutation(gene_id=1, sample=samples[0]),
+            Mutation(gene_id=2, sample=samples[0]),
+            Mutation(gene_id=2, sample=samples[2]),
+            Mutation(gene_id=1, sample=samples[3]),
+            Mutation(gene_id=3, sample=samples[4]),
+        ])
+        DatasetFile.objects.create(filename='mutation-matrix.tsv.bz2', sha256='0' * 64)
+
+    def get_counts(self, query):
+        response = APIClient().get('/samples/counts', query)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts_by_disease(self):
+        data = self.get_counts({'genes': '2,1', 'group_by': 'disease'})
+
+        self.assertEqual(data['genes'], [1, 2])
+        self.assertEqual(data['results'], [
+            {'disease': 'BLCA', 'mutated': 2, 'total': 3},
+            {'disease': 'GBM', 'mutated': 1, 'total': 2},
+        ])
+
+    def test_counts_by_all_columns(self):
+        data = self.get_counts({'genes': '1,2'})
+
+        self.assertEqual(data['group_by'], ['disease', 'gender', 'age_bucket'])
+        self.assertEqual([list(result.values()) for result in data['results']], [
+            ['BLCA', 'female', '40-49', 1, 2],
+            ['BLCA', 'male', '50-59', 1, 1],
+            ['GBM', 'male', None, 1, 1],
+            ['GBM', None, '60-69', 0, 1],
+        ])
+
+    def test_index_matches_sql(self):
+        queries = [{'genes': '1,2'}, {'genes': '3', 'group_by': 'age_bucket,gender'}, {'genes': '999'}]
+        from_sql = [self.get_counts(query) for query in queries]
+
+        cache.clear()
+        mutation_index.rebuild()
+        with patch('api.sample_counts.counts_from_sql') as counts_from_sql:
+            from_index = [self.get_counts(query) for query in queries]
+            self.assertFalse(counts_from_sql.called)
+
+        self.assertEqual(from_index, from_sql)
+
+    def test_cached_per_gene_set(self):
+        first = self.get_counts({'genes': '1,2'})
+
+        with patch('api.sample_counts.counts_from_sql') as counts_from_sql:
+            second = self.get_counts({'genes': '2,1,2'})
+            self.assertFalse(counts_from_sql.called)
+
+        self.assertEqual(second['results'], first['results'])
+
+    def test_invalid_parameters(self):
+        client = APIClient()
+
+        self.assertEqual(client.get('/samples/counts').status_code, 400)
+        self.assertEqual(client.get('/samples/counts', {'genes': '1,foo'}).status_code, 400)
+        self.assertEqual(client.get('/samples/counts', {'genes': '1', 'group_by': 'disease,sample_id'}).status_code, 400)
@@ -0,0 +1,95 @@
+import os
+import glob
+import fcntl
+import pickle
+import threading
+
+from django.conf import settings
+
+from api import dataset
+
+class VersionedIndex(object):
+    """The current in-memory index of the loaded dataset, built by `build`.
+
+    `build` takes no arguments and returns an index with a `version`
+    attribute, the dataset version it was built from. Indexes are saved to
+    INDEX_DIR under `name` and their version, so each is built once per
+    host and dataset version, by `load_or_build()`, and never while serving
+    a request.
+    """
+
+    def __init__(self, name, build):
+        self.name = name
+        self.build = build
+        self.lock = threading.Lock()
+        self.index = None
+
+    def make_current(self, built):
+        with self.lock:
+            self.index = built
+        return built
+
+    def rebuild(self):
+        """Build the index of the loaded dataset and make it current"""
+        return self.make_current(self.build())
+
+    def saved_path(self, version):
+        return os.path.join(settings.INDEX_DIR, '{0}-{1:%Y%m%dT%H%M%S%f}.pickle'.format(self.name, version))
+
+    def load_saved(self, version):
+        try:
+            with open(self.saved_path(version), 'rb') as saved:
+                return pickle.load(saved)
+        except FileNotFoundError:
+            return None
+
+    def save(self, built):
+        # Written whole and renamed into place, so readers never see half a file
+        partial_path = '{0}.{1}.tmp'.format(self.saved_path(built.version), os.getpid())
+        with open(partial_path, 'wb') as partial_file:
+            pickle.dump(built, partial_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(partial_path, self.saved_path(built.version))
+        for path in glob.glob(os.path.join(settings.INDEX_DIR, self.name + '-*.pickle')):
+            if path != self.saved_path(built.version):
+                os.remove(path)
+
+    def load_or_build(self):
+        """Make the index of the loaded dataset current, building it once per host.
+
+        Each gunicorn worker calls this as it starts, before serving
+        requests, and loaddata after a load. Only the first process to start
+        after a load builds the index, and the workers gunicorn recycles
+        later load the one it saved.
+        """
+        os.makedirs(settings.INDEX_DIR, exist_ok=True)
+        with open(os.path.join(settings.INDEX_DIR, self.name + '.lock'), 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            version = dataset.read_version()
+            if version is None:
+                return None
+            built = self.load_saved(version)
+            if built is None:
+                built = self.build()
+                self.save(built)
+        return self.make_current(built)
+
+    def current(self):
+        """The index if it matches the loaded dataset, otherwise None.
+
+        After a new load this picks up the index loaddata saved, when it ran
+        on the same host, and otherwise returns None and callers answer from
+        the database until gunicorn recycles the worker.
+        """
+        version = dataset.version()
+        if version is None:
+            return None
+        index = self.index
+        if index is not None and index.version == version:
+            return index
+        saved = self.load_saved(version)
+        if saved is not None:
+            return self.make_current(saved)
+        return None
+
+    def reset(self):
+        self.make_current(None)
@@ -1,23 +1,70 @@
 import os
+import re
+import io
+import csv
+import json
 import datetime
-import requests
-from django.core.mail import send_mail
+import mimetypes
+from collections import OrderedDict
 from django.conf import settings
+from django.db import transaction
+from django.core.files.storage import default_storage
+from django.db.models.expressions import RawSQL
+from django.http import HttpResponse, StreamingHttpResponse
+import coreapi
 import django_filters
 from rest_framework import filters, generics, mixins
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.utils.urls import replace_query_param
 
 from api.auth import UserAccessSelfOnly, ClassifierCreatePermission, ClassifierRetrievePermission, MLWorkerOnlyPermission
 from api.models import User, Classifier, Disease, Sample, Mutation, Gene
-from api.serializers import ClassifierSerializer, UserSerializer, GeneSerializer, DiseaseSerializer, MutationSerializer, SampleSerializer
-from api import queue
-
-# This URL including the list ID is hardcoded,
-# but we don't plan on changing it any time soon.
-MAILCHIMP_LIST_URL = "https://us14.api.mailchimp.com/3.0/lists/074bca87ce/members"
+from api.serializers import ClassifierSerializer, UserSerializer, GeneSerializer, DiseaseSerializer, MutationSerializer, SampleSerializer, ClassifierFailureSerializer
+from api.querysets import SerializerQuerySetMixin, ValuesListMixin, stream_values
+from api.response_cache import DatasetCacheMixin
+from api.pooled_postgresql import pool
+from api import queue, notifications, mutation_index, gene_index, sample_counts, metrics, profiling
+from cognoma_site.custom_storages import content_md5_header, NOTEBOOK_CONTENT_TYPE
+
+# Most classifiers a worker can report on in a single batch request.
+MAX_BATCH_SIZE = 100
+
+# Notebooks uploaded straight to storage
+NOTEBOOK_UPLOAD_EXPIRES_SECONDS = 15 * 60
+MAX_NOTEBOOK_SIZE_BYTES = 100 * 1024 * 1024
+
+def completed_email(classifier, email):
+    """(subject, message, from_email, recipient_list) for a completed classifier"""
+    download_link = classifier.notebook_file.url
+    nbviewer_link = 'https://nbviewer.jupyter.org/urls/' + download_link.replace('https://', '')
+    email_message = 'Cognoma has completed processing your classifier.\n' + \
+                    'Visit {notebook_link} to download your notebook.\n'.format(notebook_link=download_link) + \
+                    'Visit {nbviewer_link} to view your notebook online.'.format(nbviewer_link=nbviewer_link)
+    return ('Cognoma Classifier {id} Processing Complete'.format(id=classifier.id),
+            email_message,
+            settings.FROM_EMAIL,
+            [email])
+
+def failed_email(classifier, email):
+    """(subject, message, from_email, recipient_list) for a classifier out of attempts"""
+    email_message = 'An error has occurred and your classifier could not be processed.\n' + \
+                    'Error: ' + classifier.fail_message + '\n' + \
+                    'Support is available at https://github.com/cognoma.'
+    return ('Cognoma Classifier {id} Processing Failure'.format(id=classifier.id),
+            email_message,
+            settings.FROM_EMAIL,
+            [email])
+
+def enqueue_email(build_email, classifier, email):
+    """Queue the email `build_email` makes for `classifier`, once per attempt"""
+    if not email:
+        return
+    dedupe_key = 'classifier-{id}-attempt-{attempts}-{email}'.format(
+        id=classifier.id, attempts=classifier.attempts, email=build_email.__name__)
+    notifications.enqueue_email(dedupe_key, *build_email(classifier, email))
 
 # Classifier
 
@@ -36,24 +83,21 @@ class ClassifierCreate(generics.CreateAPIView, mixins.CreateModelMixin):
     permission_classes = (ClassifierCreatePermission,)
     serializer_class = ClassifierSerializer
 
-    def add_user_to_mailchimp_list(self, email_address, mailchimp_api_key):
-        requests.post(MAILCHIMP_LIST_URL,
-            json={"email_address": email_address,
-                  "status": "subscribed"},
-            auth=("anystring", mailchimp_api_key))
-
+    @transaction.atomic
     def perform_create(self, serializer):
+        serializer.save()
+
         mailchimp_api_key = os.getenv("MAILCHIMP_API_KEY")
+        # Users are created without an email, and service requests have no user
+        email = getattr(self.request.user, 'email', None)
         try:
             should_subscribe = self.request.data["subscribe"]
-            if mailchimp_api_key is not None and should_subscribe == True:
-                self.add_user_to_mailchimp_list(self.request.user.email, mailchimp_api_key)
+            if mailchimp_api_key is not None and should_subscribe == True and email:
+                notifications.enqueue_mailchimp_subscription(email)
         except KeyError:
             pass
 
-        serializer.save()
-
-class RetrieveClassifier(generics.RetrieveAPIView):
+class RetrieveClassifier(SerializerQuerySetMixin, generics.RetrieveAPIView):
     permission_classes = (ClassifierRetrievePermission,)
     queryset = Classifier.objects.all()
     serializer_class = ClassifierSerializer
@@ -74,19 +118,124 @@ class UploadCompletedNotebookToClassifier(APIView):
                                               'completed_at': datetime.datetime.utcnow()
                                           }, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        download_link = classifier.notebook_file.url
-        nbviewer_link = 'https://nbviewer.jupyter.org/urls/' + download_link.replace('https://', '')
-        email_message = 'Cognoma has completed processing your classifier.\n' + \
-                        'Visit {notebook_link} to download your notebook.\n'.format(notebook_link=download_link) + \
-                        'Visit {nbviewer_link} to view your notebook online.'.format(nbviewer_link=nbviewer_link)
-        send_mail(subject='Cognoma Classifier {id} Processing Complete'.format(id=classifier.id),
-                  message=email_message,
-                  from_email=settings.FROM_EMAIL,
-                  recipient_list=[classifier.user.email],
-                  fail_silently=True)
+        with transaction.atomic():
+            serializer.save()
+            enqueue_email(completed_email, classifier, classifier.user.email)
+        metrics.completed([classifier])
         return Response(serializer.data, status=201)
 
+def parse_notebook_digest(data):
+    """Validate the (size, hex md5) a worker gives for a gzipped notebook"""
+    try:
+        size = int(data.get('size'))
+    except (TypeError, ValueError):
+        raise ParseError('`size` must be an integer')
+    if size <= 0 or size > MAX_NOTEBOOK_SIZE_BYTES:
+        raise ParseError('`size` must be between 1 and {max_size} bytes'.format(max_size=MAX_NOTEBOOK_SIZE_BYTES))
+
+    md5 = str(data.get('md5', '')).lower()
+    if not re.match('^[0-9a-f]{32}$', md5):
+        raise ParseError('`md5` must be a hex MD5 digest')
+    return size, md5
+
+def notebook_upload_name(id, md5):
+    """Name of an uploaded notebook, addressed by the `md5` of its gzipped bytes"""
+    notebook_field = Classifier._meta.get_field('notebook_file')
+    return notebook_field.storage.content_addressed_name(
+        notebook_field.generate_filename(Classifier(id=id), 'notebook.ipynb'), md5)
+
+class NotebookUploadURL(APIView):
+    """Presigned URL for a worker to PUT a classifier's gzipped notebook to directly.
+
+    Takes the `size` and `md5` of the gzipped notebook. The PUT has to send
+    the returned headers, and storage rejects a body with a different MD5,
+    so whatever is stored under the name of an MD5 has that MD5. When it is
+    already stored there is nothing to upload and `exists` is true. Either
+    way, confirm it to complete the classifier.
+    """
+    permission_classes = (MLWorkerOnlyPermission,)
+
+    def post(self, request, id):
+        if not Classifier.objects.filter(id=id).exists():
+            raise NotFound('Classifier not found')
+        size, md5 = parse_notebook_digest(request.data)
+        name = notebook_upload_name(id, md5)
+
+        storage = Classifier._meta.get_field('notebook_file').storage
+        if storage.uploaded_digest(name) == (size, md5):
+            return Response(data={'exists': True}, status=200)
+
+        url = storage.upload_url(name, NOTEBOOK_CONTENT_TYPE, md5, NOTEBOOK_UPLOAD_EXPIRES_SECONDS)
+        return Response(data={
+            'exists': False,
+            'url': request.build_absolute_uri(url),
+            'method': 'PUT',
+            'headers': {
+                'Content-Type': NOTEBOOK_CONTENT_TYPE,
+                'Content-Encoding': 'gzip',
+                'Content-MD5': content_md5_header(md5)
+            },
+            'expires_in': NOTEBOOK_UPLOAD_EXPIRES_SECONDS
+        }, status=200)
+
+class ConfirmNotebookUpload(APIView):
+    """Complete a classifier whose notebook was PUT to its upload URL, or was already stored.
+
+    Takes the same `size` and `md5` as the upload URL, which are checked
+    against the size and ETag of the stored object without reading it, so
+    the notebook bytes never pass through the API.
+    Optionally takes the `worker_id` holding the classifier.
+    """
+    permission_classes = (MLWorkerOnlyPermission,)
+
+    def post(self, request, id):
+        if not Classifier.objects.filter(id=id).exists():
+            raise NotFound('Classifier not found')
+        size, md5 = parse_notebook_digest(request.data)
+        name = notebook_upload_name(id, md5)
+        worker_id = parse_worker_id(request.data.get('worker_id'))
+
+        uploaded = Classifier._meta.get_field('notebook_file').storage.uploaded_digest(name)
+        if uploaded is None:
+            raise ParseError('The notebook has not been uploaded')
+        if uploaded != (size, md5):
+            raise ParseError('The uploaded notebook is {0} bytes with MD5 {1}'.format(*uploaded))
+
+        with transaction.atomic():
+            classifiers = queue.complete_classifiers([(int(id), name)], worker_id)
+            if not classifiers:
+                return Response(data={'message': 'Classifier task is not in progress for this worker.'}, status=409)
+            enqueue_email(completed_email, classifiers[0], classifiers[0].user.email)
+        metrics.completed(classifiers)
+
+        return Response(data=ClassifierSerializer(classifiers[0]).data, status=200)
+
+def parse_worker_id(value, required=False):
+    """Validate a worker_id from a request body, None if not given"""
+    if value is None or value == '':
+        if required:
+            raise ParseError('`worker_id` is required')
+        return None
+    if isinstance(value, (dict, list, bool)):
+        raise ParseError('`worker_id` must be a string')
+    return str(value)
+
+def parse_lease(value):
+    """Validate a worker requested lease in seconds, None if not given"""
+    if value is None:
+        return None
+    # int() would truncate a JSON 30.5 to 30
+    if isinstance(value, int) and not isinstance(value, bool):
+        lease = value
+    elif isinstance(value, str) and re.match(r'^\d+$', value):
+        lease = int(value)
+    else:
+        raise ParseError('`lease` must be an integer')
+    if lease < queue.MIN_LEASE_SECONDS or lease > queue.MAX_LEASE_SECONDS:
+        raise ParseError('`lease` must be between {min_lease} and {max_lease}'.format(
+            min_lease=queue.MIN_LEASE_SECONDS, max_lease=queue.MAX_LEASE_SECONDS))
+    return lease
+
 class PullClassifierTaskQueue(APIView):
     permission_classes = (MLWorkerOnlyPermission,)
 
@@ -115,9 +264,25 @@ class PullClassifierTaskQueue(APIView):
         if limit < 1 or limit > 10:
             raise ParseError('`limit` must be between 1 and 10')
 
-        raw_classifiers = queue.get_classifiers(title,
-                                                worker_id,
-                                                limit)
+        if 'wait' in request.query_params:
+            try:
+                wait = float(request.query_params['wait'])
+            except ValueError:
+                raise ParseError('`wait` query parameter must be a number')
+        else:
+            wait = 0
+
+        if not 0 <= wait <= queue.MAX_WAIT_SECONDS:
+            raise ParseError('`wait` must be between 0 and {max_wait}'.format(max_wait=queue.MAX_WAIT_SECONDS))
+
+        lease = parse_lease(request.query_params.get('lease'))
+
+        raw_classifiers = queue.get_classifiers_wait(title,
+                                                     worker_id,
+                                                     limit,
+                                                     wait,
+                                                     lease)
+        metrics.claimed(raw_classifiers)
 
         classifiers = []
         for classifier in raw_classifiers:
@@ -126,6 +291,22 @@ class PullClassifierTaskQueue(APIView):
 
         return Response(classifiers)
 
+class ClassifierHeartbeat(APIView):
+    permission_classes = (MLWorkerOnlyPermission,)
+
+    def post(self, request, id):
+        worker_id = parse_worker_id(request.data.get('worker_id'), required=True)
+        lease = parse_lease(request.data.get('lease'))
+
+        classifier = queue.heartbeat(id, worker_id, lease)
+
+        if classifier is None:
+            if not Classifier.objects.filter(id=id).exists():
+                raise NotFound('Task not found')
+            return Response(data={'message': 'Classifier task is not in progress for this worker.'}, status=409)
+
+        return Response(data=ClassifierSerializer(classifier).data, status=200)
+
 class ReleaseClassifierTask(APIView):
     permission_classes = (MLWorkerOnlyPermission,)
 
@@ -137,8 +318,10 @@ class ReleaseClassifierTask(APIView):
 
         classifier.status = 'queued'
         classifier.locked_at = None
+        classifier.lease = None
         classifier.worker_id = None
         classifier.save()
+        metrics.released([classifier])
 
         return Response(data={'message': 'Classifier task released.'}, status=200)
 
@@ -156,20 +339,146 @@ class FailClassifierTask(APIView):
             'fail_message': request.data['fail_message']
         }, partial=True)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-
-        if classifier.attempts >= classifier.max_attempts:
-            email_message = 'An error has occurred and your classifier could not be processed.\n' + \
-                            'Error: ' + classifier.fail_message + '\n' + \
-                            'Support is available at https://github.com/cognoma.'
-            send_mail(subject='Cognoma Classifier {id} Processing Failure'.format(id=classifier.id),
-                      message=email_message,
-                      from_email=settings.FROM_EMAIL,
-                      recipient_list=[classifier.user.email],
-                      fail_silently=True)
+        with transaction.atomic():
+            serializer.save()
+            if classifier.attempts >= classifier.max_attempts:
+                enqueue_email(failed_email, classifier, classifier.user.email)
+        metrics.failed([classifier])
 
         return Response(data=serializer.data, status=200)
 
+class BatchClassifierTaskView(APIView):
+    """Base for endpoints that apply one status transition to many classifiers.
+
+    Requests may include a `worker_id`, in which case only classifiers held
+    by that worker are updated. Responses list an outcome per classifier:
+    `updated`, `invalid`, `not_found`, or `conflict` when the classifier is
+    not in progress (for that worker).
+    """
+    permission_classes = (MLWorkerOnlyPermission,)
+
+    def get_worker_id(self, request):
+        return parse_worker_id(request.data.get('worker_id'))
+
+    def check_batch_size(self, items):
+        if not isinstance(items, list) or len(items) == 0:
+            raise ParseError('A non-empty list of classifiers is required')
+        if len(items) > MAX_BATCH_SIZE:
+            raise ParseError('At most {max_batch_size} classifiers can be updated at once'.format(
+                max_batch_size=MAX_BATCH_SIZE))
+
+    def outcomes(self, ids, classifiers, invalid):
+        """Per item results, in request order, for the attempted `ids`"""
+        updated = {classifier.id: classifier for classifier in classifiers}
+        not_updated = [id for id in ids if id not in updated]
+        existing = set()
+        if not_updated:
+            existing = set(Classifier.objects.filter(id__in=not_updated).values_list('id', flat=True))
+
+        results = list(invalid)
+        for id in ids:
+            if id in updated:
+                results.append({'id': id, 'outcome': 'updated', 'status': updated[id].status})
+            elif id in existing:
+                results.append({'id': id, 'outcome': 'conflict'})
+            else:
+                results.append({'id': id, 'outcome': 'not_found'})
+        return results
+
+    def enqueue_emails(self, classifiers, build_email):
+        if not classifiers:
+            return
+        emails = dict(Classifier.objects
+                      .filter(id__in=[classifier.id for classifier in classifiers])
+                      .values_list('id', 'user__email'))
+        for classifier in classifiers:
+            enqueue_email(build_email, classifier, emails[classifier.id])
+
+class BatchCompleteClassifierTasks(BatchClassifierTaskView):
+    """Completes many classifiers. Notebooks are multipart files named `notebook_file_<id>`."""
+
+    def post(self, request):
+        worker_id = self.get_worker_id(request)
+        notebooks = {}
+        for name, notebook_file in request.FILES.items():
+            match = re.match('^notebook_file_(?P<id>[0-9]+)$', name)
+            if not match:
+                raise ParseError('Unexpected file `{name}`'.format(name=name))
+            notebooks[int(match.group('id'))] = notebook_file
+        self.check_batch_size(list(notebooks))
+
+        ids = sorted(notebooks)
+        notebook_field = Classifier._meta.get_field('notebook_file')
+        with transaction.atomic():
+            # Locking the classifiers held keeps another worker from claiming
+            # them between saving their notebooks and completing them, so
+            # notebooks are only stored for classifiers that complete.
+            claimed = Classifier.objects.select_for_update().filter(id__in=ids, status='in_progress')
+            if worker_id is not None:
+                claimed = claimed.filter(worker_id=worker_id)
+
+            rows = []
+            for id in claimed.order_by('id').values_list('id', flat=True):
+                path = notebook_field.generate_filename(Classifier(id=id), notebooks[id].name)
+                rows.append((id, notebook_field.storage.save(path, notebooks[id])))
+
+            classifiers = queue.complete_classifiers(rows, worker_id)
+            self.enqueue_emails(classifiers, completed_email)
+        metrics.completed(classifiers)
+
+        return Response(data={'results': self.outcomes(ids, classifiers, [])}, status=200)
+
+class BatchFailClassifierTasks(BatchClassifierTaskView):
+    """Fails many classifiers given `classifiers`: [{id, fail_reason, fail_message}]"""
+
+    def post(self, request):
+        worker_id = self.get_worker_id(request)
+        items = request.data.get('classifiers')
+        self.check_batch_size(items)
+
+        failures = []
+        invalid = []
+        for item in items:
+            serializer = ClassifierFailureSerializer(data=item)
+            if serializer.is_valid():
+                failures.append((serializer.validated_data['id'],
+                                 serializer.validated_data['fail_reason'],
+                                 serializer.validated_data['fail_message']))
+            else:
+                invalid.append({'id': item.get('id') if isinstance(item, dict) else None,
+                                'outcome': 'invalid',
+                                'errors': serializer.errors})
+
+        with transaction.atomic():
+            classifiers = queue.fail_classifiers(failures, worker_id)
+            self.enqueue_emails([classifier for classifier in classifiers if classifier.status == 'failed'],
+                                failed_email)
+        metrics.failed(classifiers)
+
+        return Response(data={'results': self.outcomes([id for id, _, _ in failures], classifiers, invalid)},
+                        status=200)
+
+class BatchReleaseClassifierTasks(BatchClassifierTaskView):
+    """Puts many in progress classifiers back in the queue given `ids`"""
+
+    def post(self, request):
+        worker_id = self.get_worker_id(request)
+        items = request.data.get('ids')
+        self.check_batch_size(items)
+
+        ids = []
+        invalid = []
+        for item in items:
+            try:
+                ids.append(int(item))
+            except (TypeError, ValueError):
+                invalid.append({'id': item, 'outcome': 'invalid', 'errors': ['Must be an integer']})
+
+        classifiers = queue.release_classifiers(ids, worker_id)
+        metrics.released(classifiers)
+
+        return Response(data={'results': self.outcomes(ids, classifiers, invalid)}, status=200)
+
 # User
 
 class UserFilter(filters.FilterSet):
@@ -211,16 +520,52 @@ class GenePagination(LimitOffsetPagination):
     default_limit = 10
     max_limit = 10
 
-class GeneList(generics.ListAPIView):
+class GeneList(ValuesListMixin, SerializerQuerySetMixin, generics.ListAPIView):
     queryset = Gene.objects.all()
     serializer_class = GeneSerializer
+    values_fields = {
+        'entrez_gene_id': 'entrez_gene_id',
+        'symbol': 'symbol',
+        'description': 'description',
+        'chromosome': 'chromosome',
+        'gene_type': 'gene_type',
+        'synonyms': 'synonyms',
+        'aliases': 'aliases',
+        'mutations': RawSQL('ARRAY(SELECT id FROM mutations '
+                            'WHERE mutations.gene_id = cognoma_genes.entrez_gene_id ORDER BY id)', [])
+    }
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = GeneFilter
     pagination_class = GenePagination
     ordering_fields = ('entrez_gene_id', 'symbol', 'chromosome')
     ordering = ('entrez_gene_id',)
 
-class GeneRetrieve(generics.RetrieveAPIView):
+class GeneSearch(APIView):
+    """Type-ahead search for genes whose symbol, synonyms or aliases start with `q`.
+
+    Results are ranked exact symbol match first, then symbol prefix
+    matches, then synonym or alias matches. `limit` defaults to 10.
+    """
+    permission_classes = []
+
+    def get(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            raise ParseError('`q` is required')
+
+        try:
+            limit = int(request.query_params.get('limit', gene_index.DEFAULT_SEARCH_LIMIT))
+        except ValueError:
+            raise ParseError('`limit` must be an integer')
+        if not 0 < limit <= gene_index.MAX_SEARCH_LIMIT:
+            raise ParseError('`limit` must be between 1 and {0}'.format(gene_index.MAX_SEARCH_LIMIT))
+
+        return Response(data={
+            'q': query,
+            'results': gene_index.search(query, limit)
+        })
+
+class GeneRetrieve(SerializerQuerySetMixin, generics.RetrieveAPIView):
     queryset = Gene.objects.all()
     serializer_class = GeneSerializer
     lookup_field = 'entrez_gene_id'
@@ -232,15 +577,19 @@ class DiseaseFilter(filters.FilterSet):
         model = Disease
         fields = ['acronym', 'name']
 
-class DiseaseList(generics.ListAPIView):
+class DiseaseList(DatasetCacheMixin, ValuesListMixin, generics.ListAPIView):
     queryset = Disease.objects.all()
     serializer_class = DiseaseSerializer
+    values_fields = {
+        'acronym': 'acronym',
+        'name': 'name'
+    }
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = DiseaseFilter
     ordering_fields = ('acronym', 'name',)
     ordering = ('acronym',)
 
-class DiseaseRetrieve(generics.RetrieveAPIView):
+class DiseaseRetrieve(DatasetCacheMixin, generics.RetrieveAPIView):
     queryset = Disease.objects.all()
     serializer_class = DiseaseSerializer
     lookup_field = 'acronym'
@@ -252,7 +601,7 @@ class MutationFilter(filters.FilterSet):
         model = Mutation
         fields = ['gene', 'sample']
 
-class MutationList(generics.ListAPIView):
+class MutationList(SerializerQuerySetMixin, generics.ListAPIView):
     queryset = Mutation.objects.all()
     serializer_class = MutationSerializer
     filter_backends = (filters.DjangoFilterBackend,)
@@ -260,38 +609,296 @@ class MutationList(generics.ListAPIView):
     ordering_fields = ('id',)
     ordering = ('id',)
 
-class MutationRetrieve(generics.RetrieveAPIView):
+class MutationRetrieve(SerializerQuerySetMixin, generics.RetrieveAPIView):
     queryset = Mutation.objects.all()
     serializer_class = MutationSerializer
     lookup_field = 'id'
 
 # Samples
 
-# via https://github.com/carltongibson/django-filter/issues/137#issuecomment-38158832
-# Courtesy of @miserlou
-class ListFilter(django_filters.Filter):
+sample_mutation_ids = RawSQL('ARRAY(SELECT id FROM mutations '
+                             'WHERE mutations.sample_id = samples.sample_id ORDER BY id)', [])
+
+class MutatedGenesFilter(django_filters.Filter):
+    """Samples mutated in any (union) or all (intersection) of a comma separated list of genes.
+
+    Answered from the in-process mutation index when it is up to date with
+    the loaded dataset, otherwise with semi-joins against mutations.
+    """
+    def __init__(self, *args, **kwargs):
+        self.require_all = kwargs.pop('require_all', False)
+        super(MutatedGenesFilter, self).__init__(*args, **kwargs)
+
     def filter(self, qs, value):
-        value_list = value.split(u',')
-        return super(ListFilter, self).filter(qs, django_filters.fields.Lookup(value_list, 'in'))
+        if not value:
+            return qs
+        gene_ids = [gene_id.strip() for gene_id in value.split(u',')]
+
+        index = mutation_index.current()
+        if index is not None and all(gene_id.isdigit() for gene_id in gene_ids):
+            gene_ids = [int(gene_id) for gene_id in gene_ids]
+            if self.require_all:
+                mask = index.all_mutations(gene_ids)
+            else:
+                mask = index.any_mutations(gene_ids)
+            # One array parameter, where sample_id__in would send one per sample
+            return qs.extra(where=['samples.sample_id = ANY(%s)'], params=[index.samples(mask)])
+
+        if self.require_all:
+            for gene_id in gene_ids:
+                qs = qs.filter(sample_id__in=Mutation.objects.filter(gene=gene_id).values('sample_id'))
+            return qs
+        return qs.filter(sample_id__in=Mutation.objects.filter(gene__in=gene_ids).values('sample_id'))
 
 class SampleFilter(filters.FilterSet):
     age_diagnosed__gte = django_filters.IsoDateTimeFilter(name='age_diagnosed', lookup_expr='gte')
     age_diagnosed__lte = django_filters.IsoDateTimeFilter(name='age_diagnosed', lookup_expr='lte')
-    any_mutations = ListFilter(name='mutations__gene')  # Return union
+    any_mutations = MutatedGenesFilter()  # Return union
+    all_mutations = MutatedGenesFilter(require_all=True)  # Return intersection
 
     class Meta:
         model = Sample
-        fields = ['sample_id', 'disease', 'gender', 'age_diagnosed', 'any_mutations', 'mutations__gene', 'mutations__gene__entrez_gene_id']
-
-class SampleList(generics.ListAPIView):
+        fields = ['sample_id', 'disease', 'gender', 'age_diagnosed', 'any_mutations', 'all_mutations', 'mutations__gene', 'mutations__gene__entrez_gene_id']
+
+class SamplePagination(LimitOffsetPagination):
+    """Limit/offset pages, or keyset pages ordered on sample_id when `after` is given.
+
+    A keyset page costs the same however deep into the samples it is. Start
+    with `?after=` and follow `next`, which continues from the page's last
+    sample_id.
+    """
+    after_query_param = 'after'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.after_query_param in request.query_params
+        if not self.keyset:
+            return super(SamplePagination, self).paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.limit = self.get_limit(request)
+        after = request.query_params[self.after_query_param]
+
+        queryset = queryset.order_by('sample_id')
+        if after:
+            queryset = queryset.filter(sample_id__gt=after)
+        # One extra row tells whether there is a next page without counting.
+        samples = list(queryset[:self.limit + 1])
+        self.has_next = len(samples) > self.limit
+        self.samples = samples[:self.limit]
+        return self.samples
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super(SamplePagination, self).get_next_link()
+        if not self.has_next:
+            return None
+        last = self.samples[-1]
+        # Samples are model instances, or dicts when listed from values()
+        sample_id = last['sample_id'] if isinstance(last, dict) else last.sample_id
+        return replace_query_param(self.request.build_absolute_uri(), self.after_query_param, sample_id)
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super(SamplePagination, self).get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data)
+        ]))
+
+    def get_schema_fields(self, view):
+        return super(SamplePagination, self).get_schema_fields(view) + [
+            coreapi.Field(name=self.after_query_param, required=False, location='query')
+        ]
+
+class SampleList(DatasetCacheMixin, ValuesListMixin, SerializerQuerySetMixin, generics.ListAPIView):
     queryset = Sample.objects.all()
     serializer_class = SampleSerializer
+    values_fields = {
+        'sample_id': 'sample_id',
+        'disease': 'disease_id',
+        'mutations': sample_mutation_ids,
+        'gender': 'gender',
+        'age_diagnosed': 'age_diagnosed'
+    }
     filter_backends = (filters.DjangoFilterBackend,)
     filter_class = SampleFilter
+    pagination_class = SamplePagination
     ordering_fields = ('sample_id', 'disease', 'age_diagnosed',)
     ordering = ('sample_id',)
 
-class SampleRetrieve(generics.RetrieveAPIView):
+class SampleCounts(APIView):
+    """Mutated and total sample counts for a gene set, grouped by disease, gender and age bucket.
+
+    `genes` is a comma separated list of entrez_gene_ids, a sample counts as
+    mutated when it is mutated in any of them. `group_by` optionally narrows
+    the grouping to some of `disease`, `gender` and `age_bucket`.
+    """
+    permission_classes = []
+
+    def get(self, request):
+        try:
+            gene_ids = [int(gene_id) for gene_id in request.query_params.get('genes', '').split(',')]
+        except ValueError:
+            raise ParseError('`genes` must be a comma separated list of entrez_gene_ids')
+
+        group_by = request.query_params.get('group_by', ','.join(sample_counts.GROUP_BY_COLUMNS)).split(',')
+        if not set(group_by) <= set(sample_counts.GROUP_BY_COLUMNS) or len(set(group_by)) != len(group_by):
+            raise ParseError('`group_by` must be a comma separated list of ' +
+                             ', '.join(sample_counts.GROUP_BY_COLUMNS))
+
+        return Response(data={
+            'genes': sorted(set(gene_ids)),
+            'group_by': group_by,
+            'results': sample_counts.sample_counts(gene_ids, group_by)
+        })
+
+class SampleExport(APIView):
+    """Every sample matching the SampleList filters in one streamed response.
+
+    `/samples/export.ndjson` writes a JSON object per line with the same keys
+    as SampleList results. `/samples/export.csv` writes the same columns with
+    mutation ids separated by `|`.
+    """
+    permission_classes = []
+    columns = ['sample_id', 'disease', 'mutations', 'gender', 'age_diagnosed']
+    content_types = {
+        'ndjson': 'application/x-ndjson',
+        'csv': 'text/csv'
+    }
+
+    def get_queryset(self, request):
+        queryset = SampleFilter(request.query_params, queryset=Sample.objects.all()).qs
+        return (queryset
+                .annotate(mutation_ids=sample_mutation_ids)
+                .distinct()
+                .values_list('sample_id', 'disease_id', 'mutation_ids', 'gender', 'age_diagnosed'))
+
+    def ndjson_lines(self, chunks):
+        for rows in chunks:
+            yield ''.join(json.dumps(OrderedDict(zip(self.columns, row))) + '\n' for row in rows)
+
+    def csv_lines(self, chunks):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(self.columns)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for rows in chunks:
+            for sample_id, disease, mutations, gender, age_diagnosed in rows:
+                writer.writerow([sample_id, disease, '|'.join(str(id) for id in mutations), gender, age_diagnosed])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    def get(self, request, export_format):
+        chunks = stream_values(self.get_queryset(request), 'sample_id')
+        if export_format == 'csv':
+            lines = self.csv_lines(chunks)
+        else:
+            lines = self.ndjson_lines(chunks)
+
+        response = StreamingHttpResponse(lines, content_type=self.content_types[export_format])
+        response['Content-Disposition'] = 'attachment; filename="samples.{0}"'.format(export_format)
+        return response
+
+class SampleRetrieve(DatasetCacheMixin, SerializerQuerySetMixin, generics.RetrieveAPIView):
     queryset = Sample.objects.all()
     serializer_class = SampleSerializer
     lookup_field = 'sample_id'
+
+# Local storage
+
+class LocalMediaUpload(APIView):
+    """Receives PUTs to LocalMediaStorage upload URLs, standing in for S3 in development and tests"""
+    authentication_classes = []
+    permission_classes = []
+
+    def put(self, request, token):
+        error = default_storage.receive_upload(token,
+                                               request.META.get('CONTENT_TYPE'),
+                                               request.META.get('HTTP_CONTENT_MD5'),
+                                               request.body)
+        if error is not None:
+            return Response(data={'code': error}, status=400 if error == 'BadDigest' else 403)
+        return Response(status=200)
+
+class LocalMediaDownload(APIView):
+    """Serves LocalMediaStorage files the way S3 serves MediaStorage's.
+
+    The stored bytes are sent as they are, with a Content-Encoding when
+    gzipped, and a single `Range` of them gets a 206 Partial Content.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    def get(self, request, name):
+        if not default_storage.exists(name):
+            raise NotFound('File not found')
+        with open(default_storage.path(name), 'rb') as stored:
+            content = stored.read()
+
+        status = 200
+        start, end = 0, len(content) - 1
+        byte_range = re.match(r'^bytes=(\d*)-(\d*)$', request.META.get('HTTP_RANGE', ''))
+        if byte_range and any(byte_range.groups()):
+            first, last = byte_range.groups()
+            if first == '':
+                # The last `last` bytes
+                start = max(0, len(content) - int(last))
+            else:
+                start = int(first)
+                if last != '':
+                    end = min(int(last), end)
+            if start > end:
+                response = HttpResponse(status=416)
+                response['Content-Range'] = 'bytes */{0}'.format(len(content))
+                return response
+            status = 206
+
+        response = HttpResponse(content[start:end + 1],
+                                status=status,
+                                content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response['Content-Length'] = str(end + 1 - start)
+        response['Accept-Ranges'] = 'bytes'
+        if status == 206:
+            response['Content-Range'] = 'bytes {0}-{1}/{2}'.format(start, end, len(content))
+        if default_storage.is_gzipped(name):
+            response['Content-Encoding'] = 'gzip'
+        return response
+
+# Status
+
+class DatabasePoolStats(APIView):
+    """Connection pool counters of the process serving the request, by database alias"""
+    permission_classes = (MLWorkerOnlyPermission,)
+
+    def get(self, request):
+        return Response(data=pool.all_stats())
+
+class Metrics(APIView):
+    """Queue, request and connection pool metrics in the Prometheus text format.
+
+    Queue depths are read from the database at most every
+    METRICS_QUEUE_CACHE_SECONDS. Event counts and latencies are added up over
+    every gunicorn worker on the host, those it has recycled included, from
+    the files each writes to METRICS_DIR.
+    """
+    permission_classes = (MLWorkerOnlyPermission,)
+
+    def get(self, request):
+        return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+class SlowestProfiles(APIView):
+    """The slowest profiled requests of the process serving the request, with their SQL.
+
+    Empty unless profiling is enabled, see ProfilingMiddleware. DELETE clears them.
+    """
+    permission_classes = (MLWorkerOnlyPermission,)
+
+    def get(self, request):
+        return Response(data=profiling.slowest.profiles())
+
+    def delete(self, request):
+        profiling.slowest.clear()
+        return Response(status=204)
@@ -1,9 +1,172 @@
+import io
+import time
+import gzip
+import base64
+import binascii
+import hashlib
+import mimetypes
+import posixpath
+
+from django.core import signing
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
 from storages.backends.s3boto import S3BotoStorage
 
+NOTEBOOK_CONTENT_TYPE = 'application/x-ipynb+json'
+GZIP_MAGIC = b'\x1f\x8b'
+
+mimetypes.add_type(NOTEBOOK_CONTENT_TYPE, '.ipynb')
+
+
+def content_md5_header(md5):
+    """Content-MD5 header value, the base64 digest, for a hex `md5`"""
+    return base64.b64encode(binascii.unhexlify(md5)).decode('ascii')
+
+
+def gzip_bytes(data):
+    # A fixed mtime keeps the output, and so its MD5, the same for the same input.
+    buffer = io.BytesIO()
+    with gzip.GzipFile(mode='wb', compresslevel=6, fileobj=buffer, mtime=0) as gzip_file:
+        gzip_file.write(data)
+    return buffer.getvalue()
+
+
+class ContentAddressedStorageMixin(object):
+    """Storage mixin saving files under the SHA-256 of their content.
+
+    `save('notebooks/classifier_1.ipynb', content)` stores the content as
+    `notebooks/<sha256>.ipynb` and returns that name, and saving the same
+    content again stores nothing more. Files are never modified in place,
+    so one can be shared by any number of records.
+
+    Uploads are addressed by the MD5 of their gzipped bytes instead, which
+    storage checks on the way in, see `upload_url`.
+    """
+
+    def content_addressed_name(self, name, digest):
+        directory, filename = posixpath.split(name)
+        return posixpath.join(directory, digest + posixpath.splitext(filename)[1])
+
+    def save(self, name, content, max_length=None):
+        if not hasattr(content, 'chunks'):
+            content = File(content)
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        name = self.content_addressed_name(name, digest.hexdigest())
+        if self.exists(name):
+            return name
+        # Type files by their name, not by whatever an upload claimed
+        content_type = mimetypes.guess_type(name)[0]
+        if content_type is not None:
+            content.content_type = content_type
+        return super(ContentAddressedStorageMixin, self).save(name, content, max_length)
+
 
 class StaticStorage(S3BotoStorage):
     location = 'static'
 
 
-class MediaStorage(S3BotoStorage):
+class MediaStorage(ContentAddressedStorageMixin, S3BotoStorage):
+    """Media on S3, gzipped with Content-Encoding: gzip where it compresses well.
+
+    S3 serves the compressed bytes with their Content-Length and supports
+    range requests on them, and clients decompress transparently.
+    """
     location = 'media'
+    gzip = True
+    gzip_content_types = S3BotoStorage.gzip_content_types + (NOTEBOOK_CONTENT_TYPE,)
+
+    def _key_name(self, name):
+        return self._encode_name(self._normalize_name(self._clean_name(name)))
+
+    def upload_url(self, name, content_type, md5, expires_in):
+        """Presigned URL to PUT gzipped content to `name` directly for the next `expires_in` seconds.
+
+        The upload has to send the given Content-Type, Content-Encoding: gzip
+        and a Content-MD5 header for `md5`, and S3 rejects a body with a
+        different digest.
+        """
+        return self.connection.generate_url(expires_in, 'PUT', self.bucket_name, self._key_name(name),
+                                            headers={'Content-Type': content_type,
+                                                     'Content-Encoding': 'gzip',
+                                                     'Content-MD5': content_md5_header(md5)})
+
+    def uploaded_digest(self, name):
+        """(size, hex md5) of the bytes stored at `name`, None if there are none"""
+        key = self.bucket.get_key(self._key_name(name))
+        if key is None:
+            return None
+        # The ETag of an object PUT in a single request is its MD5.
+        return key.size, key.etag.strip('"')
+
+    def save_gzipped(self, name, body, content_type):
+        """Store already gzipped `body` at `name` as an upload to `upload_url` would"""
+        key = self.bucket.new_key(self._key_name(name))
+        key.set_contents_from_string(body, headers={'Content-Type': content_type, 'Content-Encoding': 'gzip'})
+
+
+class LocalMediaStorage(ContentAddressedStorageMixin, FileSystemStorage):
+    """Media stored gzipped under MEDIA_ROOT, behaving like MediaStorage.
+
+    Files read back decompressed. Upload URLs point at `/media-uploads/<token>`
+    on this server, which stands in for S3 in development and tests. The
+    token is signed and carries the name, headers and expiry of the upload.
+    """
+    upload_salt = 'cognoma_site.custom_storages.LocalMediaStorage'
+
+    def _save(self, name, content):
+        return super(LocalMediaStorage, self)._save(name, ContentFile(gzip_bytes(content.read())))
+
+    def _open(self, name, mode='rb'):
+        stored = super(LocalMediaStorage, self)._open(name, mode)
+        if not self.is_gzipped(name):
+            # Saved before media was compressed
+            return stored
+        return File(gzip.GzipFile(fileobj=stored, mode='rb'), name=name)
+
+    def upload_url(self, name, content_type, md5, expires_in):
+        token = signing.dumps({
+            'name': name,
+            'content_type': content_type,
+            'md5': md5,
+            'expires_at': time.time() + expires_in
+        }, salt=self.upload_salt)
+        return '/media-uploads/' + token
+
+    def receive_upload(self, token, content_type, content_md5, body):
+        """Store a PUT to an upload URL. Returns an S3 style error code, None if stored."""
+        try:
+            upload = signing.loads(token, salt=self.upload_salt)
+        except signing.BadSignature:
+            return 'SignatureDoesNotMatch'
+        if time.time() > upload['expires_at']:
+            return 'AccessDenied'
+        if content_type != upload['content_type'] or content_md5 != content_md5_header(upload['md5']):
+            return 'SignatureDoesNotMatch'
+        if hashlib.md5(body).hexdigest() != upload['md5']:
+            return 'BadDigest'
+
+        self.save_gzipped(upload['name'], body, content_type)
+        return None
+
+    def save_gzipped(self, name, body, content_type):
+        # Replaces the file as is, where save() would compress and rename it.
+        self.delete(name)
+        FileSystemStorage._save(self, name, ContentFile(body))
+
+    def uploaded_digest(self, name):
+        if not self.exists(name):
+            return None
+        md5 = hashlib.md5()
+        with open(self.path(name), 'rb') as uploaded:
+            for chunk in iter(lambda: uploaded.read(64 * 1024), b''):
+                md5.update(chunk)
+        return self.size(name), md5.hexdigest()
+
+    def is_gzipped(self, name):
+        with open(self.path(name), 'rb') as stored:
+            return stored.read(len(GZIP_MAGIC)) == GZIP_MAGIC
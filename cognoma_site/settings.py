@@ -12,6 +12,7 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 
 import os
 import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -81,6 +82,8 @@ SWAGGER_SETTINGS = {
 }
 
 MIDDLEWARE_CLASSES = [
+    'api.metrics.RequestMetricsMiddleware',
+    'api.profiling.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'cognoma_site.urls'
@@ -98,10 +101,77 @@ DATABASES = {
         'USER': os.getenv('DB_USER', 'postgres'),
         'PASSWORD': os.getenv('DB_PASSWORD', 'postgres'),
         'HOST': os.getenv('DB_HOST', 'core_db'),
-        'PORT': os.getenv('DB_PORT', '5432')
+        'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', '0'))
     }
 }
 
+# Connections are pooled per process when DB_POOL_SIZE is more than 0,
+# which stays opt-in until a load test shows it helps. A request waits
+# DB_POOL_TIMEOUT seconds for a free connection before failing, and a long
+# poll holds its connection for up to a minute, so set it to at least the
+# number of requests each eventlet worker serves at once.
+GUNICORN_WORKER_CONNECTIONS = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '10'))
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '0'))
+if DB_POOL_SIZE > 0:
+    DATABASES['default']['ENGINE'] = 'api.pooled_postgresql'
+    DATABASES['default']['POOL'] = {
+        'MAX_SIZE': DB_POOL_SIZE,
+        'TIMEOUT': float(os.getenv('DB_POOL_TIMEOUT', '10')),
+        'MAX_AGE': float(os.getenv('DB_POOL_MAX_AGE', '1800')),
+        'HEALTH_CHECK_INTERVAL': float(os.getenv('DB_POOL_HEALTH_CHECK_INTERVAL', '30'))
+    }
+
+# Cache
+
+# Responses of the dataset endpoints are cached until the next loaddata,
+# with RESPONSE_CACHE=locmem in each process's memory or with
+# RESPONSE_CACHE=file on disk under RESPONSE_CACHE_PATH, shared by every
+# process on the host.
+RESPONSE_CACHE = os.getenv('RESPONSE_CACHE', 'locmem')
+RESPONSE_CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'responses'
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('RESPONSE_CACHE_PATH', '/tmp/cognoma-responses')
+    }
+}
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+    },
+    'responses': dict(RESPONSE_CACHE_BACKENDS[RESPONSE_CACHE],
+                      TIMEOUT=int(os.getenv('RESPONSE_CACHE_TIMEOUT', str(60 * 60 * 24))),
+                      OPTIONS={'MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '10000'))})
+}
+
+# How long clients and nginx may reuse a dataset response before revalidating its ETag
+DATASET_CACHE_MAX_AGE = int(os.getenv('DATASET_CACHE_MAX_AGE', '300'))
+
+# How long each process reuses the dataset version before reading it again.
+# Tests load datasets and expect the next request to see them.
+DATASET_VERSION_CACHE_SECONDS = float(os.getenv('DATASET_VERSION_CACHE_SECONDS', '0' if TESTING_MODE else '2'))
+
+# Where the in-memory indexes are saved for the workers on a host to share,
+# see api.versioned_index.VersionedIndex
+INDEX_DIR = os.getenv('INDEX_DIR', os.path.join(tempfile.gettempdir(), 'cognoma-indexes'))
+
+# How often each process counts the classifier queue for /metrics
+METRICS_QUEUE_CACHE_SECONDS = int(os.getenv('METRICS_QUEUE_CACHE_SECONDS', '15'))
+# Where each process writes its counters for /metrics to add up, and how
+# often at most as they change
+METRICS_DIR = os.getenv('METRICS_DIR', os.path.join(tempfile.gettempdir(), 'cognoma-metrics'))
+METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '1'))
+
+# Request profiling, see api.profiling.ProfilingMiddleware
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False') == 'True'
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_SLOWEST = int(os.getenv('PROFILING_SLOWEST', '50'))
+
 dev_pub_key = """
 -----BEGIN PUBLIC KEY-----
 MIIBIjANBgkqhkiG9w0BAQEFAAOCAQ8AMIIBCgKCAQEA5knVYXDKNZAZ36TAo2S2
@@ -152,6 +222,8 @@ AWS_S3_CUSTOM_DOMAIN = '{bucket_name}.s3.amazonaws.com'.format(bucket_name=AWS_S
 
 if DEBUG or TESTING_MODE:
     MEDIA_ROOT = 'files/media'
+    MEDIA_URL = '/media/'
+    DEFAULT_FILE_STORAGE = 'cognoma_site.custom_storages.LocalMediaStorage'
     STATIC_ROOT = 'files/static'
     STATIC_URL = '/static/'
 else:
@@ -11,16 +11,23 @@ urlpatterns = [
 
     url(r'^classifiers/?$', views.ClassifierCreate.as_view()),
     url(r'^classifiers/queue/?$', views.PullClassifierTaskQueue.as_view()),
+    url(r'^classifiers/complete/?$', views.BatchCompleteClassifierTasks.as_view()),
+    url(r'^classifiers/fail/?$', views.BatchFailClassifierTasks.as_view()),
+    url(r'^classifiers/release/?$', views.BatchReleaseClassifierTasks.as_view()),
     url(r'^classifiers/(?P<id>[0-9]+)$', views.RetrieveClassifier.as_view()),
     url(r'^classifiers/(?P<id>[0-9]+)/upload/?$', views.UploadCompletedNotebookToClassifier.as_view()),
+    url(r'^classifiers/(?P<id>[0-9]+)/notebook-upload/?$', views.NotebookUploadURL.as_view()),
+    url(r'^classifiers/(?P<id>[0-9]+)/notebook-upload/confirm/?$', views.ConfirmNotebookUpload.as_view()),
+    url(r'^classifiers/(?P<id>[0-9]+)/heartbeat/?$', views.ClassifierHeartbeat.as_view()),
     url(r'^classifiers/(?P<id>[0-9]+)/release/?$', views.ReleaseClassifierTask.as_view()),
     url(r'^classifiers/(?P<id>[0-9]+)/fail/?$', views.FailClassifierTask.as_view()),
 
     url(r'^users/?$', views.UserCreate.as_view()),
     url(r'^users/(?P<random_slug>.+)$', views.UserRetrieveUpdateFromSlug.as_view()),
 
-    # url(r'^genes/?$', views.GeneList.as_view()),
-    # url(r'^genes/(?P<entrez_gene_id>[0-9]+)$', views.GeneRetrieve.as_view()),
+    url(r'^genes/?$', views.GeneList.as_view()),
+    url(r'^genes/search/?$', views.GeneSearch.as_view()),
+    url(r'^genes/(?P<entrez_gene_id>[0-9]+)$', views.GeneRetrieve.as_view()),
 
     url(r'^diseases/?$', views.DiseaseList.as_view()),
     url(r'^diseases/(?P<acronym>[a-zA-Z]+)$', views.DiseaseRetrieve.as_view()),
@@ -29,5 +36,18 @@ urlpatterns = [
     # url(r'^mutations/(?P<id>[0-9]+)$', views.MutationRetrieve.as_view()),
 
     url(r'^samples/?$', views.SampleList.as_view()),
+    url(r'^samples/counts/?$', views.SampleCounts.as_view()),
+    url(r'^samples/export\.(?P<export_format>ndjson|csv)$', views.SampleExport.as_view()),
     url(r'^samples/(?P<sample_id>[A-Z0-9\-]+)$', views.SampleRetrieve.as_view()),
+
+    url(r'^status/database-pool/?$', views.DatabasePoolStats.as_view()),
+    url(r'^status/profiles/?$', views.SlowestProfiles.as_view()),
+    url(r'^metrics/?$', views.Metrics.as_view()),
 ] + static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
+
+if settings.DEBUG or settings.TESTING_MODE:
+    # Media is stored locally, see LocalMediaStorage
+    urlpatterns += [
+        url(r'^media-uploads/(?P<token>[^/]+)$', views.LocalMediaUpload.as_view()),
+        url(r'^media/(?P<name>.+)$', views.LocalMediaDownload.as_view()),
+    ]
@@ -1,4 +1,5 @@
 #!/bin/bash -x
 sleep 5
 python manage.py migrate -v3 --no-input
+python manage.py dispatchnotifications &
 python manage.py runserver 0.0.0.0:8000